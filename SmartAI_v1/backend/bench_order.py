@@ -0,0 +1,141 @@
+"""
+Benchmark of student-major against question-major grading order.
+
+Starts the fake LLM server (``backend.fake_llm``) in-process with its
+simulated prompt prefix cache, grades a synthetic cohort (``--students``
+students answering ``--questions`` questions of mixed types, each with its own
+long rubric) once per order on a fresh engine, and prints wall time, the
+share of prompt tokens served from the prefix cache and when the first and
+median students were finished::
+
+    python -m backend.bench_order --students 80 --questions 10 --concurrency 16
+
+The prefix cache holds ``--cache-blocks`` blocks of ``--block-chars``
+characters; keep it smaller than one student's worth of prompts to see
+student-major order evict every rubric before it is used again.
+"""
+import os
+# Measure the ordering, not our own response cache or the production rate limit
+os.environ.setdefault("LLM_CACHE_ENABLED", "0")
+os.environ.setdefault("LLM_RPM", "1000000")
+os.environ.setdefault("LLM_TPM", "1000000000")
+
+import time
+import random
+import socket
+import argparse
+import statistics
+import threading
+from typing import Dict, Any, List, Tuple
+
+from backend import fake_llm
+from backend.correct.engine import GradingEngine, TASK_ORDERS
+from backend.llm.runtime import run_sync
+from backend.llm.metrics import tag_calls, get_call_ledger
+from backend.dependencies import llm_registry
+
+TYPES = ["概念题", "计算题", "证明题", "编程题"]
+
+
+def make_cohort(students: int, questions: int, rubric_chars: int, seed: int = 0) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """A problem store and students whose answers all differ (nothing is deduplicated)."""
+    rng = random.Random(seed)
+    problem_store = {}
+    for q in range(questions):
+        q_id = f"q{q + 1}"
+        items = []
+        while sum(len(item) for item in items) < rubric_chars:
+            items.append(f"{len(items) + 1}. 第{q + 1}题评分要点{len(items) + 1}：" + "给出关键推导并说明理由，" * rng.randint(2, 6) + f"得{rng.randint(1, 3)}分。")
+        problem_store[q_id] = {"q_id": q_id, "number": str(q + 1), "type": TYPES[q % len(TYPES)],
+                               "stem": f"第{q + 1}题", "criterion": "\n".join(items)}
+    cohort = []
+    for s in range(students):
+        stu_id = f"PB{20000000 + s}"
+        cohort.append({"stu_id": stu_id, "stu_name": f"学生{s}", "stu_ans": [
+            {"q_id": q_id, "number": problem["number"], "type": problem["type"],
+             "content": f"{stu_id} 的解答：" + "由题设可得结论，" * rng.randint(5, 40), "flag": []}
+            for q_id, problem in problem_store.items()
+        ]})
+    return problem_store, cohort
+
+
+def start_fake_server() -> str:
+    """Run the fake LLM server on a free local port; returns its base URL."""
+    import uvicorn
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(fake_llm.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def run_order(order: str, problem_store: Dict[str, Any], cohort: List[Dict[str, Any]], llm, concurrency: int) -> Dict[str, Any]:
+    """Grade the cohort in ``order`` with a cold prefix cache and a fresh engine."""
+    fake_llm.prefix_cache.blocks.clear()
+    before = dict(fake_llm.stats)
+    engine = GradingEngine(concurrency)
+    job_id = f"bench_order_{order}"
+    finished_at: List[float] = []
+    started = time.perf_counter()
+    try:
+        with tag_calls(job_id=job_id):
+            run_sync(engine.grade_students(
+                cohort, problem_store, llm, dedup=False, order=order,
+                on_student_done=lambda result: finished_at.append(time.perf_counter() - started)
+            ))
+        wall = time.perf_counter() - started
+    finally:
+        run_sync(engine.close())
+    prompt_tokens = fake_llm.stats["prompt_tokens"] - before["prompt_tokens"]
+    cached_tokens = fake_llm.stats["cached_tokens"] - before["cached_tokens"]
+    ledger = (get_call_ledger().summary(job_id) or {}).get("total", {})
+    return {
+        "order": order,
+        "wall": wall,
+        "requests": fake_llm.stats["requests"] - before["requests"],
+        "cached_share": cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+        "ledger_cached": ledger.get("cached_prompt_tokens", 0),
+        "first_student": min(finished_at) if finished_at else None,
+        "median_student": statistics.median(finished_at) if finished_at else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark student-major vs question-major grading order")
+    parser.add_argument("--students", type=int, default=80)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--rubric-chars", type=int, default=1500)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--cache-blocks", type=int, default=64)
+    parser.add_argument("--block-chars", type=int, default=256)
+    parser.add_argument("--discount", type=float, default=0.5)
+    args = parser.parse_args()
+
+    fake_llm.config.update({
+        "latency_ms": args.latency_ms, "jitter_ms": args.latency_ms / 5, "chars_per_second": 20000,
+        "error_rate": 0, "throttle_rate": 0, "malformed_rate": 0,
+        "prefix_cache_blocks": args.cache_blocks, "prefix_cache_block_chars": args.block_chars,
+        "prefix_cache_discount": args.discount,
+    })
+    from langchain_openai import ChatOpenAI
+    llm = ChatOpenAI(model="fake-llm", base_url=start_fake_server(), api_key="fake", temperature=0,
+                     http_client=llm_registry.http_client, http_async_client=llm_registry.http_async_client)
+    problem_store, cohort = make_cohort(args.students, args.questions, args.rubric_chars)
+
+    rows = [run_order(order, problem_store, cohort, llm, args.concurrency) for order in TASK_ORDERS]
+
+    print(f"{args.students} students x {args.questions} questions, {args.concurrency} workers, "
+          f"prefix cache {args.cache_blocks} x {args.block_chars} chars, latency {args.latency_ms:.0f} ms")
+    print(f"{'order':<10} {'requests':>9} {'wall s':>8} {'cached prompt':>14} {'ledger cached':>14} "
+          f"{'first student s':>16} {'median student s':>17}")
+    for row in rows:
+        print(f"{row['order']:<10} {row['requests']:>9} {row['wall']:>8.2f} {row['cached_share']:>14.1%} "
+              f"{row['ledger_cached']:>14,} {row['first_student']:>16.2f} {row['median_student']:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark of serving a finished grade result.
+
+Builds a synthetic finished batch job (``--students`` students with
+``--questions`` Corrections each, steps and comments included) and compares
+the per-request cost of the old path, FastAPI's ``jsonable_encoder`` plus
+``json.dumps`` of the live ``Correction`` objects, with the pre-serialized
+bodies of :class:`~backend.jobs.results.ResultStore`, and prints payload
+sizes of each content coding::
+
+    python -m backend.bench_results --students 500 --questions 10
+"""
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from typing import Dict, Any, Callable
+
+from fastapi.encoders import jsonable_encoder
+
+from backend.models import Correction, StepScore
+from backend.jobs.results import ResultStore, dump_json
+
+
+def make_job(students: int, questions: int, seed: int = 0) -> Dict[str, Any]:
+    """A finished batch result shaped like ``run_batch_grading_task`` stores it."""
+    rng = random.Random(seed)
+    types = ["concept", "calculation", "proof", "programming"]
+    results = []
+    for s in range(students):
+        corrections = []
+        for q in range(questions):
+            steps = [
+                StepScore(step_no=i + 1, desc=f"第{i + 1}步：推导过程与结论检查 " + "说明" * rng.randint(5, 30),
+                          is_correct=rng.random() > 0.3, score=round(rng.uniform(0, 3), 1))
+                for i in range(rng.randint(2, 5))
+            ]
+            corrections.append(Correction(
+                q_id=f"q{q + 1}", type=types[q % len(types)], score=round(sum(step.score for step in steps), 1),
+                max_score=10, confidence=round(rng.uniform(0.5, 1), 2),
+                comment="整体思路正确，" + "部分步骤表述不够严谨，" * rng.randint(1, 8),
+                steps=steps, hits=[f"要点{i}" for i in range(rng.randint(0, 3))],
+                fingerprint=f"{rng.getrandbits(128):032x}",
+            ))
+        results.append({"student_id": f"PB{20000000 + s}", "corrections": corrections})
+    return {"status": "completed", "results": results, "llm_stats": None,
+            "dedup": {"answers": students * questions, "saved_calls": 0}}
+
+
+def timed(fn: Callable[[], Any], repeat: int) -> float:
+    """Median wall time of ``fn`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def fastapi_body(result: Dict[str, Any]) -> bytes:
+    # What returning the dict from an endpoint costs: JSONResponse.render(jsonable_encoder(result))
+    return json.dumps(jsonable_encoder(result), ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark grade-result serialization and compression")
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    result = make_job(args.students, args.questions)
+    store = ResultStore(spill_dir=tempfile.mkdtemp(prefix="bench_results_"))
+    job_id = "bench"
+
+    rows = []
+    body = fastapi_body(result)
+    rows.append(("jsonable_encoder + json.dumps (per request)", timed(lambda: fastapi_body(result), args.repeat), len(body)))
+    raw = dump_json(result)
+    rows.append(("orjson.dumps (per request)", timed(lambda: dump_json(result), args.repeat), len(raw)))
+
+    def store_result():
+        store[job_id] = result
+    rows.append(("ResultStore set: orjson + gzip (once per job)", timed(store_result, args.repeat),
+                 len(store.payload(job_id, "gzip")[0])))
+    rows.append(("served, identity", timed(lambda: store.payload(job_id, None), args.repeat),
+                 len(store.payload(job_id, None)[0])))
+    rows.append(("served, gzip", timed(lambda: store.payload(job_id, "gzip"), args.repeat),
+                 len(store.payload(job_id, "gzip")[0])))
+    store_result()
+    first_zstd = timed(lambda: store.payload(job_id, "zstd"), 1)
+    rows.append(("served, zstd (first request compresses)", first_zstd, len(store.payload(job_id, "zstd")[0])))
+    rows.append(("served, zstd", timed(lambda: store.payload(job_id, "zstd"), args.repeat),
+                 len(store.payload(job_id, "zstd")[0])))
+    rows.append(("304: ETag lookup", timed(lambda: store.etag(job_id), args.repeat), 0))
+
+    print(f"{args.students} students x {args.questions} questions, median of {args.repeat}")
+    print(f"{'path':<48} {'ms':>10} {'bytes':>12}")
+    for name, ms, size in rows:
+        print(f"{name:<48} {ms:>10.3f} {size:>12,}")
+
+
+if __name__ == "__main__":
+    main()
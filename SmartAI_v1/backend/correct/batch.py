@@ -0,0 +1,166 @@
+"""
+Multi-student batched grading for short concept/choice answers.
+
+For short answers the template, rubric and JSON format instructions dominate
+the prompt, so up to K answers to the same question are packed into one
+request that returns one result per student id. K adapts to answer length so
+a batch stays within the context budget; any item whose result is missing or
+invalid is regraded on its own by the caller.
+"""
+import os
+import structlog
+from typing import Dict, Any, List, Optional, Tuple
+
+from pydantic import BaseModel
+from langchain_core.messages import HumanMessage
+
+from backend.models import Correction, StepScore, GradingOutput
+from backend.correct.prompt_utils import prepare_concept_batch_prompt
+from backend.dependencies import get_llm, CONTEXT_WINDOW_THRESHOLD_CHARS
+from backend.llm.structured import astructured_llm, StructuredOutputError
+from backend.llm.metrics import get_call_ledger
+
+# Setup logger
+logger = structlog.get_logger()
+
+# Question types graded by the concept node, whose answers are usually short
+BATCHABLE_TYPES = {"概念题", "其他", "其它"}
+
+# Upper bound on answers per batched request
+GRADING_BATCH_SIZE = int(os.getenv("GRADING_BATCH_SIZE", "8"))
+# Budget for the student answers of one batch; the prompt must also fit CONTEXT_WINDOW_THRESHOLD_CHARS
+GRADING_BATCH_MAX_CHARS = int(os.getenv("GRADING_BATCH_MAX_CHARS", "6000"))
+# Characters reserved per item for its JSON result in the completion
+BATCH_RESULT_RESERVE_CHARS = 400
+
+TEMPLATE_PATH = "backend/prompts/concept_batch.txt"
+
+
+def batch_char_budget(prompt_overhead_chars: int = 0) -> int:
+    """Characters of student answers one batch may carry."""
+    return max(0, min(GRADING_BATCH_MAX_CHARS, CONTEXT_WINDOW_THRESHOLD_CHARS - prompt_overhead_chars))
+
+
+def plan_batches(items: List[Tuple[str, str]], max_size: int = GRADING_BATCH_SIZE,
+                 budget_chars: Optional[int] = None) -> Tuple[List[List[Tuple[str, str]]], List[Tuple[str, str]]]:
+    """
+    Greedily pack (item_id, answer text) pairs into batches.
+
+    A batch is closed when it reaches ``max_size`` items or the next answer
+    (plus its result reserve) would exceed the character budget, so K shrinks
+    automatically for long answers. Answers that would fill more than half the
+    budget on their own are not batched.
+
+    Args:
+        items: (item_id, answer text) pairs for one question
+        max_size: Maximum answers per batch (K)
+        budget_chars: Character budget per batch; defaults to :func:`batch_char_budget`
+
+    Returns:
+        Tuple: (batches with at least two items, items to grade individually)
+    """
+    budget = batch_char_budget() if budget_chars is None else budget_chars
+    batches: List[List[Tuple[str, str]]] = []
+    singles: List[Tuple[str, str]] = []
+    current: List[Tuple[str, str]] = []
+    used = 0
+
+    for item in items:
+        cost = len(item[1] or "") + BATCH_RESULT_RESERVE_CHARS
+        if max_size < 2 or cost > budget // 2:
+            singles.append(item)
+            continue
+        if current and (len(current) >= max_size or used + cost > budget):
+            batches.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += cost
+
+    if current:
+        batches.append(current)
+    # A batch of one saves nothing; grade it on the normal path
+    for batch in [b for b in batches if len(b) < 2]:
+        batches.remove(batch)
+        singles.extend(batch)
+    return batches, singles
+
+
+class ConceptBatchOutput(BaseModel):
+    """Top level of a batched grading answer; the items are validated one by one."""
+    results: List[Dict[str, Any]]
+
+
+def _correction_from_result(result: Dict[str, Any], q_id: str, max_score: float) -> Correction:
+    """Validate one batch result entry and convert it into a Correction."""
+    output = GradingOutput.model_validate(result)
+    step_scores = [
+        StepScore(
+            step_no=step.step_no if step.step_no is not None else i,
+            desc=step.desc or step.comment or f"步骤 {i}",
+            is_correct=step.is_correct if step.is_correct is not None else True,
+            score=step.score
+        )
+        for i, step in enumerate(output.steps, 1)
+    ]
+    response_max_score = output.max_score if output.max_score is not None else max_score
+    return Correction(
+        q_id=q_id,
+        type="概念题",
+        score=max(0.0, min(output.score, response_max_score)),
+        max_score=response_max_score,
+        confidence=max(0.0, min(output.confidence if output.confidence is not None else 0.8, 1.0)),
+        comment=output.comment or "",
+        steps=step_scores,
+        hits=output.hits or []
+    )
+
+
+async def agrade_concept_batch(q_id: str, items: List[Tuple[str, str]], rubric: str,
+                               max_score: float = 10.0, llm=None, stem: str = "") -> Dict[str, Optional[Correction]]:
+    """
+    Grade several answers to one concept question with a single LLM call.
+
+    Args:
+        q_id: The question id
+        items: (item_id, answer text) pairs; item ids are student ids
+        rubric: The grading rubric
+        max_score: The maximum score for this question
+        llm: Optional LLM client (defaults to the shared registry client)
+        stem: The question stem from the problem store
+
+    Returns:
+        Dict[str, Optional[Correction]]: Correction per item id, or None for
+        items that must be regraded individually
+    """
+    corrections: Dict[str, Optional[Correction]] = {item_id: None for item_id, _ in items}
+    keywords = [f"知识点{i}" for i in range(5)]  # Mock keywords, as in concept_node
+    prompt = prepare_concept_batch_prompt(
+        TEMPLATE_PATH, keywords, stem or "概念题",
+        [{"id": item_id, "answer": text or ""} for item_id, text in items],
+        rubric
+    )
+    if llm is None:
+        llm = get_llm()
+
+    try:
+        output = await astructured_llm(llm, [HumanMessage(content=prompt)], ConceptBatchOutput)
+    except StructuredOutputError as e:
+        logger.warning("concept_batch_unparseable", q_id=q_id, size=len(items), error=str(e))
+        return corrections
+    except Exception as e:
+        logger.warning("concept_batch_failed", q_id=q_id, size=len(items), error=str(e))
+        return corrections
+
+    for result in output.results:
+        item_id = str(result.get("id", ""))
+        if item_id not in corrections or corrections[item_id] is not None:
+            continue
+        try:
+            corrections[item_id] = _correction_from_result(result, q_id, max_score)
+        except Exception as e:
+            get_call_ledger().record_parse_failure()
+            logger.warning("concept_batch_item_invalid", q_id=q_id, item_id=item_id, error=str(e))
+
+    missing = sum(1 for c in corrections.values() if c is None)
+    logger.info("concept_batch_complete", q_id=q_id, size=len(items), fallbacks=missing)
+    return corrections
@@ -0,0 +1,132 @@
+"""
+Latency cost model for grading tasks and makespan estimates.
+
+A batch's wall time is set by its slowest tail, so the engine can queue the
+tasks it expects to take longest first (longest-processing-time-first, LPT)
+and report an ETA before grading starts. Each task's latency is estimated
+from its prompt length and question type: a per-type prior (fixed overhead
+plus seconds per prompt character) scaled by a moving average of how far
+the measured latencies of that type were from the prior.
+"""
+import os
+import heapq
+import threading
+import structlog
+from typing import Dict, Any, List, Optional, Tuple
+
+# Setup logger
+logger = structlog.get_logger()
+
+# Weight of the newest measurement in the per-type correction factor
+GRADING_COST_ALPHA = float(os.getenv("GRADING_COST_ALPHA", "0.2"))
+
+# Prior latency per correction node: (fixed seconds, seconds per prompt character).
+# Proofs and programs get longer step-by-step completions than concept answers.
+COST_PRIORS: Dict[str, Tuple[float, float]] = {
+    "concept": (2.0, 0.0010),
+    "concept_batch": (3.0, 0.0015),
+    "calculation": (3.0, 0.0015),
+    "proof": (4.0, 0.0025),
+    "programming": (4.0, 0.0030),
+}
+# Bounds of the correction factor, so a burst of cache hits or one stalled call cannot skew it for good
+MIN_SCALE, MAX_SCALE = 0.05, 20.0
+
+
+def prompt_chars(answer: Dict[str, Any], problem: Optional[Dict[str, Any]]) -> int:
+    """Characters an answer contributes to its prompt: answer text, stem and rubric."""
+    problem = problem or {}
+    return len(answer.get("content") or "") + len(problem.get("stem") or "") + len(problem.get("criterion") or "")
+
+
+class TaskCostModel:
+    """
+    Estimates the LLM latency of a grading task and learns from measured ones.
+
+    Args:
+        alpha: Weight of the newest measurement in the moving average
+    """
+
+    def __init__(self, alpha: float = GRADING_COST_ALPHA):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        # Measured / prior latency per node type, and the number of measurements behind it
+        self._scale: Dict[str, float] = {}
+        self._samples: Dict[str, int] = {}
+
+    @staticmethod
+    def prior(node: str, chars: int) -> float:
+        base, per_char = COST_PRIORS.get(node, COST_PRIORS["concept"])
+        return base + per_char * max(0, chars)
+
+    def estimate(self, node: str, chars: int) -> float:
+        """Expected seconds of one task of ``node`` type with ``chars`` prompt characters."""
+        with self._lock:
+            scale = self._scale.get(node, 1.0)
+        return self.prior(node, chars) * scale
+
+    def observe(self, node: str, chars: int, seconds: float) -> None:
+        """Fold a measured task latency into the correction factor of its node type."""
+        prior = self.prior(node, chars)
+        if prior <= 0 or seconds < 0:
+            return
+        ratio = min(MAX_SCALE, max(MIN_SCALE, seconds / prior))
+        with self._lock:
+            current = self._scale.get(node)
+            self._scale[node] = ratio if current is None else current + self.alpha * (ratio - current)
+            self._samples[node] = self._samples.get(node, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Current correction factor and measurement count per node type."""
+        with self._lock:
+            return {node: {"scale": round(scale, 4), "samples": self._samples.get(node, 0)}
+                    for node, scale in self._scale.items()}
+
+
+def list_schedule(costs: List[float], workers: int) -> float:
+    """
+    Makespan of running ``costs`` in the given order on ``workers`` parallel workers.
+
+    Every task goes to the worker that becomes free first, as on the grading
+    work queue.
+    """
+    if not costs:
+        return 0.0
+    free_at = [0.0] * max(1, min(workers, len(costs)))
+    for cost in costs:
+        heapq.heapreplace(free_at, free_at[0] + cost)
+    return max(free_at)
+
+
+def schedule_estimate(costs: List[float], workers: int, order: str,
+                      deadline_seconds: Optional[float] = None) -> Dict[str, Any]:
+    """
+    ETA of a job whose tasks (estimated ``costs``, in queue order) share ``workers``.
+
+    The ETA never exceeds the deadline: calls still running then are aborted
+    (see :func:`backend.llm.retry.job_deadline`), so ``meets_deadline`` tells
+    whether every answer is expected to be graded by then.
+    """
+    makespan = list_schedule(costs, workers)
+    lower_bound = max(sum(costs) / max(1, workers), max(costs, default=0.0))
+    eta = makespan if deadline_seconds is None else min(makespan, max(0.0, deadline_seconds))
+    return {
+        "order": order,
+        "tasks": len(costs),
+        "workers": workers,
+        "work_seconds": round(sum(costs), 1),
+        "makespan_seconds": round(makespan, 1),
+        "lower_bound_seconds": round(lower_bound, 1),
+        "deadline_seconds": round(deadline_seconds, 1) if deadline_seconds is not None else None,
+        "eta_seconds": round(eta, 1),
+        "meets_deadline": deadline_seconds is None or makespan <= deadline_seconds,
+    }
+
+
+# Model shared by every engine in the process
+cost_model = TaskCostModel()
+
+
+def get_cost_model() -> TaskCostModel:
+    """Return the process-wide grading task cost model."""
+    return cost_model
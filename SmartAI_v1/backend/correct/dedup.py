@@ -0,0 +1,151 @@
+"""
+Within-job deduplication of identical answers.
+
+Many students submit the same answer to a question (choice questions in
+particular). Answers are normalized and grouped by (q_id, type, rubric,
+normalized content); each group is graded once and its Correction is fanned
+out to every student in the group.
+
+The hash of the same key is the answer's fingerprint. Corrections carry it,
+so a later regrade can reuse every Correction whose question, rubric and
+answer did not change (see :func:`reusable_corrections`).
+"""
+import re
+import json
+import hashlib
+import unicodedata
+from typing import Dict, Any, List, Tuple, Iterable, Optional, Set
+
+# Punctuation that NFKC leaves as full-width CJK forms
+CJK_PUNCTUATION = str.maketrans({
+    "。": ".",
+    "“": '"',
+    "”": '"',
+    "‘": "'",
+    "’": "'",
+    "【": "[",
+    "】": "]",
+    "《": "<",
+    "》": ">",
+})
+
+# LaTeX explicit spacing commands that do not change the meaning of a formula
+LATEX_SPACING = re.compile(r'\\(?:qquad|quad|[,;:!> ])')
+MATH_SEGMENT = re.compile(r'(\$\$.*?\$\$|\$.*?\$|\\\(.*?\\\)|\\\[.*?\\\])', re.DOTALL)
+# Whitespace inside math is insignificant unless it separates two letters (e.g. "\alpha x")
+MATH_WHITESPACE = re.compile(r'(?<![A-Za-z])\s+|\s+(?![A-Za-z])')
+WHITESPACE = re.compile(r'\s+')
+
+
+def _normalize_math(segment: str) -> str:
+    segment = WHITESPACE.sub(" ", LATEX_SPACING.sub(" ", segment))
+    return MATH_WHITESPACE.sub("", segment)
+
+
+def normalize_answer(text: str) -> str:
+    """
+    Normalize an answer so that trivially different spellings compare equal.
+
+    Full-width characters and CJK punctuation are folded to ASCII, LaTeX
+    spacing commands and insignificant whitespace inside formulas are removed,
+    and all other whitespace runs collapse to a single space.
+
+    Args:
+        text: The raw answer content
+
+    Returns:
+        str: The normalized content
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).translate(CJK_PUNCTUATION)
+    parts = MATH_SEGMENT.split(text)
+    normalized = []
+    for i, part in enumerate(parts):
+        # re.split with one capturing group puts the math segments at odd indices
+        normalized.append(_normalize_math(part) if i % 2 else WHITESPACE.sub(" ", part))
+    return "".join(normalized).strip()
+
+
+def dedup_key(answer: Dict[str, Any], problem_store: Dict[str, Any]) -> Tuple[str, str, str, str]:
+    """Return the grouping key (q_id, type, rubric, normalized content) of an answer."""
+    q_id = answer.get("q_id")
+    problem = problem_store.get(q_id) or {}
+    return (
+        q_id,
+        answer.get("type") or "",
+        problem.get("criterion", ""),
+        normalize_answer(answer.get("content") or ""),
+    )
+
+
+def answer_fingerprint(key: Tuple[str, ...]) -> str:
+    """Stable hash of the (q_id, type, rubric, normalized content) part of a dedup key."""
+    return hashlib.sha256(json.dumps(list(key[:4]), ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+
+
+def reusable_corrections(results: Iterable[Dict[str, Any]], wanted: Optional[Set[str]] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Collect the Corrections of an earlier job that a regrade may reuse.
+
+    Corrections without a fingerprint (graded before fingerprints existed) and
+    failed ones (zero confidence, e.g. LLM errors) are left out, so they are
+    graded again.
+
+    Args:
+        results: ``{"student_id", "corrections"}`` results of the earlier job
+        wanted: Only keep these fingerprints (those of the answers about to be graded)
+
+    Returns:
+        Dict[str, Dict[str, Any]]: Correction data per fingerprint
+    """
+    reusable: Dict[str, Dict[str, Any]] = {}
+    for result in results:
+        for correction in result.get("corrections", []):
+            if hasattr(correction, "model_dump"):
+                correction = correction.model_dump()
+            fingerprint = correction.get("fingerprint")
+            if not fingerprint or not correction.get("confidence") or (wanted is not None and fingerprint not in wanted):
+                continue
+            reusable.setdefault(fingerprint, correction)
+    return reusable
+
+
+class AnswerGroup:
+    """Answers that share one dedup key; ``answer`` is the one sent to the LLM."""
+
+    __slots__ = ("key", "answer", "members")
+
+    def __init__(self, key: Tuple[str, str, str, str], answer: Dict[str, Any]):
+        self.key = key
+        self.answer = answer
+        # (student_id, index of the answer in that student's stu_ans)
+        self.members: List[Tuple[str, int]] = []
+
+
+def group_answers(students: List[Dict[str, Any]], problem_store: Dict[str, Any], merge: bool = True) -> List[AnswerGroup]:
+    """
+    Group all answers of a batch by dedup key, in order of first appearance.
+
+    Args:
+        students: Student entries from the student store (entries without stu_id are skipped)
+        problem_store: The problem store keyed by q_id
+        merge: If False, every answer gets its own group (deduplication off)
+
+    Returns:
+        List[AnswerGroup]: One group per distinct (q_id, type, rubric, normalized answer)
+    """
+    groups: Dict[Tuple[str, str, str, str], AnswerGroup] = {}
+    for student in students:
+        student_id = student.get("stu_id")
+        if not student_id:
+            continue
+        for position, answer in enumerate(student.get("stu_ans", [])):
+            key = dedup_key(answer, problem_store)
+            if not merge:
+                key = key + (student_id, position)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = AnswerGroup(key, answer)
+            group.members.append((student_id, position))
+    return list(groups.values())
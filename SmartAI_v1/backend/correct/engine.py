@@ -0,0 +1,483 @@
+"""
+Asynchronous grading engine.
+
+Drives every correction node through ``ainvoke`` on the shared runtime loop
+(see ``backend.llm.runtime``). A batch is flattened into one task per answer
+group (or batched prompt) on a single work queue with a fixed number of
+workers (see ``backend.correct.scheduler``), and the corrections are
+reassembled per student as they complete.
+
+Tasks are queued student-major by default (each student's answers together,
+so students finish one after another). Question-major order queues every
+answer to one question before the next question, so consecutive prompts share
+the template, problem and rubric prefix and provider prompt caches stay warm.
+Durable jobs are graded one claim (``GRADING_WORKER_CLAIM`` students) at a
+time, so there a question wave spans the students of one claim, not the job.
+Longest-first order queues the tasks the cost model (``backend.correct.cost``)
+expects to take longest first, so long proofs and programs do not start last
+and stretch the batch's tail. Every planned job gets an ETA from the same
+estimates, bounded by its deadline.
+"""
+import os
+import time
+import asyncio
+import structlog
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+from backend.models import Correction
+from backend.correct.calc import acalc_node
+from backend.correct.concept import aconcept_node
+from backend.correct.proof import aproof_node
+from backend.correct.programming import aprogramming_node
+from backend.correct.dedup import AnswerGroup, group_answers, answer_fingerprint, dedup_key
+from backend.correct.batch import BATCHABLE_TYPES, GRADING_BATCH_SIZE, plan_batches, agrade_concept_batch
+from backend.correct.scheduler import GRADING_CONCURRENCY, GradingWorkQueue
+from backend.correct.cost import TaskCostModel, get_cost_model, prompt_chars, schedule_estimate
+from backend.llm.metrics import tag_calls
+from backend.llm.retry import remaining_time
+
+# Setup logger
+logger = structlog.get_logger()
+
+# Order grading tasks are queued in: "student" (student-major), "question" (question-major waves)
+# or "longest" (longest estimated task first)
+GRADING_TASK_ORDER = os.getenv("GRADING_TASK_ORDER", "student")
+TASK_ORDERS = ("student", "question", "longest")
+
+# Map Chinese question types to internal English types for processing
+TYPE_MAPPING = {
+    "概念题": "concept",
+    "其他": "concept",
+    "其它": "concept",
+    "计算题": "calculation",
+    "证明题": "proof",
+    "推理题": "proof", # 推理题和证明题可以使用相同的处理节点
+    "编程题": "programming"
+}
+
+# Cache for processed rubrics to avoid redundant processing
+@lru_cache(maxsize=128)
+def get_processed_rubric(q_id: str, rubric_text: str) -> str:
+    """Cache processed rubrics to avoid redundant processing."""
+    # In a real implementation, this could do more complex processing
+    # For now, we just return the rubric as-is but cache it
+    return rubric_text
+
+
+def error_correction(q_id: str, answer_type: Optional[str], comment: str, max_score: float = 10.0) -> Correction:
+    """Build the zero-score Correction used when an answer cannot be graded."""
+    return Correction(
+        q_id=q_id,
+        type=answer_type or "概念题",
+        score=0.0,
+        max_score=max_score,
+        confidence=0.0,
+        comment=comment,
+        steps=[]
+    )
+
+
+class GradingEngine:
+    """Grades answers on one event loop through a single work queue with a fixed number of workers."""
+
+    def __init__(self, concurrency: int = GRADING_CONCURRENCY, cost_model: Optional[TaskCostModel] = None):
+        self.concurrency = max(1, concurrency)
+        self.queue = GradingWorkQueue(self.concurrency)
+        self.cost_model = cost_model or get_cost_model()
+
+    async def close(self) -> None:
+        """Stop the workers of the engine's work queue."""
+        await self.queue.close()
+
+    async def _run_node(self, internal_type: str, answer_unit: Dict[str, Any], answer_type: Optional[str],
+                        rubric: str, max_score: float, llm, chars: int = 0) -> Correction:
+        """Run the correction node of ``internal_type`` and feed its latency to the cost model."""
+        started = time.monotonic()
+        correction = await self._dispatch_node(internal_type, answer_unit, answer_type, rubric, max_score, llm)
+        self.cost_model.observe(internal_type, chars, time.monotonic() - started)
+        return correction
+
+    async def _dispatch_node(self, internal_type: str, answer_unit: Dict[str, Any], answer_type: Optional[str],
+                             rubric: str, max_score: float, llm) -> Correction:
+        """Run the correction node of ``internal_type`` on one answer unit."""
+        q_id = answer_unit["q_id"]
+        content = answer_unit["text"]
+        # Tag the node's LLM calls for per-question cost and latency accounting
+        with tag_calls(q_id=q_id, type=answer_type, node=internal_type):
+            if internal_type == "calculation":
+                # For calculation questions, we need to parse steps
+                answer_unit["steps"] = [{"step_no": 1, "content": content, "formula": ""}]
+                return await acalc_node(answer_unit, rubric, max_score, llm)
+
+            elif internal_type == "proof":
+                # For proof/reasoning questions, parse steps from content
+                answer_unit["steps"] = [{"step_no": 1, "content": content}]
+                return await aproof_node(answer_unit, rubric, max_score, llm)
+
+            elif internal_type == "programming":
+                answer_unit["code"] = content
+                answer_unit["language"] = "python"  # Default language
+                answer_unit["test_cases"] = []  # Empty test cases for now
+                return await aprogramming_node(answer_unit, rubric, max_score, llm)
+
+            else:
+                return await aconcept_node(answer_unit, rubric, max_score, llm)
+
+    async def grade_answer(self, answer: Dict[str, Any], problem_store: Dict[str, Any], llm=None) -> Correction:
+        """
+        Grade a single student answer with the node matching its question type.
+
+        Args:
+            answer: One entry of a student's ``stu_ans`` list
+            problem_store: The problem store keyed by q_id
+            llm: Optional LLM client passed through to the node
+
+        Returns:
+            Correction: The correction result (a zero-score Correction on error)
+        """
+        q_id = answer.get("q_id")
+        answer_type = answer.get("type")
+        content = answer.get("content")
+
+        # Get the problem rubric
+        problem = problem_store.get(q_id)
+        if not problem:
+            logger.warning("problem_not_found", q_id=q_id)
+            return error_correction(q_id, answer_type, f"Problem {q_id} not found")
+
+        # Use cached rubric processing
+        rubric = get_processed_rubric(q_id, problem.get("criterion", ""))
+        max_score = 10.0  # Default max score
+
+        # Prepare answer unit based on type; the stem and reference answer go into the shared prompt prefix
+        answer_unit = {
+            "q_id": q_id,
+            "text": content,
+            "stem": problem.get("stem") or "",
+            "reference_answer": problem.get("answer"),
+        }
+        internal_type = TYPE_MAPPING.get(answer_type, "concept")
+        chars = prompt_chars(answer, problem)
+
+        try:
+            # Queued as one task; runs once a worker is free
+            correction = await self.queue.run(
+                lambda: self._run_node(internal_type, answer_unit, answer_type, rubric, max_score, llm, chars)
+            )
+
+            # Ensure the type in the correction is the original Chinese type
+            if correction:
+                correction.type = answer_type
+                correction.fingerprint = answer_fingerprint(dedup_key(answer, problem_store))
+            return correction
+
+        except Exception as e:
+            logger.error("grade_answer_failed", q_id=q_id, error=str(e))
+            return error_correction(q_id, answer_type, f"Grading error: {str(e)}", max_score)
+
+    async def grade_student(self, student: Dict[str, Any], problem_store: Dict[str, Any], llm=None) -> Optional[Dict[str, Any]]:
+        """
+        Grade all answers of one student concurrently.
+
+        Args:
+            student: A student entry from the student store
+            problem_store: The problem store keyed by q_id
+            llm: Optional LLM client passed through to the nodes
+
+        Returns:
+            Optional[Dict[str, Any]]: ``{"student_id", "corrections"}``, or None without a stu_id
+        """
+        student_id = student.get("stu_id")
+        if not student_id:
+            return None
+
+        logger.info("grade_student_start", student_id=student_id)
+        student_answers = student.get("stu_ans", [])
+        outcomes = await asyncio.gather(
+            *(self.grade_answer(answer, problem_store, llm) for answer in student_answers),
+            return_exceptions=True
+        )
+
+        corrections = []
+        for answer, outcome in zip(student_answers, outcomes):
+            if isinstance(outcome, asyncio.CancelledError):
+                # The job was cancelled: no error corrections, the caller records the cancellation
+                raise outcome
+            if isinstance(outcome, BaseException):
+                q_id = answer.get("q_id", "unknown")
+                logger.error("grade_answer_crashed", student_id=student_id, q_id=q_id, error=str(outcome))
+                outcome = error_correction(q_id, answer.get("type"), f"Processing error: {str(outcome)}")
+            if outcome:
+                corrections.append(outcome)
+
+        logger.info("grade_student_complete", student_id=student_id)
+        return {
+            "student_id": student_id,
+            "corrections": corrections
+        }
+
+    async def grade_answer_batch(self, q_id: str, items: List[Tuple[str, Dict[str, Any]]],
+                                 problem_store: Dict[str, Any], llm=None,
+                                 stats: Optional[Dict[str, Any]] = None) -> Dict[str, Correction]:
+        """
+        Grade several answers to one concept question with one LLM call.
+
+        Items the batched call could not grade are regraded one by one.
+
+        Args:
+            q_id: The question id shared by all items
+            items: (item_id, answer) pairs
+            problem_store: The problem store keyed by q_id
+            llm: Optional LLM client passed through to the nodes
+            stats: Optional dict whose ``"fallbacks"`` counter is incremented
+
+        Returns:
+            Dict[str, Correction]: Correction per item id
+        """
+        problem = problem_store.get(q_id) or {}
+        rubric = get_processed_rubric(q_id, problem.get("criterion", ""))
+
+        chars = sum(prompt_chars(answer, None) for _, answer in items) + prompt_chars({}, problem)
+
+        async def _batch_call() -> Dict[str, Optional[Correction]]:
+            started = time.monotonic()
+            with tag_calls(q_id=q_id, type="概念题", node="concept_batch"):
+                corrections = await agrade_concept_batch(
+                    q_id, [(item_id, answer.get("content") or "") for item_id, answer in items], rubric, 10.0, llm,
+                    stem=problem.get("stem") or ""
+                )
+            self.cost_model.observe("concept_batch", chars, time.monotonic() - started)
+            return corrections
+
+        # The whole batched prompt is one queue task
+        corrections = await self.queue.run(_batch_call)
+
+        answers = dict(items)
+        fallback_ids = [item_id for item_id, correction in corrections.items() if correction is None]
+        if stats is not None:
+            stats["fallbacks"] = stats.get("fallbacks", 0) + len(fallback_ids)
+        if fallback_ids:
+            # Fallbacks are queued as tasks of their own once the batch task is done
+            fallbacks = await asyncio.gather(
+                *(self.grade_answer(answers[item_id], problem_store, llm) for item_id in fallback_ids)
+            )
+            corrections.update(zip(fallback_ids, fallbacks))
+        for item_id, correction in corrections.items():
+            correction.type = answers[item_id].get("type")
+        return corrections
+
+    def task_cost(self, answers: List[Dict[str, Any]], problem_store: Dict[str, Any]) -> float:
+        """Estimated seconds of the queue task grading ``answers`` (several only in a batched prompt)."""
+        problem = problem_store.get(answers[0].get("q_id"))
+        if len(answers) > 1:
+            chars = sum(prompt_chars(answer, None) for answer in answers) + prompt_chars({}, problem)
+            return self.cost_model.estimate("concept_batch", chars)
+        internal_type = TYPE_MAPPING.get(answers[0].get("type"), "concept")
+        return self.cost_model.estimate(internal_type, prompt_chars(answers[0], problem))
+
+    async def _grade_groups(self, groups: List[AnswerGroup], problem_store: Dict[str, Any], llm,
+                            batched: bool, batch_size: int, stats: Optional[Dict[str, Any]],
+                            on_done: Optional[Callable[[int, Any], None]] = None,
+                            order: str = GRADING_TASK_ORDER,
+                            on_planned: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Any]:
+        """
+        Grade every group once, batching short concept answers when requested.
+
+        ``on_done(index, outcome)`` is called as soon as each group's
+        Correction (or exception) is available. With ``order="question"`` the
+        tasks are queued question by question (in problem store order), with
+        ``order="longest"`` by decreasing estimated latency, instead of in
+        group order. ``on_planned`` receives the schedule estimate (see
+        :func:`backend.correct.cost.schedule_estimate`) before grading starts.
+        """
+        outcomes: List[Any] = [None] * len(groups)
+        batch_plan: List[Tuple[str, List[Tuple[str, int]]]] = []
+
+        if batched:
+            by_question: Dict[str, List[Tuple[str, int]]] = {}
+            for index, group in enumerate(groups):
+                q_id = group.key[0]
+                if group.answer.get("type") in BATCHABLE_TYPES and q_id in problem_store:
+                    items = by_question.setdefault(q_id, [])
+                    # Items are keyed by the student id of the group's first member
+                    item_id = group.members[0][0]
+                    if any(existing == item_id for existing, _ in items):
+                        item_id = f"{item_id}#{index}"
+                    items.append((item_id, index))
+            for q_id, items in by_question.items():
+                index_of = dict(items)
+                batches, _ = plan_batches(
+                    [(item_id, groups[index].answer.get("content") or "") for item_id, index in items], batch_size
+                )
+                for batch in batches:
+                    batch_plan.append((q_id, [(item_id, index_of[item_id]) for item_id, _ in batch]))
+
+        batch_stats: Dict[str, Any] = {"fallbacks": 0}
+        batched_indices = {index for _, batch in batch_plan for _, index in batch}
+        singles = [index for index in range(len(groups)) if index not in batched_indices]
+
+        def _finish(index: int, outcome: Any) -> None:
+            outcomes[index] = outcome
+            if on_done is not None:
+                on_done(index, outcome)
+
+        async def _single(index: int) -> None:
+            try:
+                outcome = await self.grade_answer(groups[index].answer, problem_store, llm)
+            except Exception as e:
+                outcome = e
+            _finish(index, outcome)
+
+        async def _batch(q_id: str, batch: List[Tuple[str, int]]) -> None:
+            try:
+                corrections = await self.grade_answer_batch(
+                    q_id, [(item_id, groups[index].answer) for item_id, index in batch], problem_store, llm, batch_stats
+                )
+            except Exception as e:
+                corrections = e
+            for item_id, index in batch:
+                _finish(index, corrections if isinstance(corrections, BaseException) else corrections.get(item_id))
+
+        # Every group and batch becomes one task on the shared queue, queued in submission order
+        units = [(index, self.task_cost([groups[index].answer], problem_store), _single(index)) for index in singles]
+        units += [(batch[0][1], self.task_cost([groups[index].answer for _, index in batch], problem_store),
+                   _batch(q_id, batch)) for q_id, batch in batch_plan]
+        if order == "question":
+            rank = {q_id: position for position, q_id in enumerate(problem_store)}
+            units.sort(key=lambda unit: (rank.get(groups[unit[0]].key[0], len(rank)), unit[0]))
+        elif order == "longest":
+            units.sort(key=lambda unit: (-unit[1], unit[0]))
+
+        schedule = schedule_estimate([cost for _, cost, _ in units], self.concurrency, order, remaining_time())
+        logger.info("grading_scheduled", **schedule)
+        if not schedule["meets_deadline"]:
+            logger.warning("grading_deadline_at_risk", makespan=schedule["makespan_seconds"],
+                           deadline=schedule["deadline_seconds"])
+        if on_planned is not None:
+            try:
+                on_planned(schedule)
+            except Exception as e:
+                logger.error("planned_callback_failed", error=str(e))
+        await asyncio.gather(*(unit for _, _, unit in units))
+
+        if stats is not None and batched:
+            batched_answers = len(batched_indices)
+            stats["batching"] = {
+                "batches": len(batch_plan),
+                "batched_answers": batched_answers,
+                "fallbacks": batch_stats["fallbacks"],
+                "saved_calls": batched_answers - len(batch_plan) - batch_stats["fallbacks"],
+            }
+        return outcomes
+
+    async def grade_students(self, students: List[Dict[str, Any]], problem_store: Dict[str, Any], llm=None,
+                             dedup: bool = True, batched: bool = False, batch_size: int = GRADING_BATCH_SIZE,
+                             stats: Optional[Dict[str, Any]] = None,
+                             on_student_done: Optional[Callable[[Dict[str, Any]], None]] = None,
+                             reuse: Optional[Dict[str, Dict[str, Any]]] = None,
+                             order: str = GRADING_TASK_ORDER,
+                             on_planned: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """
+        Grade many students; all their answers share the engine's concurrency limit.
+
+        With ``dedup`` enabled, identical (normalized) answers to the same
+        question and rubric are graded once and the Correction is copied to
+        every student who gave that answer. With ``batched`` enabled, short
+        concept answers to the same question are packed up to ``batch_size``
+        per LLM call. Corrections are reassembled per student as they
+        complete, and ``on_student_done`` receives each student's result as
+        soon as the last of its answers is graded. Every Correction carries the
+        fingerprint of its answer; answers whose fingerprint is in ``reuse``
+        get that Correction back without an LLM call. ``order`` picks
+        student-major, question-major or longest-first queueing (see the
+        module docstring), and ``on_planned`` receives the job's estimated
+        makespan and ETA once its tasks are queued.
+
+        Args:
+            students: Student entries from the student store
+            problem_store: The problem store keyed by q_id
+            llm: Optional LLM client passed through to the nodes
+            dedup: Whether to grade identical answers only once
+            batched: Whether to pack concept answers into multi-student prompts
+            batch_size: Maximum answers per batched prompt (K)
+            stats: Optional dict that receives ``"dedup"``/``"batching"``/``"reuse"`` summaries
+            on_student_done: Optional callback receiving ``{"student_id", "corrections"}``
+                per finished student
+            reuse: Optional Correction data per fingerprint from an earlier job
+                (see :func:`backend.correct.dedup.reusable_corrections`)
+            order: ``"student"``, ``"question"`` or ``"longest"`` (one of ``TASK_ORDERS``)
+            on_planned: Optional callback receiving the schedule estimate
+
+        Returns:
+            List[Dict[str, Any]]: One result per student that has a stu_id
+        """
+        students = [student for student in students if student.get("stu_id")]
+        groups = group_answers(students, problem_store, merge=dedup)
+        total_answers = sum(len(group.members) for group in groups)
+        logger.info("grading_planned", answers=total_answers, unique=len(groups), batched=batched, order=order)
+
+        # Fan each group's correction out to all of its members, keeping answer order
+        slots: Dict[str, List[Optional[Correction]]] = {
+            student["stu_id"]: [None] * len(student.get("stu_ans", [])) for student in students
+        }
+        pending = {student_id: len(corrections) for student_id, corrections in slots.items()}
+        results: Dict[str, Dict[str, Any]] = {}
+
+        def _student_done(student_id: str) -> None:
+            results[student_id] = {"student_id": student_id, "corrections": [c for c in slots[student_id] if c]}
+            if on_student_done is not None:
+                try:
+                    on_student_done(results[student_id])
+                except Exception as e:
+                    logger.error("student_callback_failed", student_id=student_id, error=str(e))
+
+        def _group_done(index: int, outcome: Any) -> None:
+            group = groups[index]
+            if isinstance(outcome, BaseException):
+                logger.error("grade_answer_crashed", q_id=group.key[0], error=str(outcome))
+                outcome = error_correction(group.key[0], group.answer.get("type"), f"Processing error: {str(outcome)}")
+            if outcome is not None:
+                outcome.fingerprint = fingerprints[index]
+            for i, (student_id, position) in enumerate(group.members):
+                slots[student_id][position] = outcome if i == 0 or outcome is None else outcome.model_copy(deep=True)
+                pending[student_id] -= 1
+                if pending[student_id] == 0:
+                    _student_done(student_id)
+
+        for student_id, count in pending.items():
+            if count == 0:
+                _student_done(student_id)
+
+        # Unchanged answers of a regrade take the earlier Correction; only the rest are graded
+        fingerprints = [answer_fingerprint(group.key) for group in groups]
+        reused = [index for index, fingerprint in enumerate(fingerprints) if reuse and fingerprint in reuse]
+        for index in reused:
+            correction = Correction.model_validate(reuse[fingerprints[index]])
+            correction.type = groups[index].answer.get("type") or correction.type
+            _group_done(index, correction)
+        to_grade = [index for index in range(len(groups)) if not (reuse and fingerprints[index] in reuse)]
+        await self._grade_groups([groups[index] for index in to_grade], problem_store, llm, batched, batch_size, stats,
+                                 on_done=lambda position, outcome: _group_done(to_grade[position], outcome),
+                                 order=order, on_planned=on_planned)
+
+        if stats is not None and reuse is not None:
+            reused_answers = sum(len(groups[index].members) for index in reused)
+            stats["reuse"] = {
+                "answers": total_answers,
+                "reused_answers": reused_answers,
+                "regraded_answers": total_answers - reused_answers,
+                "saved_calls": len(reused),
+            }
+
+        if stats is not None and dedup:
+            stats["dedup"] = {
+                "answers": total_answers,
+                "unique_answers": len(groups),
+                "saved_calls": total_answers - len(groups),
+            }
+        return [results[student_id] for student_id in slots]
+
+
+# Shared engine used by the API and by synchronous wrappers
+grading_engine = GradingEngine()
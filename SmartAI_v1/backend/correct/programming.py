@@ -2,37 +2,20 @@
 Programming question correction node implementation.
 """
 import structlog
-import re
-import os
 import json
 import argparse
-import subprocess
-import tempfile
 from typing import Dict, Any, List
 from pydantic import BaseModel
 
-from backend.models import Correction, StepScore
+from backend.models import Correction, StepScore, GradingOutput
 from backend.correct.prompt_utils import prepare_programming_prompt
 from backend.dependencies import get_llm
+from backend.llm.runtime import run_sync
+from backend.llm.structured import astructured_llm
 
 # Setup logger
 logger = structlog.get_logger()
 
-# Zhipu AI configuration
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "8dcdf3e9238f48f4ae329f638e66dfe2.HHIbfrj5M4GcjM8f")
-OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://open.bigmodel.cn/api/paas/v4")
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "glm-4")
-
-# Global LLM client for connection pooling
-LLM_CLIENT = None
-
-def get_llm_client():
-    """Get or create a shared LLM client for connection pooling."""
-    global LLM_CLIENT
-    if LLM_CLIENT is None:
-        LLM_CLIENT = get_llm()
-    return LLM_CLIENT
-
 class TestCase(BaseModel):
     """Model for a test case."""
     input: str
@@ -86,120 +69,12 @@ class AnswerUnit(BaseModel):
     code: str
     language: str
     test_cases: List[TestCase]
+    # Question stem from the problem store
+    stem: str = ""
 
-def parse_llm_json_response(response_text: str) -> Dict[str, Any]:
-    """
-    Parse LLM JSON response, handling common formatting issues.
-    
-    Args:
-        response_text: The raw response text from the LLM
-        
-    Returns:
-        Dict[str, Any]: Parsed JSON object
-    """
-    # Log the raw response for debugging
-    logger.info("parsing_llm_response", response_text=response_text[:500] + "..." if len(response_text) > 500 else response_text)
-    
-    # Use a more robust approach similar to what's in routers/new.py
-    # First try to find JSON objects in the response
-    import json
-    from pydantic import ValidationError
-    
-    # Match JSON objects or arrays
-    match = re.search(r'\{.*\}', response_text, re.DOTALL)
-    if not match:
-        match = re.search(r'\[.*\]', response_text, re.DOTALL)
-    
-    if match:
-        json_str = match.group(0)
-        try:
-            # Try to parse the JSON directly
-            return json.loads(json_str)
-        except json.JSONDecodeError as e:
-            # If direct parsing fails, try to fix common issues
-            try:
-                # Remove trailing commas before closing braces/brackets
-                json_str = re.sub(r',(\s*[}\]])', r'\1', json_str)
-                # Remove comments
-                json_str = re.sub(r'//.*?(?=\n|$)', '', json_str)
-                json_str = re.sub(r'/\*.*?\*/', '', json_str, flags=re.DOTALL)
-                # Try parsing again
-                return json.loads(json_str)
-            except json.JSONDecodeError:
-                pass
-    
-    # If all parsing attempts fail, create a fallback response
-    # Extract individual fields with more robust regex patterns
-    try:
-        llm_response = {}
-        
-        # Extract score with more flexible pattern matching
-        score_match = re.search(r'"score"\s*:\s*([0-9.]+)', response_text)
-        if score_match:
-            llm_response["score"] = float(score_match.group(1))
-        
-        # Extract max_score
-        max_score_match = re.search(r'"max_score"\s*:\s*([0-9.]+)', response_text)
-        if max_score_match:
-            llm_response["max_score"] = float(max_score_match.group(1))
-        else:
-            llm_response["max_score"] = 10.0
-        
-        # Extract confidence
-        confidence_match = re.search(r'"confidence"\s*:\s*([0-9.]+)', response_text)
-        if confidence_match:
-            llm_response["confidence"] = float(confidence_match.group(1))
-        else:
-            llm_response["confidence"] = 0.8
-        
-        # Extract comment (handle escaped quotes and truncated text)
-        comment_match = re.search(r'"comment"\s*:\s*"((?:[^"\\]|\\.)*)"', response_text)
-        if comment_match:
-            # Unescape the string
-            comment = comment_match.group(1).replace('\\"', '"').replace('\\\\', '\\')
-            llm_response["comment"] = comment
-        else:
-            # Try to extract comment with more flexible pattern
-            flexible_comment_match = re.search(r'"comment"\s*:\s*"([^"]*)"', response_text)
-            if flexible_comment_match:
-                llm_response["comment"] = flexible_comment_match.group(1)
-            else:
-                llm_response["comment"] = "AI评分完成"
-        
-        # Extract logs (handle escaped quotes)
-        logs_match = re.search(r'"logs"\s*:\s*"((?:[^"\\]|\\.)*)"', response_text)
-        if logs_match:
-            # Unescape the string
-            logs = logs_match.group(1).replace('\\"', '"').replace('\\\\', '\\')
-            llm_response["logs"] = logs
-        else:
-            llm_response["logs"] = ""
-        
-        # Initialize empty steps array
-        llm_response["steps"] = []
-        
-        logger.info("manual_json_parsing_success", parsed_keys=list(llm_response.keys()))
-        return llm_response
-    except Exception as e:
-        logger.warning("manual_json_parsing_failed", error=str(e))
-    
-    # Final fallback
-    llm_response = {
-        "score": 5.0,
-        "max_score": 10.0,
-        "confidence": 0.8,
-        "comment": "默认评分",
-        "steps": [],
-        "logs": ""
-    }
-    
-    logger.info("parse_llm_json_response_complete", response_type=type(llm_response).__name__, 
-                response_keys=list(llm_response.keys()) if isinstance(llm_response, dict) else "Not a dict")
-    return llm_response
-
-def programming_node(answer_unit: Dict[str, Any], rubric: str, max_score: float = 10.0, llm=None) -> Correction:
+async def aprogramming_node(answer_unit: Dict[str, Any], rubric: str, max_score: float = 10.0, llm=None) -> Correction:
     """
-    Programming question correction node.
+    Programming question correction node, driving the LLM through ``ainvoke``.
     
     Args:
         answer_unit: The answer unit containing the student's code
@@ -236,28 +111,10 @@ def programming_node(answer_unit: Dict[str, Any], rubric: str, max_score: float
     executor = CodeExecutor()
     result = executor.run(answer_unit_model.code, test_cases)
     
-    # Step 3: Calculate score based on pass rate
-    score = max_score * result.pass_rate
-    
-    # Step 4: Calculate confidence based on pass rate and coverage
-    confidence = 0.7 * result.pass_rate + 0.3 * result.coverage
-    
-    # Step 5: Create step score
-    steps = [
-        StepScore(
-            step_no=1,
-            desc=f"代码通过率: {result.pass_rate:.2%}, 覆盖率: {result.coverage:.2%}",
-            is_correct=result.passed,
-            score=score
-        )
-    ]
-    
-    # Step 6: Prepare prompt using the new prompt_utils module
+    # Step 3: Prepare prompt using the new prompt_utils module
     try:
         template_path = "backend/prompts/programming.txt"
-        # For now, we use a placeholder problem statement since we don't have the actual problem
-        # In a real implementation, you would get the problem from the problem store
-        problem = "编程题"
+        problem = answer_unit_model.stem or "编程题"
         test_cases = [{"input": "", "output": ""}]
         prompt = prepare_programming_prompt(template_path, problem, answer_unit_model.code, test_cases, rubric)
         
@@ -265,21 +122,16 @@ def programming_node(answer_unit: Dict[str, Any], rubric: str, max_score: float
         # For now, we'll just log that we would use it
         logger.info("programming_prompt_prepared", prompt=prompt[:100] + "..." if len(prompt) > 100 else prompt)
         
-        # Step 7: Call LLM with the prepared prompt using connection pooling
+        # Step 4: Call LLM with the prepared prompt using connection pooling
         try:
-            # Use provided LLM client or get shared LLM client for connection pooling
+            # Use provided LLM client or the pooled client from the shared registry
             if llm is None:
-                llm = get_llm_client()
+                llm = get_llm()
             from langchain.schema import HumanMessage
             
-            # Use invoke method instead of direct call to avoid deprecation warning
-            response = llm.invoke([HumanMessage(content=prompt)])
-            
-            # Log the raw response for debugging
-            logger.info("llm_raw_response", content=response.content[:500] + "..." if len(response.content) > 500 else response.content)
-            
-            # Parse the JSON response
-            llm_response = parse_llm_json_response(response.content)
+            # Provider-enforced JSON validated against the output schema; invalid output gets a bounded re-ask
+            output = await astructured_llm(llm, [HumanMessage(content=prompt)], GradingOutput)
+            llm_response = output.model_dump(exclude_none=True)
             
             # Create step scores from LLM response
             step_scores = []
@@ -298,7 +150,7 @@ def programming_node(answer_unit: Dict[str, Any], rubric: str, max_score: float
                         logger.warning("step_creation_failed", error=str(step_creation_error), step_data=step)
             
             # Calculate total score and confidence
-            total_score = llm_response.get("score", sum(step.score for step in step_scores) if step_scores else 5.0)
+            total_score = llm_response["score"]  # Required by GradingOutput
             overall_confidence = llm_response.get("confidence", 0.8)
             comment = llm_response.get("comment", f"代码通过率: {result.pass_rate:.2%}, 覆盖率: {result.coverage:.2%}")
             response_max_score = llm_response.get("max_score", max_score)  # Use AI response max_score if available
@@ -338,11 +190,18 @@ def programming_node(answer_unit: Dict[str, Any], rubric: str, max_score: float
             correction = Correction(
                 q_id=answer_unit_model.q_id,
                 type="编程题",
-                score=score,
+                score=0.0,  # The code executor is a mock: its pass rate is no score, the answer needs manual review
                 max_score=max_score,
-                confidence=confidence,
-                comment="LLM调用失败，使用默认评分",
-                steps=steps,
+                confidence=0.0,
+                comment="LLM调用失败或输出无效，需人工复核",
+                steps=[
+                    StepScore(
+                        step_no=1,
+                        desc="LLM调用失败或输出无效，需人工复核",
+                        is_correct=False,
+                        score=0.0
+                    )
+                ],
                 logs=result.logs
             )
             return correction
@@ -384,13 +243,14 @@ def programming_node(answer_unit: Dict[str, Any], rubric: str, max_score: float
         
         # Try to call LLM with default prompt
         try:
-            # Use provided LLM client or get shared LLM client for connection pooling
+            # Use provided LLM client or the pooled client from the shared registry
             if llm is None:
-                llm = get_llm_client()
+                llm = get_llm()
             from langchain.schema import HumanMessage
             
-            response = llm.invoke([HumanMessage(content=default_prompt)])
-            llm_response = parse_llm_json_response(response.content)
+            # Provider-enforced JSON validated against the output schema; invalid output gets a bounded re-ask
+            output = await astructured_llm(llm, [HumanMessage(content=default_prompt)], GradingOutput)
+            llm_response = output.model_dump(exclude_none=True)
             
             # Create step scores from LLM response
             step_scores = []
@@ -409,7 +269,7 @@ def programming_node(answer_unit: Dict[str, Any], rubric: str, max_score: float
                         logger.warning("step_creation_failed", error=str(step_creation_error), step_data=step)
             
             # Calculate total score and confidence
-            total_score = llm_response.get("score", sum(step.score for step in step_scores) if step_scores else 5.0)
+            total_score = llm_response["score"]  # Required by GradingOutput
             overall_confidence = llm_response.get("confidence", 0.8)
             comment = llm_response.get("comment", f"代码通过率: {result.pass_rate:.2%}, 覆盖率: {result.coverage:.2%}")
             response_max_score = llm_response.get("max_score", max_score)  # Use AI response max_score if available
@@ -437,11 +297,18 @@ def programming_node(answer_unit: Dict[str, Any], rubric: str, max_score: float
             correction = Correction(
                 q_id=answer_unit_model.q_id,
                 type="编程题",
-                score=score,
+                score=0.0,  # The code executor is a mock: its pass rate is no score, the answer needs manual review
                 max_score=max_score,
-                confidence=confidence,
-                comment="模板文件未找到，使用默认评分",
-                steps=steps,
+                confidence=0.0,
+                comment="LLM调用失败或输出无效，需人工复核",
+                steps=[
+                    StepScore(
+                        step_no=1,
+                        desc="LLM调用失败或输出无效，需人工复核",
+                        is_correct=False,
+                        score=0.0
+                    )
+                ],
                 logs=result.logs
             )
             return correction
@@ -451,15 +318,28 @@ def programming_node(answer_unit: Dict[str, Any], rubric: str, max_score: float
         correction = Correction(
             q_id=answer_unit_model.q_id,
             type="编程题",
-            score=score,
+            score=0.0,  # The code executor is a mock: its pass rate is no score, the answer needs manual review
             max_score=max_score,
-            confidence=confidence,
-            comment=f"提示准备失败: {str(e)}",
-            steps=steps,
+            confidence=0.0,
+            comment=f"提示准备失败，需人工复核: {str(e)}",
+            steps=[
+                StepScore(
+                    step_no=1,
+                    desc=f"提示准备失败，需人工复核: {str(e)}",
+                    is_correct=False,
+                    score=0.0
+                )
+            ],
             logs=result.logs
         )
         return correction
 
+def programming_node(answer_unit: Dict[str, Any], rubric: str, max_score: float = 10.0, llm=None) -> Correction:
+    """
+    Synchronous wrapper around :func:`aprogramming_node` for thread-based and CLI callers.
+    """
+    return run_sync(aprogramming_node(answer_unit, rubric, max_score, llm))
+
 def process_programming_from_files(input_file: str, rubric_file: str, output_file: str, max_score: float = 10.0):
     """
     Process a programming question from input files and write results to output file.
@@ -1,7 +1,14 @@
 """
 Utility functions for preparing prompts for AI grading.
+
+Templates are laid out prefix-first: instructions, output format, context,
+problem and rubric come first and the student's answer comes last, so every
+prompt for the same question shares one long identical prefix that provider
+prompt caches can reuse. Student content is substituted last, after every
+shared placeholder, so it can never be mistaken for one.
 """
 import os
+import json
 import structlog
 from typing import List, Dict, Any
 
@@ -49,8 +56,8 @@ def prepare_concept_prompt(template_path: str, context: List[str], problem: str,
     # Replace the placeholders carefully to avoid JSON format issues
     prompt = template.replace("{context}", context_str)
     prompt = prompt.replace("{problem}", problem)
-    prompt = prompt.replace("{answer}", answer)
     prompt = prompt.replace("{rubric}", rubric)
+    prompt = prompt.replace("{answer}", answer)
     
     return prompt
 
@@ -73,9 +80,9 @@ def prepare_calc_prompt(template_path: str, problem: str, student_answer: str, c
     
     # Format prompt
     prompt = template.replace("{problem}", problem)
-    prompt = prompt.replace("{answer}", student_answer)
     prompt = prompt.replace("{correct_answer}", str(correct_answer))
     prompt = prompt.replace("{rubric}", rubric)
+    prompt = prompt.replace("{answer}", student_answer)
     
     return prompt
 
@@ -96,8 +103,8 @@ def prepare_proof_prompt(template_path: str, steps: List[Dict[str, Any]], rubric
     
     # Format prompt
     steps_str = "\n".join([f"步骤{i+1}: {step['content']}" for i, step in enumerate(steps)])
-    prompt = template.replace("{steps}", steps_str)
-    prompt = prompt.replace("{rubric}", rubric)
+    prompt = template.replace("{rubric}", rubric)
+    prompt = prompt.replace("{steps}", steps_str)
     
     return prompt
 
@@ -121,8 +128,34 @@ def prepare_programming_prompt(template_path: str, problem: str, code: str, test
     # Format prompt
     test_cases_str = "\n".join([f"输入: {tc['input']}, 期望输出: {tc['output']}" for tc in test_cases])
     prompt = template.replace("{problem}", problem if problem else "未提供题目描述")
-    prompt = template.replace("{code}", code)
-    prompt = template.replace("{test_cases}", test_cases_str)
-    prompt = template.replace("{rubric}", rubric)
+    prompt = prompt.replace("{test_cases}", test_cases_str)
+    prompt = prompt.replace("{rubric}", rubric)
+    prompt = prompt.replace("{code}", code)
+    
+    return prompt
+
+def prepare_concept_batch_prompt(template_path: str, context: List[str], problem: str, answers: List[Dict[str, str]], rubric: str) -> str:
+    """
+    Prepare a prompt that grades several answers to the same concept question.
     
-    return prompt
\ No newline at end of file
+    Args:
+        template_path: Path to the prompt template file
+        context: List of relevant knowledge points
+        problem: The problem statement
+        answers: List of {"id": ..., "answer": ...} items
+        rubric: The grading rubric
+        
+    Returns:
+        str: The prepared prompt
+    """
+    template = load_prompt_template(template_path)
+    context_str = "\n".join(context)
+    answers_str = json.dumps(answers, ensure_ascii=False)
+    
+    # Replace the placeholders carefully to avoid JSON format issues
+    prompt = template.replace("{context}", context_str)
+    prompt = prompt.replace("{problem}", problem)
+    prompt = prompt.replace("{rubric}", rubric)
+    prompt = prompt.replace("{answers}", answers_str)
+    
+    return prompt
@@ -0,0 +1,293 @@
+"""
+Shared work queue for grading tasks.
+
+A batch is flattened into individual tasks (one per answer group, or one per
+batched prompt) served by a fixed number of worker tasks on the runtime loop.
+No student holds a pool of its own, so a student with many questions cannot
+keep workers idle while other students wait.
+
+Tasks are queued per job (see :func:`grading_job`). A free worker takes the
+oldest task of the highest priority class, so interactive single-student
+jobs run ahead of batch work. While other jobs have tasks waiting, a job
+gets at most ``GRADING_JOB_MAX_SHARE`` of the workers, so one large batch
+cannot starve the rest; alone it may use all of them. A cancelled job's queued
+tasks are dropped and its running tasks are cancelled. Queue depth, queue
+wait and worker utilization are tracked for the status endpoint.
+"""
+import os
+import math
+import time
+import asyncio
+import itertools
+import threading
+import contextvars
+import structlog
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Iterator, Tuple
+
+# Setup logger
+logger = structlog.get_logger()
+
+# Workers serving the grading queue, i.e. answers graded concurrently across all jobs
+GRADING_CONCURRENCY = int(os.getenv("GRADING_CONCURRENCY", "64"))
+# Share of the workers one job may hold while other jobs have tasks waiting
+GRADING_JOB_MAX_SHARE = float(os.getenv("GRADING_JOB_MAX_SHARE", "0.75"))
+
+# Priority classes (lower runs first)
+INTERACTIVE, BATCH = 0, 10
+PRIORITY_CLASSES = {"interactive": INTERACTIVE, "batch": BATCH}
+
+# (job_id, priority) of the grading job the current code works for
+_current_job: contextvars.ContextVar[Optional[Tuple[str, int]]] = contextvars.ContextVar(
+    "grading_job", default=None
+)
+
+
+@contextmanager
+def grading_job(job_id: str, priority: int = BATCH) -> Iterator[None]:
+    """Queue grading tasks submitted inside this block under ``job_id`` with ``priority``."""
+    token = _current_job.set((job_id, priority))
+    try:
+        yield
+    finally:
+        _current_job.reset(token)
+
+
+def _percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+
+
+class _JobLane:
+    """Queued and running tasks of one job."""
+
+    __slots__ = ("priority", "items", "running", "tasks")
+
+    def __init__(self, priority: int):
+        self.priority = priority
+        self.items: deque = deque()
+        self.running = 0
+        self.tasks: set = set()
+
+
+class GradingWorkQueue:
+    """
+    Per-job task lanes served by a fixed set of workers in priority order.
+
+    Tasks run in the context (job tags, deadline, cache bypass) of the code
+    that submitted them. Tasks submitted outside :func:`grading_job` run as
+    one anonymous interactive job without a cap. The workers are created
+    lazily on the loop that first submits work.
+
+    Args:
+        workers: Number of worker tasks
+        max_job_share: Share of the workers one job may hold while others wait
+    """
+
+    def __init__(self, workers: int = GRADING_CONCURRENCY, max_job_share: float = GRADING_JOB_MAX_SHARE):
+        self.workers = max(1, workers)
+        self.job_cap = max(1, math.ceil(self.workers * max_job_share))
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ready: Optional[asyncio.Condition] = None
+        self._lanes: Dict[str, _JobLane] = {}
+        self._seq = itertools.count()
+        self._worker_tasks: List[asyncio.Task] = []
+        # Counters are read by the status endpoint, and jobs cancelled, from other threads
+        self._lock = threading.Lock()
+        self._cancelled: deque = deque(maxlen=1000)
+        self._started_at: Optional[float] = None
+        self._busy: Dict[int, float] = {}
+        self._busy_seconds = 0.0
+        self._waits = deque(maxlen=1000)
+        self._counts = {"submitted": 0, "completed": 0, "failed": 0, "cancelled": 0}
+
+    def _ensure_started(self) -> asyncio.Condition:
+        if self._ready is None:
+            self._loop = asyncio.get_running_loop()
+            self._ready = asyncio.Condition()
+            self._started_at = time.monotonic()
+            self._worker_tasks = [asyncio.ensure_future(self._worker(i)) for i in range(self.workers)]
+            logger.info("grading_queue_started", workers=self.workers, job_cap=self.job_cap)
+        return self._ready
+
+    async def close(self) -> None:
+        """
+        Stop the workers and wait for them to finish; queued tasks are cancelled.
+
+        Call it on the loop the queue runs on. A later submission starts a new
+        set of workers.
+        """
+        tasks, self._worker_tasks = self._worker_tasks, []
+        for lane in self._lanes.values():
+            for _, _, _, future, _ in lane.items:
+                future.cancel()
+        self._lanes.clear()
+        self._ready = self._loop = None
+        # Workers of a loop that has already shut down were cancelled with it
+        tasks = [task for task in tasks if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if tasks:
+            logger.info("grading_queue_closed", workers=len(tasks))
+
+    def is_cancelled(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._cancelled
+
+    async def run(self, make_coro: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Queue a task and wait for its result.
+
+        Args:
+            make_coro: Factory of the coroutine to run once a worker is free
+
+        Returns:
+            Any: The coroutine's result (its exception is raised here)
+
+        Raises:
+            asyncio.CancelledError: If the task's job is or gets cancelled
+        """
+        job_id, priority = _current_job.get() or ("", INTERACTIVE)
+        if job_id and self.is_cancelled(job_id):
+            raise asyncio.CancelledError()
+        ready = self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes.get(job_id)
+        if lane is None:
+            lane = self._lanes[job_id] = _JobLane(priority)
+        lane.priority = min(lane.priority, priority)
+        lane.items.append((next(self._seq), make_coro, contextvars.copy_context(), future, time.monotonic()))
+        with self._lock:
+            self._counts["submitted"] += 1
+        async with ready:
+            ready.notify()
+        return await future
+
+    def _pick(self) -> Optional[Tuple[str, _JobLane]]:
+        """The lane whose head task runs next, preferring lanes under the per-job cap."""
+        best = None
+        for job_id, lane in self._lanes.items():
+            if not lane.items:
+                continue
+            capped = bool(job_id) and lane.running >= self.job_cap
+            rank = (capped, lane.priority, lane.items[0][0])
+            if best is None or rank < best[0]:
+                best = (rank, job_id, lane)
+        return (best[1], best[2]) if best is not None else None
+
+    async def _worker(self, index: int) -> None:
+        ready = self._ready
+        while True:
+            async with ready:
+                await ready.wait_for(lambda: any(lane.items for lane in self._lanes.values()))
+                job_id, lane = self._pick()
+                _, make_coro, context, future, enqueued_at = lane.items.popleft()
+                lane.running += 1
+
+            try:
+                if future.done():
+                    # The submitter stopped waiting while the task was queued
+                    with self._lock:
+                        self._counts["cancelled"] += 1
+                    continue
+                await self._execute(index, lane, make_coro, context, future, enqueued_at)
+            finally:
+                lane.running -= 1
+                if not lane.items and not lane.running and self._lanes.get(job_id) is lane:
+                    del self._lanes[job_id]
+                async with ready:
+                    # A capped job may have room again
+                    ready.notify()
+
+    async def _execute(self, index: int, lane: _JobLane, make_coro: Callable[[], Awaitable[Any]],
+                       context: contextvars.Context, future: asyncio.Future, enqueued_at: float) -> None:
+        started = time.monotonic()
+        with self._lock:
+            self._waits.append(started - enqueued_at)
+            self._busy[index] = started
+        # A new task in the submitter's context; it is cancelled if the submitter gives up
+        task = context.run(asyncio.ensure_future, make_coro())
+        lane.tasks.add(task)
+        future.add_done_callback(lambda f, t=task: t.cancel() if f.cancelled() else None)
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            # The queue is closing; the submitter must not wait forever
+            task.cancel()
+            future.cancel()
+            raise
+        finally:
+            lane.tasks.discard(task)
+            with self._lock:
+                self._busy_seconds += time.monotonic() - self._busy.pop(index, started)
+
+        if future.done():
+            counter = "cancelled"
+        elif task.cancelled():
+            future.cancel()
+            counter = "cancelled"
+        elif task.exception() is not None:
+            future.set_exception(task.exception())
+            counter = "failed"
+        else:
+            future.set_result(task.result())
+            counter = "completed"
+        with self._lock:
+            self._counts[counter] += 1
+
+    def cancel_job(self, job_id: str) -> None:
+        """
+        Drop the queued tasks of a job and cancel its running ones (safe from any thread).
+
+        Later submissions of the job are refused, so no new LLM calls are made for it.
+        """
+        with self._lock:
+            if job_id not in self._cancelled:
+                self._cancelled.append(job_id)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._cancel_lane, job_id)
+
+    def _cancel_lane(self, job_id: str) -> None:
+        lane = self._lanes.get(job_id)
+        if lane is None:
+            return
+        dropped = 0
+        while lane.items:
+            _, _, _, future, _ = lane.items.popleft()
+            if future.cancel():
+                dropped += 1
+        for task in list(lane.tasks):
+            task.cancel()
+        with self._lock:
+            self._counts["cancelled"] += dropped
+        logger.info("grading_job_cancelled", job_id=job_id, dropped=dropped, running=len(lane.tasks))
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Queue depth, busy workers, utilization, queue-wait percentiles and per-job lanes."""
+        now = time.monotonic()
+        with self._lock:
+            busy = len(self._busy)
+            busy_seconds = self._busy_seconds + sum(now - since for since in self._busy.values())
+            uptime = now - self._started_at if self._started_at is not None else 0.0
+            waits = list(self._waits)
+            counts = dict(self._counts)
+        lanes = list(self._lanes.items())
+        return dict(
+            counts,
+            workers=self.workers,
+            job_cap=self.job_cap,
+            busy_workers=busy,
+            queue_depth=sum(len(lane.items) for _, lane in lanes),
+            utilization=round(busy / self.workers, 4),
+            average_utilization=round(busy_seconds / (self.workers * uptime), 4) if uptime > 0 else None,
+            queue_wait_p50=_percentile(waits, 0.5),
+            queue_wait_p95=_percentile(waits, 0.95),
+            jobs={
+                job_id or "(anonymous)": {"priority": lane.priority, "queued": len(lane.items), "running": lane.running}
+                for job_id, lane in lanes
+            },
+        )
@@ -1,10 +1,11 @@
 # dependencies.py
 import os
 import logging
-from typing import Dict, List, Any, Type
-from pydantic import BaseModel, Field, ValidationError
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI # <-- 换成这行
+from typing import Dict, List, Any, Type, Optional
+from pydantic import BaseModel, Field
+from backend.llm.registry import LLMClientRegistry
+from backend.llm.router import LLMRouter, RoutedLLM, parse_routes
+from backend.llm.structured import parse_structured, StructuredOutputError
 
 # # 这是一个我们希望在不同路由间共享的 Python 变量
 # # 它可以是任何东西：一个数据库连接池、一个配置对象、一个AI模型实例等
@@ -118,121 +119,50 @@ OPENAI_MODEL = os.getenv("OPENAI_MODEL", "glm-4-plus")
 
 CONTEXT_WINDOW_THRESHOLD_CHARS = 200000 
 
-def get_llm(model="zhipu") -> ChatOpenAI:
-    """返回共享的LLM客户端实例。"""
-
-    if model == "zhipu":
-        if not OPENAI_API_KEY:
-            logger.error("环境变量 OPENAI_API_KEY 未设置，后端调用将失败！")
-
-        try:
-            client = ChatOpenAI(
-                api_key=OPENAI_API_KEY,
-                base_url=OPENAI_API_BASE,
-            )
-        except Exception as e:
-            logger.error(f"初始化OpenAI客户端失败: {e}")
-            client = None
-
-        # NOTE:zhipu ai直接复制这部分代码
-        zhipu_ai = ChatOpenAI(
-                    model=OPENAI_MODEL,
-                    temperature=0.0,
-                    api_key=OPENAI_API_KEY,
-                    base_url=OPENAI_API_BASE,
-                )
-
-        return zhipu_ai
-
-    elif model == "gemini":
-        if not GEMINI_API_KEY:
-            logger.error("API 密钥未设置，后端调用将失败！")
-
-        try:
-            # 核心改动在这里：
-            # 1. 类从 ChatOpenAI 变为 ChatGoogleGenerativeAI
-            # 2. 参数从 api_key, base_url 变为 model, google_api_key
-            gemini_client = ChatGoogleGenerativeAI(
-                model="gemini-pro",  # 或者 "gemini-pro"
-                temperature=0.0,
-                google_api_key=GEMINI_API_KEY,
-            )
-            logger.info("LangChain Gemini 客户端初始化成功！")
-            
-            # 你可以继续使用 gemini_client 这个变量，就像你之前使用 zhipu_ai 一样
-            # 例如: gemini_client.invoke("你好")
-
-        except Exception as e:
-            logger.error(f"初始化 LangChain Gemini 客户端失败: {e}")
-            gemini_client = None
-
-        return gemini_client
-
-import re
-import json
+# 所有 LLM 提供方的配置；客户端由注册表按 provider/model 复用，
+# 共享同一个带 keep-alive 的 HTTP 连接池
+LLM_PROVIDERS: Dict[str, Dict[str, Any]] = {
+    "zhipu": {
+        "kind": "openai",
+        "api_key": OPENAI_API_KEY,
+        "base_url": OPENAI_API_BASE,
+        "model": OPENAI_MODEL,
+    },
+    "gemini": {
+        "kind": "gemini",
+        "api_key": GEMINI_API_KEY,
+        "model": "gemini-pro",
+    },
+}
 
-def parse_llm_json_output(llm_output: str, output_model: Type[BaseModel]) -> BaseModel:
-    """
-    一个通用的、健壮的函数，用于从LLM的原始文本输出中提取JSON并使用Pydantic模型进行解析。
+# 额外的智谱 API Key（逗号分隔），每个 key 注册为一个 provider：zhipu_2, zhipu_3, ...
+for _i, _key in enumerate([k.strip() for k in os.getenv("ZHIPU_API_KEYS", "").split(",") if k.strip()], start=2):
+    LLM_PROVIDERS[f"zhipu_{_i}"] = dict(LLM_PROVIDERS["zhipu"], api_key=_key)
 
-    [最终修复版]：通过简单地将所有反斜杠加倍来修复所有类型的非法反斜杠转义错误，
-    这对于处理包含大量LaTeX等内容的字符串尤为稳健。
-    """
-    # 优先匹配大括号，其次匹配方括号，以处理JSON对象和JSON数组
-    match = re.search(r'\{.*\}', llm_output, re.DOTALL)
-    if not match:
-        match = re.search(r'\[.*\]', llm_output, re.DOTALL)
+llm_registry = LLMClientRegistry(LLM_PROVIDERS, default_provider="zhipu")
 
-    if not match:
-        raise ValueError(f"在LLM输出中未找到有效的JSON结构。原始输出: '{llm_output[:200]}...'")
+# 批改流量在各 provider 间按权重分配，例如 "zhipu:3,zhipu_2:3,gemini:1"；默认所有智谱 key 等权
+LLM_ROUTES = os.getenv("LLM_ROUTES") or ",".join(name for name in LLM_PROVIDERS if name.startswith("zhipu"))
+llm_router = LLMRouter(llm_registry, parse_routes(LLM_ROUTES))
+routed_llm = RoutedLLM(llm_router)
 
-    json_str = match.group(0)
+def get_llm(model: Optional[str] = None) -> Any:
+    """
+    返回共享的LLM客户端实例（进程内复用，不再每次请求新建）。
+    不指定 model 时返回路由客户端：按权重在多个 provider 间分配请求，出错过多的 provider 会被熔断。
+    """
+    if model is None:
+        return routed_llm
+    return llm_registry.get(model)
 
+def parse_llm_json_output(llm_output: str, output_model: Type[BaseModel]) -> BaseModel:
+    """
+    从LLM的原始文本输出中提取第一个JSON对象，并使用Pydantic模型进行校验。
+    新代码请直接使用 backend.llm.structured 中的 structured_llm / astructured_llm：
+    它们会要求模型以JSON格式输出，并在输出无效时有限次地重新询问。
+    """
     try:
-        # 第一次尝试直接解析
-        return output_model.model_validate_json(json_str)
-    # except ValidationError as e:
-    #     # 检查是否是由于JSON语法无效（特别是转义问题）导致的验证错误
-    #     # e.errors() 返回一个错误字典列表，我们检查第一个错误的类型
-    #     first_error = e.errors()[0] if e.errors() else {}
-    #     error_type = first_error.get('type')
-    #     # 精准定位到由 'invalid escape' 引起的 'json_invalid' 错误
-    #     if error_type == 'json_invalid' and "invalid escape" in str(e):
-    #         print("检测到Pydantic报告了JSON转义错误，尝试智能修复...")
-
-    except (ValidationError, json.JSONDecodeError) as e:
-        # 检查是否是由于非法转义引起的错误
-        # json.JSONDecodeError的错误信息通常包含 "Invalid \escape"
-        # Pydantic的ValidationError可能包装了底层的JSONDecodeError
-        if "invalid escape" in str(e).lower() or "invalid \\escape" in str(e).lower():
-            print("检测到JSON转义错误，尝试修复...")
-
-            # 放弃复杂的正则表达式，直接将所有反斜杠替换为转义后的反斜杠。
-            # 这能正确处理 \i, \g, 以及 \\ -> \\\\ 的情况。
-            json_str_fixed = json_str.replace('\\', '\\\\')
-            
-            try:
-                # 再次尝试解析修复后的字符串
-                print("修复成功，再次解析...")
-                return output_model.model_validate_json(json_str_fixed)
-            except Exception as final_e:
-                # 如果修复后仍然失败，则抛出信息更全的错误
-                logger.error(f"提取的字符串: {json_str}")
-                logger.error(f"修复后的字符串: {json_str_fixed}")
-                # 写入文件以供调试
-                with open("error_json.txt", "w", encoding="utf-8") as file:
-                    file.write(json_str)
-                with open("error_fixed_json.txt", "w", encoding="utf-8") as file:
-                    file.write(json_str_fixed)
-                raise ValueError(
-                    f"自动修复转义字符后解析仍然失败。\n"
-                    f"原始错误: {e}\n"
-                    f"最终错误: {final_e}"
-                )
-        else:
-            # 如果是其他类型的JSON错误，直接抛出
-            logger.error(f"提取的字符串：{json_str}，它不是一个有效的JSON。错误: {e}")
-            with open("error_json.txt", "w", encoding="utf-8") as file:
-                file.write(json_str)
-
-            raise ValueError(f"提取的字符串不是一个有效的JSON。错误: {e}")
+        return parse_structured(llm_output, output_model)
+    except StructuredOutputError as e:
+        logger.error(f"LLM输出无法解析为 {output_model.__name__}: {e}。原始输出: '{llm_output[:200]}...'")
+        raise
@@ -0,0 +1,360 @@
+"""
+Local stand-in for an OpenAI-compatible chat-completions server.
+
+Speaks the protocol ``ChatOpenAI`` uses (``POST /v1/chat/completions``,
+streaming and non-streaming, plus ``GET /v1/models``) and answers every
+backend prompt with schema-valid JSON: ``ProblemSet`` for problem
+extraction, ``StudentSubmission`` for answer segmentation, a ``results``
+array for batched concept grading and a Correction for every grading node.
+Latency, server-error, 429 and malformed-JSON rates are configurable, so the
+whole upload -> segment -> grade pipeline can be load-tested offline::
+
+    python -m backend.fake_llm --port 8001 --latency-ms 800 --throttle-rate 0.02
+    OPENAI_API_BASE=http://127.0.0.1:8001/v1 python -m uvicorn backend.main:app
+
+Answers are derived from a hash of the prompt, so the same prompt always gets
+the same answer (which keeps cache and dedup benchmarks meaningful).
+
+A provider-side prompt prefix cache can be simulated (``--prefix-cache-blocks``):
+prompts are hashed in blocks of ``--prefix-cache-block-chars`` characters, the
+longest run of leading blocks seen recently (LRU) is reported as
+``usage.prompt_tokens_details.cached_tokens`` and shortens the time to first
+token. A prompt's blocks are cached only once its prefill is done, so
+concurrent requests with the same prefix all miss, as on a real provider.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+import hashlib
+import argparse
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class FakeLLMConfig:
+    """Behaviour knobs of the fake server (defaults come from FAKE_LLM_* env vars)."""
+
+    def __init__(self):
+        # Mean time to first token and its uniform jitter, in milliseconds
+        self.latency_ms = float(os.getenv("FAKE_LLM_LATENCY_MS", "500"))
+        self.jitter_ms = float(os.getenv("FAKE_LLM_JITTER_MS", "200"))
+        # Output speed once the first token is out (streaming and non-streaming)
+        self.chars_per_second = float(os.getenv("FAKE_LLM_CHARS_PER_SECOND", "2000"))
+        self.error_rate = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+        self.throttle_rate = float(os.getenv("FAKE_LLM_THROTTLE_RATE", "0"))
+        self.malformed_rate = float(os.getenv("FAKE_LLM_MALFORMED_RATE", "0"))
+        self.seed = int(os.getenv("FAKE_LLM_SEED", "0"))
+        # Simulated prompt prefix cache: capacity in blocks (0 disables it) and block size in characters
+        self.prefix_cache_blocks = int(os.getenv("FAKE_LLM_PREFIX_CACHE_BLOCKS", "0"))
+        self.prefix_cache_block_chars = int(os.getenv("FAKE_LLM_PREFIX_CACHE_BLOCK_CHARS", "256"))
+        # Share of the time to first token saved for a fully cached prompt
+        self.prefix_cache_discount = float(os.getenv("FAKE_LLM_PREFIX_CACHE_DISCOUNT", "0.5"))
+
+    def update(self, values: Dict[str, Any]) -> None:
+        for key, value in values.items():
+            if hasattr(self, key):
+                setattr(self, key, type(getattr(self, key))(value))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+class PrefixCache:
+    """LRU of hashes of prompt prefixes, one entry per block of ``prefix_cache_block_chars`` characters."""
+
+    def __init__(self):
+        self.blocks: "OrderedDict[str, None]" = OrderedDict()
+
+    @staticmethod
+    def _hashes(prompt: str, block_chars: int) -> List[str]:
+        # Each block's hash covers the whole prefix up to its end
+        hashes, digest = [], ""
+        for start in range(0, len(prompt) - block_chars + 1, block_chars):
+            digest = hashlib.blake2b(f"{digest}{prompt[start:start + block_chars]}".encode("utf-8"),
+                                     digest_size=12).hexdigest()
+            hashes.append(digest)
+        return hashes
+
+    def lookup(self, prompt: str) -> int:
+        """Number of leading characters of ``prompt`` that are cached."""
+        if config.prefix_cache_blocks <= 0:
+            return 0
+        cached = 0
+        for digest in self._hashes(prompt, config.prefix_cache_block_chars):
+            if digest not in self.blocks:
+                break
+            self.blocks.move_to_end(digest)
+            cached += config.prefix_cache_block_chars
+        return cached
+
+    def insert(self, prompt: str) -> None:
+        if config.prefix_cache_blocks <= 0:
+            return
+        for digest in self._hashes(prompt, config.prefix_cache_block_chars):
+            self.blocks[digest] = None
+            self.blocks.move_to_end(digest)
+        while len(self.blocks) > config.prefix_cache_blocks:
+            self.blocks.popitem(last=False)
+
+
+config = FakeLLMConfig()
+prefix_cache = PrefixCache()
+stats = {"requests": 0, "streamed": 0, "json_mode": 0, "ok": 0, "errors": 0, "throttled": 0, "malformed": 0,
+         "prompt_tokens": 0, "cached_tokens": 0}
+
+app = FastAPI(title="Fake LLM")
+
+
+def _rng(prompt: str) -> random.Random:
+    digest = hashlib.sha256(f"{config.seed}:{prompt}".encode("utf-8")).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def _decode_after(text: str, marker: str, opener: str) -> Optional[Any]:
+    """Decode the first JSON value starting with ``opener`` after ``marker``."""
+    start = text.find(marker)
+    if start < 0:
+        return None
+    start = text.find(opener, start)
+    if start < 0:
+        return None
+    try:
+        return json.JSONDecoder().raw_decode(text[start:])[0]
+    except ValueError:
+        return None
+
+
+def _correction(rng: random.Random, max_score: float = 10.0) -> Dict[str, Any]:
+    steps = []
+    remaining = rng.uniform(0, max_score)
+    for step_no in range(1, rng.randint(1, 4) + 1):
+        score = round(remaining / 2, 1)
+        remaining -= score
+        steps.append({"step_no": step_no, "desc": f"步骤 {step_no}", "is_correct": score > 0.5, "score": score})
+    return {
+        "score": round(sum(step["score"] for step in steps), 1),
+        "max_score": max_score,
+        "confidence": round(rng.uniform(0.6, 0.99), 2),
+        "comment": rng.choice(["解答基本正确。", "思路正确，但计算有误。", "关键步骤缺失。", "完全正确。"]),
+        "steps": steps,
+        "hits": ["知识点0"],
+    }
+
+
+def _problem_set(text: str) -> Dict[str, Any]:
+    """Split the document on numbered lines ("1.", "2.3", "第二题", ...) into problems."""
+    blocks: List[List[str]] = []
+    for line in text.splitlines():
+        if re.match(r'\s*(\d+(\.\d+)*[.、)]|第.{1,3}题|[IVX]+\.)', line) or not blocks:
+            blocks.append([])
+        blocks[-1].append(line)
+    problems = []
+    for block in blocks:
+        stem = "\n".join(block).strip()
+        if not stem:
+            continue
+        i = len(problems) + 1
+        number = re.match(r'\s*([\w.]+)', stem)
+        problems.append({
+            "q_id": f"q{i}",
+            "number": number.group(1).rstrip(".") if number else str(i),
+            "type": "编程题" if "```" in stem else "计算题" if re.search(r'[=$]', stem) else "概念题",
+            "stem": stem,
+            "criterion": "满分10分，按步骤给分。",
+        })
+    return {"problems": problems}
+
+
+def _student_submission(text: str) -> Dict[str, Any]:
+    """Cut the student's text into one answer per problem of the embedded problem list."""
+    filename = re.search(r'【文件名】\**:?\s*\n\s*(.+)', text)
+    filename = filename.group(1).strip() if filename else ""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    stu_id = re.search(r'[A-Za-z]*\d{4,}', stem)
+    stu_name = re.search(r'[一-龥]{2,4}', stem)
+    problems = _decode_after(text, "【题目数据 (JSON)】", "[") or []
+    body = text.split("---", 1)[1].rsplit("---", 1)[0] if text.count("---") >= 2 else ""
+    chunks = [c.strip() for c in re.split(r'\n\s*\n', body) if c.strip()] or [""]
+
+    answers = []
+    for i, problem in enumerate(problems):
+        answers.append({
+            "q_id": problem.get("q_id", f"q{i + 1}"),
+            "number": str(problem.get("number", i + 1)),
+            "type": problem.get("type", "概念题"),
+            "content": chunks[i] if i < len(chunks) else "",
+            "flag": [] if i < len(chunks) else ["未找到作答"],
+        })
+    return {
+        "stu_id": stu_id.group(0) if stu_id else "",
+        "stu_name": stu_name.group(0) if stu_name else "",
+        "stu_ans": answers,
+    }
+
+
+def build_answer(messages: List[Dict[str, Any]]) -> str:
+    """Pick the output format from the prompt and build a schema-valid JSON answer."""
+    texts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        texts.append(content or "")
+    system = "\n".join(t for m, t in zip(messages, texts) if m.get("role") == "system")
+    user = "\n".join(t for m, t in zip(messages, texts) if m.get("role") != "system")
+    prompt = system + "\n" + user
+    rng = _rng(prompt)
+
+    if "【文件名】" in user:
+        answer = _student_submission(user)
+    elif '"problems"' in system:
+        answer = _problem_set(user)
+    elif '"results"' in prompt:
+        items = _decode_after(prompt, "学生解答列表", "[") or []
+        answer = {"results": [
+            dict(_correction(_rng(prompt + str(item.get("id")))), id=item.get("id")) for item in items if isinstance(item, dict)
+        ]}
+    else:
+        answer = _correction(rng)
+    return json.dumps(answer, ensure_ascii=False)
+
+
+def _error(status: int, message: str, kind: str) -> JSONResponse:
+    headers = {"retry-after": "1"} if status == 429 else None
+    return JSONResponse({"error": {"message": message, "type": kind, "code": status}}, status_code=status, headers=headers)
+
+
+@app.get("/v1/models")
+def list_models():
+    return {"object": "list", "data": [{"id": "fake-llm", "object": "model", "owned_by": "fake"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    if body.get("response_format"):
+        stats["json_mode"] += 1
+    roll = random.random()
+    prompt = "".join(str(m.get("content", "")) for m in body.get("messages", []))
+    cached_chars = prefix_cache.lookup(prompt)
+    latency_ms = max(0.0, config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms))
+    if prompt:
+        latency_ms *= 1 - config.prefix_cache_discount * cached_chars / len(prompt)
+    await asyncio.sleep(latency_ms / 1000)
+
+    if roll < config.throttle_rate:
+        stats["throttled"] += 1
+        return _error(429, "Rate limit reached for requests", "rate_limit_error")
+    if roll < config.throttle_rate + config.error_rate:
+        stats["errors"] += 1
+        return _error(500, "The server had an error while processing your request", "server_error")
+
+    prefix_cache.insert(prompt)
+    content = build_answer(body.get("messages", []))
+    if random.random() < config.malformed_rate:
+        stats["malformed"] += 1
+        # Cut the JSON in half, as a truncated or rambling completion would
+        content = "好的，以下是评分结果：" + content[:len(content) // 2]
+    else:
+        stats["ok"] += 1
+
+    model = body.get("model", "fake-llm")
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    prompt_tokens = len(prompt) // 2 + 1
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 2 + 1}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    usage["prompt_tokens_details"] = {"cached_tokens": cached_chars // 2}
+    stats["prompt_tokens"] += prompt_tokens
+    stats["cached_tokens"] += cached_chars // 2
+
+    if not body.get("stream"):
+        await asyncio.sleep(len(content) / config.chars_per_second)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    stats["streamed"] += 1
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    async def events():
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None, **extra) -> str:
+            payload = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra,
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        yield chunk({"role": "assistant", "content": ""})
+        step = 16
+        for i in range(0, len(content), step):
+            yield chunk({"content": content[i:i + step]})
+            await asyncio.sleep(step / config.chars_per_second)
+        yield chunk({}, "stop")
+        if include_usage:
+            usage_chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                           "model": model, "choices": [], "usage": usage}
+            yield f"data: {json.dumps(usage_chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/fake/config")
+def get_config():
+    return config.as_dict()
+
+
+@app.post("/fake/config")
+async def set_config(request: Request):
+    """Change latency/error rates of the running server, e.g. between benchmark phases."""
+    config.update(await request.json())
+    return config.as_dict()
+
+
+@app.get("/fake/stats")
+def get_stats():
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible fake LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=config.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=config.jitter_ms)
+    parser.add_argument("--chars-per-second", type=float, default=config.chars_per_second)
+    parser.add_argument("--error-rate", type=float, default=config.error_rate)
+    parser.add_argument("--throttle-rate", type=float, default=config.throttle_rate)
+    parser.add_argument("--malformed-rate", type=float, default=config.malformed_rate)
+    parser.add_argument("--seed", type=int, default=config.seed)
+    parser.add_argument("--prefix-cache-blocks", type=int, default=config.prefix_cache_blocks)
+    parser.add_argument("--prefix-cache-block-chars", type=int, default=config.prefix_cache_block_chars)
+    parser.add_argument("--prefix-cache-discount", type=float, default=config.prefix_cache_discount)
+    args = parser.parse_args()
+    config.update({key: value for key, value in vars(args).items() if key not in ("host", "port")})
+
+    import uvicorn
+    logger.info(f"Fake LLM 服务启动，监听 http://{args.host}:{args.port}/v1 配置: {config.as_dict()}")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
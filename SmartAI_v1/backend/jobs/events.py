@@ -0,0 +1,66 @@
+"""
+Change notifications for grading jobs.
+
+Workers call :meth:`JobEventHub.publish` whenever a job changes (a student
+finished, the job closed); the ``/ai_grading/events`` stream waits on
+:meth:`JobEventHub.wait` instead of re-reading the job store on a timer, so a
+completion reaches the browser immediately. Jobs graded by workers in other
+processes do not publish here; the stream still picks those changes up by
+re-reading the store every ``GRADING_EVENTS_POLL_SECONDS``.
+"""
+import os
+import asyncio
+import threading
+from typing import Dict, Set, Iterable, Tuple
+
+# Longest time an event stream goes without re-reading job state
+GRADING_EVENTS_POLL_SECONDS = float(os.getenv("GRADING_EVENTS_POLL_SECONDS", "2"))
+
+
+class JobEventHub:
+    """Wakes up async waiters (on any loop) when a job they watch changes; publishers may be any thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+
+    def publish(self, job_id: str) -> None:
+        """Signal that ``job_id`` changed."""
+        with self._lock:
+            waiters = list(self._waiters.get(job_id, ()))
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    async def wait(self, job_ids: Iterable[str], timeout: float = GRADING_EVENTS_POLL_SECONDS) -> bool:
+        """
+        Wait until one of ``job_ids`` changes or ``timeout`` passes.
+
+        Returns:
+            bool: True if woken by a change, False on timeout
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        job_ids = list(job_ids)
+        with self._lock:
+            for job_id in job_ids:
+                self._waiters.setdefault(job_id, set()).add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                for job_id in job_ids:
+                    waiters = self._waiters.get(job_id)
+                    if waiters is not None:
+                        waiters.discard(waiter)
+                        if not waiters:
+                            del self._waiters[job_id]
+
+
+job_events = JobEventHub()
+
+
+def get_job_events() -> JobEventHub:
+    """Return the process-wide job event hub."""
+    return job_events
@@ -0,0 +1,398 @@
+"""
+Bounded in-process store of grading results.
+
+Finished results (completed, failed or cancelled jobs) are serialized once
+with orjson and kept as gzip-compressed JSON instead of live ``Correction``
+objects, together with a content hash used as the HTTP ETag; a zstd variant is
+added the first time a client asks for one. The API serves these bytes as they
+are (see :meth:`ResultStore.payload`), so repeated reads of a finished job
+neither re-encode nor re-compress it.
+
+Memory is bounded: results not read for ``GRADING_RESULTS_TTL_SECONDS``, and
+the least recently read ones once ``GRADING_RESULTS_MAX_BYTES`` is exceeded,
+are written to ``GRADING_RESULTS_SPILL_DIR`` and dropped from memory. Reading a
+spilled result loads it back. A spilled result keeps a small status entry in
+the index until ``GRADING_RESULTS_MAX_INDEXED`` spilled jobs are indexed; older
+ones are then forgotten and found again by file name when read, so memory
+stays flat however many jobs have run.
+
+Results are decoded on every read, so callers get plain JSON data (corrections
+as dicts) and may modify it freely; a result must be complete when it is
+stored.
+"""
+import os
+import re
+import gzip
+import time
+import hashlib
+import threading
+import orjson
+import zstandard
+import structlog
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+
+# Setup logger
+logger = structlog.get_logger()
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Compressed bytes of finished results kept in memory; colder results are spilled to disk
+GRADING_RESULTS_MAX_BYTES = int(os.getenv("GRADING_RESULTS_MAX_BYTES", str(64 * 1024 * 1024)))
+# Finished results not read for this long are spilled to disk even within the budget
+GRADING_RESULTS_TTL_SECONDS = float(os.getenv("GRADING_RESULTS_TTL_SECONDS", "3600"))
+# Directory of spilled results
+GRADING_RESULTS_SPILL_DIR = os.getenv("GRADING_RESULTS_SPILL_DIR", os.path.join(BACKEND_DIR, "data", "results"))
+# Spilled jobs whose status entry stays in memory; older ones are only looked up on disk by job id
+GRADING_RESULTS_MAX_INDEXED = int(os.getenv("GRADING_RESULTS_MAX_INDEXED", "10000"))
+# Spilled results older than this are deleted when the store starts
+GRADING_RESULTS_SPILL_MAX_AGE_SECONDS = float(os.getenv("GRADING_RESULTS_SPILL_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+
+# Statuses after which a result no longer changes and is stored compactly
+FINAL_STATUSES = ("completed", "error", "cancelled")
+# Content codings a finished result can be served in, preferred first
+ENCODINGS = ("zstd", "gzip")
+# zstd level of the stored variant; it is compressed once per job, so a slower, smaller level pays off
+RESULT_ZSTD_LEVEL = 9
+
+_SAFE_JOB_ID = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+
+def _to_json(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump()
+    return str(value)
+
+
+def dump_json(data: Any) -> bytes:
+    """JSON bytes of ``data`` (``Correction`` objects become dicts)."""
+    return orjson.dumps(data, default=_to_json, option=orjson.OPT_NON_STR_KEYS)
+
+
+def make_etag(raw: bytes) -> str:
+    # Weak: the same JSON is served under several content codings
+    return f'W/"{hashlib.blake2b(raw, digest_size=12).hexdigest()}"'
+
+
+def encode_result(result: Dict[str, Any]) -> Tuple[bytes, int, str]:
+    """Compact form of a result (gzip-compressed JSON), its uncompressed size and its ETag."""
+    raw = dump_json(result)
+    return gzip.compress(raw, compresslevel=6, mtime=0), len(raw), make_etag(raw)
+
+
+def decode_result(blob: bytes) -> Dict[str, Any]:
+    return orjson.loads(gzip.decompress(blob))
+
+
+class _Entry:
+    """Index entry of one job; ``blob``/``live`` is None while the result is only on disk."""
+
+    __slots__ = ("status", "live", "blob", "zstd", "etag", "size", "raw_size", "last_access", "on_disk")
+
+    def __init__(self, status: str):
+        self.status = status
+        self.live: Optional[Dict[str, Any]] = None
+        self.blob: Optional[bytes] = None
+        self.zstd: Optional[bytes] = None
+        self.etag: Optional[str] = None
+        self.size = 0
+        self.raw_size = 0
+        self.last_access = time.monotonic()
+        self.on_disk = False
+
+    @property
+    def resident_bytes(self) -> int:
+        if self.blob is None:
+            return 0
+        return len(self.blob) + (len(self.zstd) if self.zstd is not None else 0)
+
+
+class ResultStore:
+    """
+    Dict-like map of job id to grading result with a memory budget.
+
+    Results of pending or running jobs are kept as given (they are small and
+    replaced when the job finishes); finished results are compressed,
+    accounted and evicted least recently used first.
+
+    Args:
+        max_bytes: Compressed bytes of finished results kept in memory
+        ttl_seconds: Idle time after which a finished result is spilled
+        spill_dir: Directory of spilled results
+        spill_max_age_seconds: Spilled results older than this are deleted on the first use
+        max_indexed: Spilled jobs kept in the index; older ones are dropped from it but stay readable
+    """
+
+    def __init__(self, max_bytes: int = GRADING_RESULTS_MAX_BYTES, ttl_seconds: float = GRADING_RESULTS_TTL_SECONDS,
+                 spill_dir: str = GRADING_RESULTS_SPILL_DIR,
+                 spill_max_age_seconds: float = GRADING_RESULTS_SPILL_MAX_AGE_SECONDS,
+                 max_indexed: int = GRADING_RESULTS_MAX_INDEXED):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self.spill_max_age_seconds = spill_max_age_seconds
+        self.max_indexed = max_indexed
+        self._lock = threading.Lock()
+        # Least recently read first
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._memory_bytes = 0
+        self._prepared = False
+        self._stats = {"hits": 0, "loads": 0, "spills": 0, "spill_errors": 0, "unindexed": 0}
+
+    def _path(self, job_id: str) -> Optional[str]:
+        # Job ids come from URLs; anything that is not a plain name never touches the disk
+        if not _SAFE_JOB_ID.match(job_id):
+            return None
+        return os.path.join(self.spill_dir, f"{job_id}.json.gz")
+
+    def _prepare(self) -> None:
+        """Create the spill directory and delete spilled results past their maximum age (once)."""
+        if self._prepared:
+            return
+        self._prepared = True
+        os.makedirs(self.spill_dir, exist_ok=True)
+        cutoff = time.time() - self.spill_max_age_seconds
+        removed = 0
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except OSError:
+                continue
+        if removed:
+            logger.info("result_store_pruned", removed=removed)
+
+    def __setitem__(self, job_id: str, result: Dict[str, Any]) -> None:
+        entry = _Entry(result.get("status", "unknown"))
+        if entry.status in FINAL_STATUSES:
+            entry.blob, entry.raw_size, entry.etag = encode_result(result)
+            entry.size = len(entry.blob)
+        else:
+            entry.live = result
+        with self._lock:
+            self._drop(job_id)
+            self._entries[job_id] = entry
+            self._memory_bytes += entry.resident_bytes
+            self._evict()
+
+    def _drop(self, job_id: str) -> Optional[_Entry]:
+        entry = self._entries.pop(job_id, None)
+        if entry is not None:
+            self._memory_bytes -= entry.resident_bytes
+        if entry is None or entry.on_disk:
+            # Unindexed jobs may still have a spilled result
+            path = self._path(job_id)
+            if path is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return entry
+
+    def _evict(self) -> None:
+        """
+        Spill idle results, then the least recently read ones until the budget
+        holds, then unindex the least recently read spilled jobs beyond
+        ``max_indexed`` (lock held).
+        """
+        now = time.monotonic()
+        resident = [job_id for job_id, entry in self._entries.items() if entry.blob is not None]
+        # The most recently read result always stays, even if it alone exceeds the budget
+        for job_id in resident[:-1]:
+            entry = self._entries[job_id]
+            if self._memory_bytes <= self.max_bytes and now - entry.last_access < self.ttl_seconds:
+                break
+            self._spill(job_id, entry)
+        if resident and now - self._entries[resident[-1]].last_access >= self.ttl_seconds:
+            self._spill(resident[-1], self._entries[resident[-1]])
+        spilled = [job_id for job_id, entry in self._entries.items()
+                   if entry.on_disk and entry.blob is None and entry.live is None]
+        for job_id in spilled[:max(0, len(spilled) - self.max_indexed)]:
+            # The file stays; _load finds it by job id and indexes the job again
+            del self._entries[job_id]
+            self._stats["unindexed"] += 1
+
+    def _spill(self, job_id: str, entry: _Entry) -> None:
+        path = self._path(job_id)
+        if not entry.on_disk:
+            if path is None:
+                return
+            try:
+                self._prepare()
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(entry.blob)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                # Kept in memory; the budget is exceeded rather than a result lost
+                self._stats["spill_errors"] += 1
+                logger.warning("result_store_spill_failed", job_id=job_id, error=str(e))
+                return
+            entry.on_disk = True
+        self._memory_bytes -= entry.resident_bytes
+        entry.blob = entry.zstd = None
+        self._stats["spills"] += 1
+
+    def _load(self, job_id: str) -> Optional[_Entry]:
+        """Entry of ``job_id`` with its result in memory, loading it from disk if needed (lock held)."""
+        entry = self._entries.get(job_id)
+        if entry is not None and (entry.live is not None or entry.blob is not None):
+            self._stats["hits"] += 1
+            return entry
+        path = self._path(job_id)
+        if path is None:
+            return None
+        if entry is None and not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                blob = f.read()
+        except OSError:
+            # Spilled by an earlier process and since deleted, or never written
+            return None
+        if entry is None:
+            # Spilled before a restart: index it again
+            raw = gzip.decompress(blob)
+            entry = _Entry(orjson.loads(raw).get("status", "unknown"))
+            entry.raw_size = len(raw)
+            entry.etag = make_etag(raw)
+            entry.on_disk = True
+            self._entries[job_id] = entry
+        entry.blob = blob
+        entry.size = len(blob)
+        self._memory_bytes += entry.resident_bytes
+        self._stats["loads"] += 1
+        return entry
+
+    def _touch(self, job_id: str) -> Optional[_Entry]:
+        """Load and mark ``job_id`` as just read, then enforce the budget (lock held)."""
+        entry = self._load(job_id)
+        if entry is not None:
+            entry.last_access = time.monotonic()
+            self._entries.move_to_end(job_id)
+            self._evict()
+        return entry
+
+    def get(self, job_id: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._touch(job_id)
+            if entry is None:
+                return default
+            live, blob = entry.live, entry.blob
+        if live is not None:
+            return live
+        return decode_result(blob)
+
+    def etag(self, job_id: str) -> Optional[str]:
+        """
+        ETag of a finished result (None for unknown or unfinished jobs), without
+        loading it unless the job was unindexed.
+        """
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry is None:
+                entry = self._touch(job_id)
+            return entry.etag if entry is not None else None
+
+    def payload(self, job_id: str, encoding: Optional[str] = None) -> Optional[Tuple[bytes, str]]:
+        """
+        The stored JSON of a finished result, ready to send.
+
+        Args:
+            job_id: The job
+            encoding: ``"zstd"``, ``"gzip"`` or None for uncompressed JSON
+
+        Returns:
+            Optional[Tuple[bytes, str]]: (body in ``encoding``, ETag), or None if the job is unknown or unfinished
+        """
+        with self._lock:
+            entry = self._touch(job_id)
+            if entry is None or entry.blob is None:
+                return None
+            blob, zstd, etag = entry.blob, entry.zstd, entry.etag
+        if encoding == "gzip":
+            return blob, etag
+        if encoding == "zstd" and zstd is not None:
+            return zstd, etag
+        raw = gzip.decompress(blob)
+        if encoding != "zstd":
+            return raw, etag
+        if zstd is None:
+            zstd = zstandard.ZstdCompressor(level=RESULT_ZSTD_LEVEL).compress(raw)
+            with self._lock:
+                # Kept beside the gzip form unless the result was spilled or replaced meanwhile
+                if self._entries.get(job_id) is entry and entry.blob is blob and entry.zstd is None:
+                    entry.zstd = zstd
+                    self._memory_bytes += len(zstd)
+                    self._evict()
+        return zstd, etag
+
+    def __getitem__(self, job_id: str) -> Dict[str, Any]:
+        result = self.get(job_id)
+        if result is None:
+            raise KeyError(job_id)
+        return result
+
+    def __contains__(self, job_id: object) -> bool:
+        with self._lock:
+            if job_id in self._entries:
+                return True
+        path = self._path(job_id) if isinstance(job_id, str) else None
+        return path is not None and os.path.exists(path)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def keys(self) -> List[str]:
+        """Indexed job ids (spilled jobs beyond ``max_indexed`` are not listed)."""
+        with self._lock:
+            return list(self._entries)
+
+    def pop(self, job_id: str, default: Any = None) -> Any:
+        result = self.get(job_id, default)
+        with self._lock:
+            self._drop(job_id)
+        return result
+
+    def statuses(self) -> Dict[str, str]:
+        """Status of every indexed job, without loading any result."""
+        with self._lock:
+            return {job_id: entry.status for job_id, entry in self._entries.items()}
+
+    def snapshot(self, limit: int = 100) -> Dict[str, Any]:
+        """Budget, memory in use, counters and the ``limit`` largest results with their sizes."""
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.items())
+            memory_bytes = self._memory_bytes
+            stats = dict(self._stats)
+        largest = sorted(entries, key=lambda item: item[1].size, reverse=True)[:limit]
+        return dict(
+            stats,
+            max_bytes=self.max_bytes,
+            ttl_seconds=self.ttl_seconds,
+            max_indexed=self.max_indexed,
+            memory_bytes=memory_bytes,
+            jobs=len(entries),
+            in_memory=sum(1 for _, entry in entries if entry.blob is not None or entry.live is not None),
+            on_disk=sum(1 for _, entry in entries if entry.on_disk),
+            largest=[
+                {
+                    "job_id": job_id,
+                    "status": entry.status,
+                    "bytes": entry.size,
+                    "raw_bytes": entry.raw_size,
+                    "zstd_bytes": len(entry.zstd) if entry.zstd is not None else None,
+                    "in_memory": entry.blob is not None or entry.live is not None,
+                    "on_disk": entry.on_disk,
+                    "idle_seconds": round(now - entry.last_access, 1),
+                }
+                for job_id, entry in largest
+            ],
+        )
@@ -0,0 +1,257 @@
+"""
+Worker loop that grades durable jobs.
+
+A :class:`JobWorker` claims a slice of one job's tasks from the
+:class:`~backend.jobs.store.JobStore`, grades those students on the shared
+async engine, and writes each student's corrections back as soon as that
+student is finished, renewing its task leases while it works. It works on up
+to ``GRADING_WORKER_CLAIMS`` claims at once plus one slot kept free for
+interactive jobs, so a single-student regrade never waits for a batch claim
+to finish. The API process runs one embedded worker; more can run beside it
+with ``python -m backend.worker``.
+"""
+import os
+import time
+import queue
+import socket
+import threading
+import structlog
+from typing import Dict, Any, List, Optional, Callable
+
+from backend.jobs.store import JobStore, CANCELLED
+from backend.correct.scheduler import grading_job, INTERACTIVE
+from backend.correct.engine import GRADING_TASK_ORDER
+from backend.correct.batch import GRADING_BATCH_SIZE
+from backend.jobs.events import get_job_events
+from backend.llm.runtime import submit
+from backend.llm import cache as llm_cache
+from backend.llm.retry import job_deadline, LLM_JOB_DEADLINE
+from backend.llm.metrics import tag_calls
+
+# Setup logger
+logger = structlog.get_logger()
+
+# Store grading jobs in SQLite and grade them through workers (0: in-memory jobs in background threads)
+GRADING_DURABLE_JOBS = os.getenv("GRADING_DURABLE_JOBS", "1") not in ("0", "false", "False")
+# Whether the API process grades jobs itself (turn off when only standalone workers should grade)
+GRADING_EMBEDDED_WORKER = os.getenv("GRADING_EMBEDDED_WORKER", "1") not in ("0", "false", "False")
+# Students claimed (and graded together, so their answers can be deduplicated) per claim
+GRADING_WORKER_CLAIM = int(os.getenv("GRADING_WORKER_CLAIM", "50"))
+# Claims graded at the same time (one more is kept for interactive jobs)
+GRADING_WORKER_CLAIMS = int(os.getenv("GRADING_WORKER_CLAIMS", "2"))
+# Idle workers look for new tasks this often
+GRADING_WORKER_POLL_SECONDS = float(os.getenv("GRADING_WORKER_POLL_SECONDS", "2"))
+
+
+def worker_name(role: str) -> str:
+    """Worker id such as ``api@host:1234``; the prefix up to the pid identifies a role on a host."""
+    return f"{role}@{socket.gethostname()}:{os.getpid()}"
+
+
+def worker_role_prefix(worker_id: str) -> str:
+    """``api@host:1234`` -> ``api@host:``, matching every incarnation of that role on the host."""
+    return worker_id.rsplit(":", 1)[0] + ":"
+
+
+def worker_is_alive(worker_id: str) -> bool:
+    """
+    Whether the process behind a :func:`worker_name` id still runs.
+
+    Only processes on this host can be checked; workers elsewhere count as
+    alive (their tasks come back once the lease expires).
+    """
+    role_host, _, pid = worker_id.rpartition(":")
+    if role_host.split("@", 1)[-1] != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+
+def serialize_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn a ``{"student_id", "corrections"}`` result into plain JSON data."""
+    return {
+        "student_id": result["student_id"],
+        "corrections": [
+            correction.model_dump() if hasattr(correction, "model_dump") else correction
+            for correction in result.get("corrections", [])
+        ],
+    }
+
+
+class JobWorker:
+    """
+    Claims tasks from a job store and grades them on the async engine.
+
+    Args:
+        store: The job store to claim from
+        engine: The :class:`~backend.correct.engine.GradingEngine` that grades
+        get_llm: Factory of the LLM client passed to the engine
+        worker_id: Unique id of this worker (see :func:`worker_name`)
+        claim_size: Students claimed per claim
+        max_claims: Claims graded at the same time, not counting the interactive slot
+        poll_seconds: Sleep between empty claims
+        on_job_done: Called with (job_id, final status) when this worker closes a job
+    """
+
+    def __init__(self, store: JobStore, engine: Any, get_llm: Callable[[], Any], worker_id: str,
+                 claim_size: int = GRADING_WORKER_CLAIM, max_claims: int = GRADING_WORKER_CLAIMS,
+                 poll_seconds: float = GRADING_WORKER_POLL_SECONDS, on_job_done: Optional[Callable[[str, str], None]] = None):
+        self.store = store
+        self.engine = engine
+        self.get_llm = get_llm
+        self.worker_id = worker_id
+        self.claim_size = max(1, claim_size)
+        self.max_claims = max(1, max_claims)
+        self.poll_seconds = poll_seconds
+        self.on_job_done = on_job_done
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def wake(self) -> None:
+        """Look for tasks now instead of after the poll interval (e.g. right after a job was created)."""
+        self._wake.set()
+
+    def start(self) -> threading.Thread:
+        """Start grading in a daemon thread."""
+        self._thread = threading.Thread(target=self.run_forever, name=f"grading-worker-{self.worker_id}", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop claiming and grading; claimed but unfinished tasks go back to the queue."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_forever(self) -> None:
+        logger.info("grading_worker_started", worker=self.worker_id, claim_size=self.claim_size,
+                    max_claims=self.max_claims)
+        active: List[threading.Thread] = []
+        while not self._stop.is_set():
+            active = [thread for thread in active if thread.is_alive()]
+            tasks = []
+            if len(active) <= self.max_claims:
+                # With every regular slot busy, only interactive jobs may take the last one
+                max_priority = INTERACTIVE if len(active) == self.max_claims else None
+                try:
+                    tasks = self.store.claim_tasks(self.worker_id, self.claim_size, max_priority)
+                except Exception as e:
+                    logger.error("grading_worker_error", worker=self.worker_id, error=str(e))
+            if tasks:
+                thread = threading.Thread(target=self._process, args=(tasks,), daemon=True)
+                thread.start()
+                active.append(thread)
+                continue
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+        for thread in active:
+            thread.join()
+        logger.info("grading_worker_stopped", worker=self.worker_id)
+
+    def run_once(self, max_priority: Optional[int] = None) -> int:
+        """
+        Claim and grade one slice of tasks in the calling thread.
+
+        Returns:
+            int: Number of tasks claimed (0 when the queue is empty)
+        """
+        tasks = self.store.claim_tasks(self.worker_id, self.claim_size, max_priority)
+        if tasks:
+            self._process(tasks)
+        return len(tasks)
+
+    def _process(self, tasks: List[Dict[str, Any]]) -> None:
+        try:
+            self._process_claim(tasks)
+        except Exception as e:
+            logger.error("grading_worker_error", worker=self.worker_id, error=str(e))
+        finally:
+            # A slot is free again
+            self._wake.set()
+
+    def _process_claim(self, tasks: List[Dict[str, Any]]) -> None:
+        job_id = tasks[0]["job_id"]
+        job = self.store.job(job_id)
+        logger.info("grading_tasks_claimed", worker=self.worker_id, job_id=job_id, tasks=len(tasks))
+        stats: Dict[str, Any] = {}
+        try:
+            self._grade(job, tasks, stats)
+        finally:
+            status = self.store.finish_job_if_done(job_id, stats)
+            if status is not None:
+                logger.info("grading_job_finished", job_id=job_id, status=status)
+                if self.on_job_done is not None:
+                    self.on_job_done(job_id, status)
+            get_job_events().publish(job_id)
+
+    def _grade(self, job: Dict[str, Any], tasks: List[Dict[str, Any]], stats: Dict[str, Any]) -> None:
+        job_id = job["job_id"]
+        params = job["params"]
+        task_of = {task["student_id"]: task for task in tasks}
+        open_tasks = {task["task_id"] for task in tasks}
+        finished: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        planned: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+
+        # Results arrive on the runtime loop; the SQLite writes happen here, off the loop
+        with llm_cache.bypass_cache(params.get("bypass_cache", False)), \
+                job_deadline(params.get("deadline_seconds") or LLM_JOB_DEADLINE), tag_calls(job_id=job_id), \
+                grading_job(job_id, job["priority"]):
+            future = submit(self.engine.grade_students(
+                [task["student"] for task in tasks], job["problems"], self.get_llm(),
+                dedup=params.get("dedup", True), batched=params.get("batched", False),
+                batch_size=params.get("batch_size", GRADING_BATCH_SIZE), stats=stats, on_student_done=finished.put,
+                reuse=params.get("reuse"), order=params.get("order", GRADING_TASK_ORDER),
+                on_planned=planned.put
+            ))
+
+        renew_every = self.store.lease_seconds / 3
+        renewed_at = checked_at = time.monotonic()
+        while not (future.done() and finished.empty()):
+            if self._stop.is_set() and not future.done():
+                future.cancel()
+            if time.monotonic() - checked_at >= 1 and not future.done():
+                # The job may have been cancelled through another process
+                if self.store.status(job_id) == CANCELLED:
+                    self.engine.queue.cancel_job(job_id)
+                checked_at = time.monotonic()
+            while not planned.empty():
+                self.store.set_schedule(job_id, dict(planned.get(), students=len(tasks)))
+                get_job_events().publish(job_id)
+            try:
+                result = finished.get(timeout=0.5)
+            except queue.Empty:
+                result = None
+            if result is not None:
+                task = task_of[result["student_id"]]
+                if not self.store.complete_task(task["task_id"], self.worker_id, job_id, task["student_id"],
+                                                serialize_result(result)):
+                    # The lease expired and another worker re-claimed the task: its result counts instead
+                    logger.warning("grading_task_lost", job_id=job_id, worker=self.worker_id,
+                                   student_id=task["student_id"], task_id=task["task_id"])
+                open_tasks.discard(task["task_id"])
+                get_job_events().publish(job_id)
+            if time.monotonic() - renewed_at >= renew_every:
+                lost = open_tasks - set(self.store.renew_leases(self.worker_id, list(open_tasks)))
+                if lost:
+                    # Still graded here (the engine cannot drop one student), but no longer renewed or failed
+                    logger.warning("grading_leases_lost", job_id=job_id, worker=self.worker_id, tasks=len(lost))
+                    open_tasks -= lost
+                renewed_at = time.monotonic()
+
+        if future.cancelled():
+            # Tasks of a cancelled job are no longer running, so only a shutdown gives any back
+            self.store.release_tasks(self.worker_id, list(open_tasks))
+            return
+        error = future.exception()
+        for task_id in open_tasks:
+            self.store.fail_task(task_id, self.worker_id, str(error) if error else "no result")
+        if error is not None:
+            logger.error("grading_claim_failed", job_id=job_id, worker=self.worker_id, error=str(error))
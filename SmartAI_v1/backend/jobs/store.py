@@ -0,0 +1,722 @@
+"""
+Durable grading jobs (SQLite).
+
+A grading job is stored with everything a worker needs to run it without the
+API process: the request parameters, a snapshot of the problem store, and one
+task per student holding that student's submission. Tasks move through
+``pending -> running -> done | failed`` (or ``cancelled`` with its job); a
+running task carries a lease that
+its worker renews, so tasks of a crashed worker or a restarted API process
+become claimable again once the lease runs out. Corrections are appended to
+the ``results`` table and never updated in place; the ``result_id`` of that
+table doubles as the cursor for fetching results incrementally while a job
+is still running.
+
+Jobs remember the idempotency key and the fingerprint of the request that
+created them, so a repeated submission is matched to the existing job instead
+of being graded twice.
+
+Several processes (the API and any number of ``python -m backend.worker``)
+share one database file; claims run in ``BEGIN IMMEDIATE`` transactions.
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import structlog
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+from backend.correct.scheduler import BATCH
+
+# Setup logger
+logger = structlog.get_logger()
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+GRADING_JOB_DB = os.getenv("GRADING_JOB_DB", os.path.join(BACKEND_DIR, "data", "grading_jobs.sqlite3"))
+# A running task whose lease is not renewed for this long is handed to another worker
+GRADING_TASK_LEASE_SECONDS = float(os.getenv("GRADING_TASK_LEASE_SECONDS", "120"))
+# Claims of a task (crashes included) before it is marked failed
+GRADING_TASK_MAX_ATTEMPTS = int(os.getenv("GRADING_TASK_MAX_ATTEMPTS", "3"))
+# A repeated request with the same idempotency key returns the earlier job for this long
+GRADING_IDEMPOTENCY_TTL_SECONDS = float(os.getenv("GRADING_IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+
+PENDING, RUNNING, DONE, FAILED, CANCELLED = "pending", "running", "done", "failed", "cancelled"
+TASK_STATES = (PENDING, RUNNING, DONE, FAILED, CANCELLED)
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS jobs ("
+    " job_id TEXT PRIMARY KEY,"
+    " kind TEXT NOT NULL,"
+    " status TEXT NOT NULL,"
+    " priority INTEGER NOT NULL DEFAULT 10,"
+    " params TEXT NOT NULL,"
+    " problems TEXT NOT NULL,"
+    " summary TEXT,"
+    " message TEXT,"
+    " created_at REAL NOT NULL,"
+    " started_at REAL,"
+    " updated_at REAL NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS tasks ("
+    " task_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " job_id TEXT NOT NULL,"
+    " student_id TEXT NOT NULL,"
+    " payload TEXT NOT NULL,"
+    " state TEXT NOT NULL,"
+    " attempts INTEGER NOT NULL DEFAULT 0,"
+    " worker TEXT,"
+    " lease_until REAL,"
+    " error TEXT,"
+    " cost REAL NOT NULL DEFAULT 0,"
+    " updated_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_tasks_job_state ON tasks(job_id, state)",
+    "CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks(state, task_id)",
+    "CREATE TABLE IF NOT EXISTS results ("
+    " result_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+    " job_id TEXT NOT NULL,"
+    " task_id INTEGER NOT NULL,"
+    " student_id TEXT NOT NULL,"
+    " result TEXT NOT NULL,"
+    " created_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_results_job ON results(job_id, result_id)",
+    "CREATE INDEX IF NOT EXISTS idx_results_student ON results(job_id, student_id)",
+    "CREATE TABLE IF NOT EXISTS question_progress ("
+    " job_id TEXT NOT NULL,"
+    " q_id TEXT NOT NULL,"
+    " graded INTEGER NOT NULL,"
+    " PRIMARY KEY (job_id, q_id))",
+)
+
+
+class JobStore:
+    """
+    SQLite-backed job queue and append-only result store.
+
+    Args:
+        path: Database file path (shared by every process that grades)
+        lease_seconds: Lifetime of a task claim unless renewed
+        max_attempts: Claims of a task before it is marked failed
+    """
+
+    def __init__(self, path: str = GRADING_JOB_DB, lease_seconds: float = GRADING_TASK_LEASE_SECONDS,
+                 max_attempts: int = GRADING_TASK_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Autocommit mode: transactions are opened explicitly where several statements must be atomic
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            # Databases created before jobs recorded their start time and priority
+            columns = {column[1] for column in conn.execute("PRAGMA table_info(jobs)")}
+            if "started_at" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN started_at REAL")
+            if "priority" not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT {BATCH}")
+            # ... and before they could be matched to repeated requests
+            if "idempotency_key" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN idempotency_key TEXT")
+            if "fingerprint" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN fingerprint TEXT")
+            # ... and before tasks carried an estimated grading cost
+            if "cost" not in {column[1] for column in conn.execute("PRAGMA table_info(tasks)")}:
+                conn.execute("ALTER TABLE tasks ADD COLUMN cost REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_idempotency_key ON jobs(idempotency_key)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_fingerprint ON jobs(fingerprint, status)")
+            self._conn = conn
+        return self._conn
+
+    def create_job(self, job_id: str, kind: str, params: Dict[str, Any], problems: Dict[str, Any],
+                   students: List[Dict[str, Any]], priority: int = BATCH) -> int:
+        """
+        Store a job and one pending task per student.
+
+        Args:
+            job_id: The job id returned to the client
+            kind: "student" (one student) or "batch" (all students)
+            params: Request parameters the worker needs (cache bypass, dedup, ...)
+            problems: Snapshot of the problem store
+            students: Student entries; those without a stu_id are skipped
+            priority: Priority class (see :mod:`backend.correct.scheduler`); lower is claimed first
+
+        Returns:
+            int: Number of tasks created
+        """
+        self.create_or_join_job(job_id, kind, params, problems, students, priority)
+        return sum(1 for student in students if student.get("stu_id"))
+
+    def create_or_join_job(self, job_id: str, kind: str, params: Dict[str, Any], problems: Dict[str, Any],
+                           students: List[Dict[str, Any]], priority: int = BATCH,
+                           idempotency_key: Optional[str] = None,
+                           fingerprint: Optional[str] = None,
+                           costs: Optional[Dict[str, float]] = None) -> Tuple[str, Optional[str]]:
+        """
+        Store a job like :meth:`create_job`, unless the request repeats an earlier one.
+
+        The check and the insert share one transaction, so concurrent duplicates
+        (from any process) end up with a single job.
+
+        Args:
+            idempotency_key: Client-chosen key; a job created with the same key
+                within ``GRADING_IDEMPOTENCY_TTL_SECONDS`` is returned instead
+            fingerprint: Hash of the request and its store snapshot (see
+                :func:`job_fingerprint`); a pending or running job with the same one is returned instead
+            costs: Estimated grading seconds per student id; a job's most expensive
+                students are claimed first (longest-first order across claims)
+
+        Returns:
+            Tuple[str, Optional[str]]: The job id and None if the job was created, or the
+            existing job's id and why it was reused: "idempotency_key", "idempotency_conflict"
+            (same key, different request) or "in_flight"
+        """
+        now = time.time()
+        rows = [
+            (job_id, student["stu_id"], json.dumps(student, ensure_ascii=False), PENDING,
+             (costs or {}).get(student["stu_id"], 0.0), now)
+            for student in students if student.get("stu_id")
+        ]
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = self._find_duplicate_locked(conn, now, idempotency_key, fingerprint)
+                if existing is not None:
+                    conn.execute("COMMIT")
+                    logger.info("grading_job_coalesced", job_id=existing[0], reason=existing[1])
+                    return existing
+                conn.execute(
+                    "INSERT INTO jobs (job_id, kind, status, priority, params, problems, idempotency_key,"
+                    " fingerprint, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, "pending" if rows else "completed", priority,
+                     json.dumps(params, ensure_ascii=False), json.dumps(problems, ensure_ascii=False),
+                     idempotency_key, fingerprint, now, now)
+                )
+                conn.executemany(
+                    "INSERT INTO tasks (job_id, student_id, payload, state, cost, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        logger.info("grading_job_stored", job_id=job_id, kind=kind, tasks=len(rows))
+        return job_id, None
+
+    def _find_duplicate_locked(self, conn: sqlite3.Connection, now: float, idempotency_key: Optional[str],
+                               fingerprint: Optional[str]) -> Optional[Tuple[str, str]]:
+        if idempotency_key:
+            row = conn.execute(
+                "SELECT job_id, fingerprint FROM jobs WHERE idempotency_key = ? AND created_at >= ?"
+                " ORDER BY created_at DESC LIMIT 1",
+                (idempotency_key, now - GRADING_IDEMPOTENCY_TTL_SECONDS)
+            ).fetchone()
+            if row is not None:
+                same = fingerprint is None or row[1] is None or row[1] == fingerprint
+                return row[0], "idempotency_key" if same else "idempotency_conflict"
+        if fingerprint:
+            row = conn.execute(
+                "SELECT job_id FROM jobs WHERE fingerprint = ? AND status IN ('pending', 'running')"
+                " ORDER BY created_at LIMIT 1",
+                (fingerprint,)
+            ).fetchone()
+            if row is not None:
+                return row[0], "in_flight"
+        return None
+
+    def find_student_in_flight(self, student: Dict[str, Any], problems: Dict[str, Any],
+                               params: Dict[str, Any]) -> Optional[str]:
+        """
+        A pending or running multi-student job that grades (or has graded) this
+        exact submission against the same problems and cache settings, or None.
+        """
+        payload = json.dumps(student, ensure_ascii=False)
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT j.job_id, j.params, j.problems FROM tasks t JOIN jobs j ON j.job_id = t.job_id"
+                " WHERE t.student_id = ? AND t.payload = ? AND t.state IN (?, ?, ?)"
+                " AND j.kind != 'student' AND j.status IN ('pending', 'running') ORDER BY j.created_at",
+                (student.get("stu_id"), payload, PENDING, RUNNING, DONE)
+            ).fetchall()
+        for job_id, job_params, job_problems in rows:
+            if json.loads(job_problems) != problems:
+                continue
+            if json.loads(job_params).get("bypass_cache", False) != params.get("bypass_cache", False):
+                continue
+            return job_id
+        return None
+
+    def _expire_leases_locked(self, conn: sqlite3.Connection, now: float) -> int:
+        """Hand tasks with an expired lease back to the queue (or fail them after too many claims)."""
+        conn.execute(
+            "UPDATE tasks SET state = ?, error = 'lease expired', worker = NULL, updated_at = ?"
+            " WHERE state = ? AND lease_until < ? AND attempts >= ?",
+            (FAILED, now, RUNNING, now, self.max_attempts)
+        )
+        return conn.execute(
+            "UPDATE tasks SET state = ?, worker = NULL, updated_at = ? WHERE state = ? AND lease_until < ?",
+            (PENDING, now, RUNNING, now)
+        ).rowcount
+
+    def claim_tasks(self, worker_id: str, limit: int, max_priority: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Claim up to ``limit`` pending tasks of the job that goes first.
+
+        Jobs are taken by priority class, then oldest first. Claims never span
+        jobs, so a worker grades one job's students together (and can
+        deduplicate their answers). Within a job, students with the highest
+        estimated cost go first (all costs are 0 unless the job runs longest-first).
+
+        Args:
+            worker_id: The claiming worker
+            limit: Maximum tasks claimed
+            max_priority: Only consider jobs of this priority class or a more urgent one
+
+        Returns:
+            List[Dict[str, Any]]: Tasks with task_id, job_id, student_id, attempts and the student payload
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire_leases_locked(conn, now)
+                row = conn.execute(
+                    "SELECT t.job_id FROM tasks t JOIN jobs j ON j.job_id = t.job_id"
+                    " WHERE t.state = ? AND j.priority <= ? ORDER BY j.priority, t.task_id LIMIT 1",
+                    (PENDING, max_priority if max_priority is not None else 1 << 30)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return []
+                job_id = row[0]
+                rows = conn.execute(
+                    "SELECT task_id, student_id, payload, attempts FROM tasks"
+                    " WHERE job_id = ? AND state = ? ORDER BY cost DESC, task_id LIMIT ?",
+                    (job_id, PENDING, max(1, limit))
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE tasks SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1, updated_at = ?"
+                    " WHERE task_id = ?",
+                    [(RUNNING, worker_id, now + self.lease_seconds, now, task_id) for task_id, _, _, _ in rows]
+                )
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?), updated_at = ?"
+                    " WHERE job_id = ? AND status = 'pending'",
+                    (now, now, job_id)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return [
+            {"task_id": task_id, "job_id": job_id, "student_id": student_id,
+             "student": json.loads(payload), "attempts": attempts + 1}
+            for task_id, student_id, payload, attempts in rows
+        ]
+
+    def renew_leases(self, worker_id: str, task_ids: List[int]) -> List[int]:
+        """
+        Extend the lease of tasks this worker is still grading.
+
+        Returns:
+            List[int]: The tasks renewed; the others are no longer this worker's
+            (their lease expired and they were re-claimed, or they were cancelled)
+        """
+        if not task_ids:
+            return []
+        now = time.time()
+        renewed = []
+        with self._lock:
+            conn = self._connect()
+            for task_id in task_ids:
+                if conn.execute(
+                    "UPDATE tasks SET lease_until = ? WHERE task_id = ? AND worker = ? AND state = ?",
+                    (now + self.lease_seconds, task_id, worker_id, RUNNING)
+                ).rowcount:
+                    renewed.append(task_id)
+        return renewed
+
+    def complete_task(self, task_id: int, worker_id: str, job_id: str, student_id: str,
+                      result: Dict[str, Any]) -> bool:
+        """
+        Append a task's result and mark it done.
+
+        Returns:
+            bool: False if the task is no longer this worker's (its lease expired and it was re-claimed)
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = conn.execute(
+                    "UPDATE tasks SET state = ?, worker = NULL, lease_until = NULL, updated_at = ?"
+                    " WHERE task_id = ? AND worker = ? AND state = ?",
+                    (DONE, now, task_id, worker_id, RUNNING)
+                ).rowcount
+                if updated:
+                    conn.execute(
+                        "INSERT INTO results (job_id, task_id, student_id, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (job_id, task_id, student_id, json.dumps(result, ensure_ascii=False), now)
+                    )
+                    graded: Dict[str, int] = {}
+                    for correction in result.get("corrections", []):
+                        q_id = correction.get("q_id") or "unknown"
+                        graded[q_id] = graded.get(q_id, 0) + 1
+                    conn.executemany(
+                        "INSERT INTO question_progress (job_id, q_id, graded) VALUES (?, ?, ?)"
+                        " ON CONFLICT (job_id, q_id) DO UPDATE SET graded = graded + excluded.graded",
+                        [(job_id, q_id, count) for q_id, count in graded.items()]
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return bool(updated)
+
+    def fail_task(self, task_id: int, worker_id: str, error: str) -> None:
+        """Give a task back to the queue, or mark it failed once it has used all its attempts."""
+        now = time.time()
+        with self._lock:
+            self._connect().execute(
+                "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END,"
+                " worker = NULL, lease_until = NULL, error = ?, updated_at = ?"
+                " WHERE task_id = ? AND worker = ? AND state = ?",
+                (self.max_attempts, FAILED, PENDING, error, now, task_id, worker_id, RUNNING)
+            )
+
+    def release_tasks(self, worker_id: str, task_ids: List[int]) -> None:
+        """Return unfinished tasks of a worker that is shutting down, without charging an attempt."""
+        if not task_ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._connect().executemany(
+                "UPDATE tasks SET state = ?, worker = NULL, lease_until = NULL, attempts = MAX(0, attempts - 1),"
+                " updated_at = ? WHERE task_id = ? AND worker = ? AND state = ?",
+                [(PENDING, now, task_id, worker_id, RUNNING) for task_id in task_ids]
+            )
+
+    def recover(self, worker_prefix: Optional[str] = None,
+                is_alive: Optional[Callable[[str], bool]] = None) -> int:
+        """
+        Make unfinished tasks claimable again after a restart.
+
+        Tasks with an expired lease are always requeued. With ``worker_prefix``
+        and ``is_alive``, running tasks claimed by workers of that prefix whose
+        process is gone (e.g. the API process before a restart) are requeued
+        right away; tasks of live workers sharing the prefix (siblings under
+        ``uvicorn --workers``) keep their lease.
+
+        Args:
+            worker_prefix: Prefix of the worker ids to check (see :func:`backend.jobs.runner.worker_role_prefix`)
+            is_alive: Whether the worker with a given id still runs (see :func:`backend.jobs.runner.worker_is_alive`)
+
+        Returns:
+            int: Number of tasks put back to pending
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                requeued = self._expire_leases_locked(conn, now)
+                if worker_prefix and is_alive is not None:
+                    workers = [row[0] for row in conn.execute(
+                        "SELECT DISTINCT worker FROM tasks WHERE state = ? AND worker LIKE ?",
+                        (RUNNING, worker_prefix + "%")
+                    )]
+                    for worker in workers:
+                        if is_alive(worker):
+                            continue
+                        requeued += conn.execute(
+                            "UPDATE tasks SET state = ?, worker = NULL, lease_until = NULL, updated_at = ?"
+                            " WHERE state = ? AND worker = ?",
+                            (PENDING, now, RUNNING, worker)
+                        ).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if requeued:
+            logger.info("grading_tasks_recovered", tasks=requeued)
+        return requeued
+
+    def status(self, job_id: str) -> Optional[str]:
+        """Status of a job without loading its parameters and problems, or None if unknown."""
+        with self._lock:
+            row = self._connect().execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job row plus task counts per state, or None if unknown."""
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT kind, status, priority, params, problems, summary, message, created_at, updated_at"
+                " FROM jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT state, COUNT(*) FROM tasks WHERE job_id = ? GROUP BY state", (job_id,)
+            ).fetchall())
+        kind, status, priority, params, problems, summary, message, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "kind": kind,
+            "status": status,
+            "params": json.loads(params),
+            "problems": json.loads(problems),
+            "summary": json.loads(summary) if summary else {},
+            "message": message,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "priority": priority,
+            "tasks": {state: counts.get(state, 0) for state in TASK_STATES},
+        }
+
+    def results(self, job_id: str, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """The latest result per student of a job, in task order (one page of them with ``offset``/``limit``)."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT task_id, result FROM results WHERE result_id IN"
+                " (SELECT MAX(result_id) FROM results WHERE job_id = ? GROUP BY task_id) ORDER BY task_id"
+                " LIMIT ? OFFSET ?",
+                (job_id, limit if limit is not None else -1, max(0, offset))
+            ).fetchall()
+        return [json.loads(result) for _, result in rows]
+
+    def result_count(self, job_id: str) -> int:
+        """Number of students of a job that have a result."""
+        with self._lock:
+            return self._connect().execute(
+                "SELECT COUNT(DISTINCT task_id) FROM results WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+
+    def student_result(self, job_id: str, student_id: str) -> Optional[Dict[str, Any]]:
+        """The latest result of one student of a job, or None if that student has none."""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT result FROM results WHERE job_id = ? AND student_id = ? ORDER BY result_id DESC LIMIT 1",
+                (job_id, student_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def results_since(self, job_id: str, cursor: int = 0, limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Results appended after ``cursor``, oldest first.
+
+        Args:
+            job_id: The job
+            cursor: The cursor returned by the previous call (0 for everything)
+            limit: Maximum results returned
+
+        Returns:
+            Tuple[List[Dict[str, Any]], int]: The results and the cursor to pass next time
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT result_id, result FROM results WHERE job_id = ? AND result_id > ? ORDER BY result_id LIMIT ?",
+                (job_id, cursor, limit if limit is not None else -1)
+            ).fetchall()
+        return [json.loads(result) for _, result in rows], rows[-1][0] if rows else cursor
+
+    def progress(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Task counts, throughput and ETA of a job, or None if unknown.
+
+        The rate is measured from the first claim, so the ETA assumes the
+        remaining students take as long as the ones graded so far. A job with
+        a deadline never gets an ETA past it (its LLM calls stop there), and
+        ``meets_deadline`` tells whether the current rate finishes in time.
+        ``schedule`` is the cost-model estimate of the claim being graded.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT status, started_at, updated_at, params, summary FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT state, COUNT(*) FROM tasks WHERE job_id = ? GROUP BY state", (job_id,)
+            ).fetchall())
+            questions = conn.execute(
+                "SELECT q_id, graded FROM question_progress WHERE job_id = ? ORDER BY q_id", (job_id,)
+            ).fetchall()
+        status, started_at, updated_at, params, summary = row
+        total = sum(counts.values())
+        completed = counts.get(DONE, 0)
+        failed = counts.get(FAILED, 0)
+        cancelled = counts.get(CANCELLED, 0)
+        finished = status not in ("pending", "running")
+        elapsed = ((updated_at if finished else now) - started_at) if started_at else 0.0
+        rate = completed / elapsed if elapsed > 0 else None
+        remaining = counts.get(PENDING, 0) + counts.get(RUNNING, 0)
+        eta = 0.0 if not remaining else (remaining / rate if rate else None)
+        deadline = json.loads(params).get("deadline_seconds") if params else None
+        meets_deadline = None
+        if deadline:
+            left = max(0.0, deadline - elapsed)
+            meets_deadline = None if eta is None else eta <= left
+            eta = left if eta is None else min(eta, left)
+        return {
+            "total": total,
+            "completed": completed,
+            "failed": failed,
+            "cancelled": cancelled,
+            "running": counts.get(RUNNING, 0),
+            "pending": counts.get(PENDING, 0),
+            "percent": round(100.0 * (completed + failed + cancelled) / total, 1) if total else 100.0,
+            "elapsed_seconds": round(elapsed, 1),
+            "students_per_second": round(rate, 4) if rate else None,
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "deadline_seconds": deadline,
+            "meets_deadline": meets_deadline,
+            "schedule": (json.loads(summary) if summary else {}).get("schedule"),
+            "questions": {
+                q_id: {"graded": graded, "per_second": round(graded / elapsed, 4) if elapsed > 0 else None}
+                for q_id, graded in questions
+            },
+        }
+
+    def failed_tasks(self, job_id: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT student_id, error FROM tasks WHERE job_id = ? AND state = ? ORDER BY task_id", (job_id, FAILED)
+            ).fetchall()
+        return [{"student_id": student_id, "error": error} for student_id, error in rows]
+
+    def finish_job_if_done(self, job_id: str, summary: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        Close a job whose tasks are all done or failed, merging ``summary`` into its stored summary.
+
+        Returns:
+            Optional[str]: The final status ("completed" or "error") if the job was closed by this call
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT status, summary FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                merged = _merge_summary(json.loads(row[1]) if row[1] else {}, summary or {})
+                counts = dict(conn.execute(
+                    "SELECT state, COUNT(*) FROM tasks WHERE job_id = ? GROUP BY state", (job_id,)
+                ).fetchall())
+                status = None
+                if row[0] in ("pending", "running") and not counts.get(PENDING) and not counts.get(RUNNING):
+                    status = "completed" if counts.get(DONE) else "error"
+                conn.execute(
+                    "UPDATE jobs SET status = COALESCE(?, status), summary = ?, updated_at = ?,"
+                    " message = CASE WHEN ? = 'error' THEN 'all tasks failed' ELSE message END WHERE job_id = ?",
+                    (status, json.dumps(merged, ensure_ascii=False), now, status, job_id)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return status
+
+    def set_schedule(self, job_id: str, schedule: Dict[str, Any]) -> None:
+        """Store the schedule estimate of the claim being graded (replacing the previous claim's)."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT summary FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row is not None:
+                    summary = json.loads(row[0]) if row[0] else {}
+                    summary["schedule"] = schedule
+                    conn.execute("UPDATE jobs SET summary = ? WHERE job_id = ?",
+                                 (json.dumps(summary, ensure_ascii=False), job_id))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def cancel_job(self, job_id: str) -> bool:
+        """
+        Cancel a job that has not finished: its unfinished tasks are never claimed again.
+
+        Students already graded keep their results; results of running tasks
+        that arrive later are discarded.
+
+        Returns:
+            bool: True if the job was pending or running
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                updated = conn.execute(
+                    "UPDATE jobs SET status = ?, message = 'cancelled', updated_at = ?"
+                    " WHERE job_id = ? AND status IN ('pending', 'running')",
+                    (CANCELLED, now, job_id)
+                ).rowcount
+                if updated:
+                    conn.execute(
+                        "UPDATE tasks SET state = ?, worker = NULL, lease_until = NULL, updated_at = ?"
+                        " WHERE job_id = ? AND state IN (?, ?)",
+                        (CANCELLED, now, job_id, PENDING, RUNNING)
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if updated:
+            logger.info("grading_job_cancelled", job_id=job_id)
+        return bool(updated)
+
+    def list_jobs(self) -> Dict[str, str]:
+        """Status of every stored job, oldest first."""
+        with self._lock:
+            rows = self._connect().execute("SELECT job_id, status FROM jobs ORDER BY created_at").fetchall()
+        return dict(rows)
+
+
+def job_fingerprint(kind: str, params: Dict[str, Any], problems: Dict[str, Any],
+                    students: List[Dict[str, Any]]) -> str:
+    """Hash of a job request and the store snapshot it grades; equal for a repeated submission."""
+    raw = json.dumps([kind, params, problems, students], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _merge_summary(current: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """Add numeric counters of ``update`` (e.g. dedup/batching stats of one claim) into ``current``."""
+    merged = dict(current)
+    for key, value in update.items():
+        if isinstance(value, dict):
+            merged[key] = _merge_summary(merged.get(key) or {}, value)
+        elif isinstance(value, (int, float)) and isinstance(merged.get(key), (int, float)):
+            merged[key] = merged[key] + value
+        else:
+            merged[key] = value
+    return merged
+
+
+# Store shared by the API and the in-process worker
+job_store = JobStore()
+
+
+def get_job_store() -> JobStore:
+    """Return the process-wide grading job store."""
+    return job_store
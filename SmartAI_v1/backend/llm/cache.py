@@ -0,0 +1,246 @@
+"""
+Persistent, content-addressed cache of LLM responses (SQLite).
+
+Entries are keyed by a hash of the model, temperature, the fully rendered
+prompt and the expected output schema, so re-running a job over unchanged
+answers is served from disk instead of the provider. The cache sits inside
+``backend.llm.calls`` and therefore below every LLM call site.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import contextvars
+import structlog
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Callable
+
+# Setup logger
+logger = structlog.get_logger()
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") not in ("0", "false", "False")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(BACKEND_DIR, "data", "llm_cache.sqlite3"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+LLM_CACHE_MAX_AGE_SECONDS = float(os.getenv("LLM_CACHE_MAX_AGE_SECONDS", str(30 * 24 * 3600)))
+
+# Set to True for the duration of a job that must not read cached responses
+cache_bypass: contextvars.ContextVar = contextvars.ContextVar("llm_cache_bypass", default=False)
+
+
+@contextmanager
+def bypass_cache(enabled: bool = True):
+    """Within this block, cache lookups are skipped (fresh responses are still stored)."""
+    token = cache_bypass.set(enabled)
+    try:
+        yield
+    finally:
+        cache_bypass.reset(token)
+
+
+def _schema_fingerprint(schema: Any) -> Optional[str]:
+    if schema is None:
+        return None
+    if hasattr(schema, "model_json_schema"):
+        return json.dumps(schema.model_json_schema(), sort_keys=True, ensure_ascii=False)
+    return str(schema)
+
+
+def make_cache_key(llm: Any, messages: List[Any], schema: Any = None) -> str:
+    """
+    Build the content address of one LLM request.
+
+    Args:
+        llm: The chat model (its model name and temperature are part of the key)
+        messages: The fully rendered messages
+        schema: The pydantic model (or any identifier) the output is parsed into
+
+    Returns:
+        str: A hex SHA-256 digest
+    """
+    payload = {
+        "model": getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__,
+        "temperature": getattr(llm, "temperature", None),
+        "messages": [[getattr(m, "type", "human"), getattr(m, "content", m)] for m in messages],
+        "schema": _schema_fingerprint(schema),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def is_cacheable_output(content: Any, validate: Optional[Callable[[str], Any]] = None) -> bool:
+    """
+    Whether a response may be stored (or replayed) from the cache.
+
+    With ``validate`` (the caller's schema check, raising ``ValueError`` on an
+    invalid output) only outputs that pass it qualify, so an answer that would
+    be re-asked is never replayed; without one the whole output must be JSON.
+    """
+    if not isinstance(content, str):
+        return False
+    try:
+        if validate is not None:
+            validate(content)
+        else:
+            json.loads(content)
+        return True
+    except ValueError:
+        return False
+
+
+class LLMResponseCache:
+    """
+    SQLite-backed response cache with age- and size-based eviction.
+
+    Args:
+        path: Database file path
+        max_entries: Entries kept after eviction (least recently used go first)
+        max_age_seconds: Entries older than this are evicted
+        evict_every: Run eviction after this many writes
+    """
+
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 max_age_seconds: float = LLM_CACHE_MAX_AGE_SECONDS, evict_every: int = 200):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.evict_every = evict_every
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes_since_evict = 0
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "writes": 0, "evictions": 0, "errors": 0}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT,"
+                " content TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL,"
+                " hits INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached content for a key, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                row = conn.execute("SELECT content, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is None or now - row[1] > self.max_age_seconds:
+                    self._stats["misses"] += 1
+                    return None
+                conn.execute("UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+                conn.commit()
+                self._stats["hits"] += 1
+                return row[0]
+            except sqlite3.Error as e:
+                self._stats["errors"] += 1
+                logger.warning("llm_cache_read_failed", error=str(e))
+                return None
+
+    def put(self, key: str, content: str, model: Optional[str] = None) -> None:
+        """Store (or refresh) a response."""
+        now = time.time()
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, model, content, size, created_at, last_access, hits)"
+                    " VALUES (?, ?, ?, ?, ?, ?, 0)",
+                    (key, model, content, len(content.encode("utf-8")), now, now)
+                )
+                conn.commit()
+                self._stats["writes"] += 1
+                self._writes_since_evict += 1
+                if self._writes_since_evict >= self.evict_every:
+                    self._evict_locked(now)
+            except sqlite3.Error as e:
+                self._stats["errors"] += 1
+                logger.warning("llm_cache_write_failed", error=str(e))
+
+    def delete(self, key: str) -> None:
+        """Drop one entry (e.g. a response that no longer passes its schema)."""
+        with self._lock:
+            try:
+                conn = self._connect()
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                conn.commit()
+            except sqlite3.Error as e:
+                self._stats["errors"] += 1
+                logger.warning("llm_cache_write_failed", error=str(e))
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self._stats["bypassed"] += 1
+
+    def _evict_locked(self, now: float) -> int:
+        conn = self._connect()
+        removed = conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,)).rowcount
+        count = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count > self.max_entries:
+            removed += conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                (count - self.max_entries,)
+            ).rowcount
+        conn.commit()
+        self._writes_since_evict = 0
+        self._stats["evictions"] += removed
+        if removed:
+            logger.info("llm_cache_evicted", removed=removed)
+        return removed
+
+    def evict(self) -> int:
+        """Run age/size eviction now and return the number of removed entries."""
+        with self._lock:
+            return self._evict_locked(time.time())
+
+    def clear(self) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters plus the current entry count and size on disk."""
+        with self._lock:
+            try:
+                conn = self._connect()
+                entries, total_bytes = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            except sqlite3.Error:
+                entries, total_bytes = None, None
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                enabled=LLM_CACHE_ENABLED,
+                path=self.path,
+                entries=entries,
+                content_bytes=total_bytes,
+                hit_rate=round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                max_entries=self.max_entries,
+                max_age_seconds=self.max_age_seconds,
+            )
+
+
+# Single cache shared by every LLM call site in the process
+response_cache = LLMResponseCache()
+
+
+def get_response_cache() -> LLMResponseCache:
+    """Return the process-wide LLM response cache."""
+    return response_cache
@@ -0,0 +1,310 @@
+"""
+Single entry point for every LLM request made by the backend.
+
+Grading nodes, answer segmentation (hw_preview) and problem extraction
+(prob_preview) all send their messages through :func:`ainvoke_llm` /
+:func:`invoke_llm`, so cross-cutting policies such as rate limiting live in
+one place. Requests pass through, in order: the persistent response cache
+and the shared retry policy (backoff, timeouts, hedging), and each attempt
+through the shared rate limiter. :func:`astream_llm` is the streaming variant
+used for JSON outputs: fields are published as they arrive and a stream that
+breaks the schema is aborted and retried early.
+"""
+import time
+import asyncio
+import structlog
+from typing import Dict, Any, List, Optional, Callable
+
+from langchain_core.messages import AIMessage
+
+from backend.llm.cache import (
+    LLM_CACHE_ENABLED, cache_bypass, get_response_cache, make_cache_key, is_cacheable_output
+)
+from backend.llm.limiter import get_rate_limiter, is_throttling_error
+from backend.llm.retry import get_retry_policy
+from backend.llm.metrics import CallRecord, get_call_ledger
+from backend.llm.runtime import run_sync
+from backend.llm.streaming import (
+    LLM_STREAMING, LLM_STREAM_USAGE_WAIT, IncrementalJSONParser, StreamSchemaError,
+    schema_field_types, stream_field_sink, get_stream_metrics
+)
+
+# Setup logger
+logger = structlog.get_logger()
+
+
+def estimate_tokens(messages: List[Any]) -> int:
+    """
+    Roughly estimate the prompt size of a message list in tokens.
+
+    Chinese text averages a bit over one character per token and English about
+    four, so two characters per token is a conservative middle ground.
+    """
+    chars = 0
+    for message in messages:
+        content = getattr(message, "content", message)
+        chars += len(content) if isinstance(content, str) else len(str(content))
+    return chars // 2 + 1
+
+
+def response_total_tokens(response: Any) -> Any:
+    """Return the provider-reported total token count of a response, or None."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    total = usage.get("total_tokens") if isinstance(usage, dict) else None
+    if total is None:
+        token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+        total = token_usage.get("total_tokens")
+    return total
+
+
+async def _cache_lookup(llm: Any, messages: List[Any], schema: Any,
+                        validate: Optional[Callable[[str], Any]] = None):
+    """Return (cache, key, cached AIMessage or None) for a request; entries failing ``validate`` are dropped."""
+    cache = get_response_cache() if LLM_CACHE_ENABLED else None
+    if cache is None:
+        return None, None, None
+    cache_key = make_cache_key(llm, messages, schema)
+    if cache_bypass.get():
+        cache.record_bypass()
+        return cache, cache_key, None
+    cached = await asyncio.to_thread(cache.get, cache_key)
+    if cached is None:
+        return cache, cache_key, None
+    if validate is not None and not is_cacheable_output(cached, validate):
+        # Stored before it was checked against the schema: ask the model afresh
+        logger.warning("llm_cache_invalid_entry", key=cache_key[:12])
+        await asyncio.to_thread(cache.delete, cache_key)
+        return cache, cache_key, None
+    logger.info("llm_cache_hit", key=cache_key[:12])
+    return cache, cache_key, AIMessage(content=cached, response_metadata={"cache_hit": True})
+
+
+async def _cache_store(cache: Any, cache_key: Optional[str], llm: Any, content: Any,
+                       validate: Optional[Callable[[str], Any]] = None) -> None:
+    # Outputs the caller would reject are not stored, so a retry or re-ask really asks the model again
+    if cache is not None and is_cacheable_output(content, validate):
+        model = getattr(llm, "model_name", None) or getattr(llm, "model", None)
+        await asyncio.to_thread(cache.put, cache_key, content, model)
+
+
+async def _ainvoke_once(llm: Any, messages: List[Any], record: CallRecord, call_kwargs: Dict[str, Any]) -> Any:
+    """One attempt: a limiter ticket around a single ``ainvoke``."""
+    limiter = get_rate_limiter()
+    ticket = await limiter.acquire(estimate_tokens(messages))
+    started = time.monotonic()
+    try:
+        response = await llm.ainvoke(messages, **call_kwargs)
+    except asyncio.CancelledError:
+        # Timed out or lost a hedge race
+        limiter.release(ticket, "error")
+        raise
+    except Exception as e:
+        outcome = "throttled" if is_throttling_error(e) else "error"
+        limiter.release(ticket, outcome)
+        logger.warning("llm_call_failed", outcome=outcome, error=str(e))
+        raise
+    finally:
+        record.add_attempt(ticket.waited, time.monotonic() - started)
+    limiter.release(ticket, "success", response_total_tokens(response))
+    return response
+
+
+async def _run_recorded(make_call: Callable[[], Any], record: CallRecord, messages: List[Any], label: str) -> Any:
+    """Run a call under the retry policy and file its record in the call ledger."""
+    try:
+        response = await get_retry_policy().call(make_call, label=label)
+    except BaseException:
+        record.outcome = "error"
+        get_call_ledger().record(record)
+        raise
+    record.set_usage(response, estimate_tokens(messages))
+    get_call_ledger().record(record)
+    return response
+
+
+async def ainvoke_llm(llm: Any, messages: List[Any], schema: Any = None,
+                      call_kwargs: Optional[Dict[str, Any]] = None,
+                      validate: Optional[Callable[[str], Any]] = None) -> Any:
+    """
+    Send one chat request through the response cache, retry policy and rate limiter.
+
+    Args:
+        llm: A LangChain chat model
+        messages: The messages to send
+        schema: The pydantic model (or identifier) the caller parses the output
+            into; part of the cache key
+        call_kwargs: Extra request arguments for the model (e.g. ``response_format``)
+        validate: Check of the output against ``schema`` (raises ``ValueError``);
+            only outputs passing it are cached or replayed
+
+    Returns:
+        Any: The model response (an AIMessage); cache hits carry
+        ``response_metadata["cache_hit"] = True``
+    """
+    record = CallRecord()
+    cache, cache_key, cached = await _cache_lookup(llm, messages, schema, validate)
+    if cached is not None:
+        record.cache_hit = True
+        record.set_usage(cached, estimate_tokens(messages))
+        get_call_ledger().record(record)
+        return cached
+
+    response = await _run_recorded(lambda: _ainvoke_once(llm, messages, record, call_kwargs or {}), record, messages, "invoke")
+    await _cache_store(cache, cache_key, llm, response.content, validate)
+    return response
+
+
+async def _drain_usage(stream: Any) -> Optional[Dict[str, Any]]:
+    """Read the rest of a stream for its usage metadata, which providers send after the content."""
+    async def tail() -> Optional[Dict[str, Any]]:
+        usage = None
+        async for chunk in stream:
+            usage = getattr(chunk, "usage_metadata", None) or usage
+        return usage
+
+    try:
+        return await asyncio.wait_for(tail(), LLM_STREAM_USAGE_WAIT)
+    except asyncio.TimeoutError:
+        logger.debug("llm_stream_usage_missing", waited=LLM_STREAM_USAGE_WAIT)
+    except Exception as e:
+        # The answer is already complete; a failing tail only costs the token counts
+        logger.debug("llm_stream_usage_missing", error=str(e))
+    return None
+
+
+async def _astream_once(llm: Any, messages: List[Any], schema: Any,
+                        on_field: Optional[Callable[[str, Any], None]], record: CallRecord,
+                        call_kwargs: Dict[str, Any]) -> Any:
+    """Stream one response, feeding the incremental parser; raises StreamSchemaError on breakage."""
+    metrics = get_stream_metrics()
+    parser = IncrementalJSONParser(schema_field_types(schema))
+    parts: List[str] = []
+    ttft = ttvj = None
+    usage = provider = None
+
+    limiter = get_rate_limiter()
+    ticket = await limiter.acquire(estimate_tokens(messages))
+    started = time.monotonic()
+    stream = llm.astream(messages, **call_kwargs)
+    try:
+        async for chunk in stream:
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            provider = (getattr(chunk, "response_metadata", None) or {}).get("provider", provider)
+            text = chunk.content if isinstance(chunk.content, str) else str(chunk.content)
+            if not text:
+                continue
+            if ttft is None:
+                ttft = time.monotonic() - started
+            parts.append(text)
+            for field, value in parser.feed(text):
+                logger.debug("llm_stream_field", field=field)
+                if on_field is not None:
+                    on_field(field, value)
+            if parser.complete:
+                ttvj = time.monotonic() - started if parser.result is not None else None
+                # Anything after the closing brace is commentary the parsers ignore,
+                # but the usage chunk comes last
+                if usage is None:
+                    usage = await _drain_usage(stream)
+                break
+    except StreamSchemaError as e:
+        record.schema_aborts += 1
+        limiter.release(ticket, "success")
+        metrics.record(ttft, None, "aborted")
+        logger.warning("llm_stream_aborted", received_chars=len(parser.text), error=str(e))
+        raise
+    except asyncio.CancelledError:
+        limiter.release(ticket, "error")
+        metrics.record(ttft, None, "aborted")
+        raise
+    except Exception as e:
+        outcome = "throttled" if is_throttling_error(e) else "error"
+        limiter.release(ticket, outcome)
+        logger.warning("llm_call_failed", outcome=outcome, error=str(e))
+        raise
+    finally:
+        await stream.aclose()
+        record.add_attempt(ticket.waited, time.monotonic() - started)
+
+    total_tokens = usage.get("total_tokens") if isinstance(usage, dict) else None
+    limiter.release(ticket, "success", total_tokens)
+    if not parser.complete:
+        record.schema_aborts += 1
+        # A truncated or JSON-less completion is as broken as a wrong field type
+        metrics.record(ttft, None, "incomplete")
+        logger.warning("llm_stream_incomplete", received_chars=len(parser.text))
+        raise StreamSchemaError("stream ended before the JSON object was complete")
+    metrics.record(ttft, ttvj, "valid_json" if ttvj is not None else "incomplete", early_stop=True)
+    metadata = {"streamed": True, "ttft": ttft, "time_to_valid_json": ttvj}
+    if provider is not None:
+        metadata["provider"] = provider
+    return AIMessage(content="".join(parts), response_metadata=metadata, usage_metadata=usage)
+
+
+async def astream_llm(llm: Any, messages: List[Any], schema: Any = None,
+                      on_field: Optional[Callable[[str, Any], None]] = None,
+                      call_kwargs: Optional[Dict[str, Any]] = None,
+                      validate: Optional[Callable[[str], Any]] = None) -> Any:
+    """
+    Streaming counterpart of :func:`ainvoke_llm` for prompts that answer with one JSON object.
+
+    Top-level fields are passed to ``on_field`` (default: the callback set with
+    :func:`backend.llm.streaming.publish_stream_fields`) as soon as each value
+    is complete. A stream that breaks ``schema`` is cut off and requested
+    again under the shared retry policy. With ``LLM_STREAMING=0`` this is
+    plain :func:`ainvoke_llm`.
+
+    Args:
+        llm: A LangChain chat model
+        messages: The messages to send
+        schema: The pydantic model the output is parsed into; its field types
+            are checked while streaming and it is part of the cache key
+        on_field: Callback receiving (field, value) for every completed top-level field
+        call_kwargs: Extra request arguments for the model (e.g. ``response_format``)
+        validate: Check of the output against ``schema`` (raises ``ValueError``);
+            only outputs passing it are cached or replayed
+
+    Returns:
+        Any: An AIMessage with the full content; streamed responses carry
+        ``ttft`` and ``time_to_valid_json`` (seconds) in ``response_metadata``
+    """
+    if not LLM_STREAMING:
+        return await ainvoke_llm(llm, messages, schema, call_kwargs, validate)
+    if on_field is None:
+        on_field = stream_field_sink.get()
+
+    record = CallRecord()
+    cache, cache_key, cached = await _cache_lookup(llm, messages, schema, validate)
+    if cached is not None:
+        record.cache_hit = True
+        record.set_usage(cached, estimate_tokens(messages))
+        get_call_ledger().record(record)
+        if on_field is not None:
+            try:
+                for field, value in IncrementalJSONParser().feed(cached.content):
+                    on_field(field, value)
+            except StreamSchemaError:
+                pass
+        return cached
+
+    response = await _run_recorded(
+        lambda: _astream_once(llm, messages, schema, on_field, record, call_kwargs or {}), record, messages, "stream"
+    )
+    await _cache_store(cache, cache_key, llm, response.content, validate)
+    return response
+
+
+def invoke_llm(llm: Any, messages: List[Any], schema: Any = None) -> Any:
+    """
+    Synchronous counterpart of :func:`ainvoke_llm` for thread-based callers.
+
+    The request still runs on the shared runtime loop so it is governed by the
+    same cache and limiter as the async grading engine.
+    """
+    return run_sync(ainvoke_llm(llm, messages, schema))
+
+
+def stream_llm(llm: Any, messages: List[Any], schema: Any = None,
+               on_field: Optional[Callable[[str, Any], None]] = None) -> Any:
+    """Synchronous counterpart of :func:`astream_llm` for thread-based callers."""
+    return run_sync(astream_llm(llm, messages, schema, on_field))
@@ -0,0 +1,185 @@
+"""
+Process-wide LLM rate limiter with adaptive concurrency.
+
+All LLM call sites acquire a ticket here before sending a request. The limiter
+caps requests/min and tokens/min over a sliding window and adapts the number of
+concurrent requests AIMD-style: it grows additively while calls succeed and is
+cut multiplicatively when the provider throttles us (429 / 5xx).
+"""
+import os
+import time
+import asyncio
+import threading
+import structlog
+from collections import deque
+from typing import Dict, Any, Optional
+
+# Setup logger
+logger = structlog.get_logger()
+
+LLM_RPM = int(os.getenv("LLM_RPM", "600"))
+LLM_TPM = int(os.getenv("LLM_TPM", "1000000"))
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+LLM_INITIAL_CONCURRENCY = int(os.getenv("LLM_INITIAL_CONCURRENCY", "16"))
+
+# HTTP status codes treated as "provider is overloaded, back off"
+THROTTLING_STATUS_CODES = {429, 500, 502, 503, 504}
+THROTTLING_ERROR_NAMES = {"RateLimitError", "InternalServerError", "ServiceUnavailable", "ResourceExhausted"}
+
+
+def is_throttling_error(error: BaseException) -> bool:
+    """Return True if an exception means the provider is rate-limiting or overloaded."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status in THROTTLING_STATUS_CODES:
+        return True
+    return type(error).__name__ in THROTTLING_ERROR_NAMES
+
+
+class LimiterTicket:
+    """A granted slot; carries the token reservation so it can be reconciled on release."""
+
+    __slots__ = ("tokens", "entry", "acquired_at", "waited")
+
+    def __init__(self, tokens: int, entry: list, acquired_at: float, waited: float):
+        self.tokens = tokens
+        self.entry = entry
+        self.acquired_at = acquired_at
+        self.waited = waited
+
+
+class AdaptiveRateLimiter:
+    """
+    Sliding-window RPM/TPM limiter with an AIMD concurrency window.
+
+    Thread-safe; async callers poll without blocking the event loop.
+    """
+
+    def __init__(self,
+                 rpm: int = LLM_RPM,
+                 tpm: int = LLM_TPM,
+                 min_concurrency: int = LLM_MIN_CONCURRENCY,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 initial_concurrency: int = LLM_INITIAL_CONCURRENCY,
+                 additive_increase: float = 1.0,
+                 multiplicative_decrease: float = 0.5,
+                 decrease_cooldown: float = 2.0,
+                 window_seconds: float = 60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.decrease_cooldown = decrease_cooldown
+        self.window_seconds = window_seconds
+
+        self._lock = threading.Lock()
+        self._limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self._in_flight = 0
+        # Each entry is a mutable [timestamp, tokens] pair so releases can reconcile estimates
+        self._window: deque = deque()
+        self._window_tokens = 0
+        self._last_decrease = 0.0
+        self._stats = {"granted": 0, "succeeded": 0, "throttled": 0, "failed": 0, "wait_seconds": 0.0}
+
+    def _prune(self, now: float) -> None:
+        while self._window and now - self._window[0][0] >= self.window_seconds:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+
+    def _try_acquire(self, tokens: int, now: float) -> float:
+        """Grant a slot if possible; otherwise return how long to wait before retrying."""
+        self._prune(now)
+        if self._in_flight >= int(self._limit):
+            return 0.05
+        if len(self._window) >= self.rpm:
+            return max(0.01, self.window_seconds - (now - self._window[0][0]))
+        # A single request bigger than the whole TPM budget is let through on an empty window
+        if self._window and self._window_tokens + tokens > self.tpm:
+            return max(0.01, self.window_seconds - (now - self._window[0][0]))
+        return 0.0
+
+    def _grant(self, tokens: int, now: float, started: float) -> LimiterTicket:
+        entry = [now, tokens]
+        self._window.append(entry)
+        self._window_tokens += tokens
+        self._in_flight += 1
+        waited = now - started
+        self._stats["granted"] += 1
+        self._stats["wait_seconds"] += waited
+        return LimiterTicket(tokens, entry, now, waited)
+
+    async def acquire(self, tokens: int = 0) -> LimiterTicket:
+        """Wait (without blocking the event loop) until a slot is granted."""
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._try_acquire(tokens, now)
+                if wait <= 0:
+                    return self._grant(tokens, now, started)
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, ticket: LimiterTicket, outcome: str = "success", tokens_used: Optional[int] = None) -> None:
+        """
+        Return a slot and feed the call outcome into the AIMD controller.
+
+        Args:
+            ticket: The ticket returned by acquire()
+            outcome: "success", "throttled" or "error"
+            tokens_used: Actual token usage reported by the provider, if known
+        """
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            if tokens_used is not None and tokens_used >= 0:
+                # Reconcile the reservation if it is still inside the window
+                if self._window and ticket.entry[0] >= self._window[0][0]:
+                    self._window_tokens += tokens_used - ticket.entry[1]
+                ticket.entry[1] = tokens_used
+
+            if outcome == "success":
+                self._stats["succeeded"] += 1
+                # Additive increase: about +1 slot per window's worth of successes
+                self._limit = min(self.max_concurrency, self._limit + self.additive_increase / max(self._limit, 1.0))
+            elif outcome == "throttled":
+                self._stats["throttled"] += 1
+                now = time.monotonic()
+                # A burst of 429s from the same overload only counts once
+                if now - self._last_decrease >= self.decrease_cooldown:
+                    old_limit = self._limit
+                    self._limit = max(self.min_concurrency, self._limit * self.multiplicative_decrease)
+                    self._last_decrease = now
+                    logger.warning("llm_limiter_backoff", old_limit=round(old_limit, 2), new_limit=round(self._limit, 2))
+            else:
+                self._stats["failed"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the current window, concurrency limit and counters."""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            return {
+                "concurrency_limit": int(self._limit),
+                "concurrency_limit_exact": round(self._limit, 3),
+                "min_concurrency": self.min_concurrency,
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "window_seconds": self.window_seconds,
+                "requests_in_window": len(self._window),
+                "tokens_in_window": self._window_tokens,
+                "rpm_limit": self.rpm,
+                "tpm_limit": self.tpm,
+                "stats": dict(self._stats, wait_seconds=round(self._stats["wait_seconds"], 3)),
+            }
+
+
+# Single limiter shared by every LLM call site in the process
+rate_limiter = AdaptiveRateLimiter()
+
+
+def get_rate_limiter() -> AdaptiveRateLimiter:
+    """Return the process-wide LLM rate limiter."""
+    return rate_limiter
@@ -0,0 +1,247 @@
+"""
+Per-call accounting of LLM tokens, latency and cost.
+
+Every call made through :mod:`backend.llm.calls` produces one
+:class:`CallRecord` (prompt/completion tokens, limiter queue wait, network
+latency, retries, schema aborts) tagged with the job_id / q_id / question
+type / node set via :func:`tag_calls` by the code that triggered it. Records
+are aggregated per job by :class:`LLMCallLedger`, broken down by question
+type, node and q_id, so it is visible which questions drive cost and time.
+"""
+import os
+import time
+import threading
+import contextvars
+import structlog
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+# Setup logger
+logger = structlog.get_logger()
+
+# Price per 1000 tokens (in the provider's billing currency); 0 disables cost estimates
+LLM_PRICE_PROMPT_PER_1K = float(os.getenv("LLM_PRICE_PROMPT_PER_1K", "0.05"))
+LLM_PRICE_COMPLETION_PER_1K = float(os.getenv("LLM_PRICE_COMPLETION_PER_1K", "0.05"))
+# Jobs whose accounts are kept in memory
+LLM_METRICS_MAX_JOBS = int(os.getenv("LLM_METRICS_MAX_JOBS", "200"))
+
+# Tags (job_id, q_id, type, node, ...) attached to every call made in this context
+call_tags: contextvars.ContextVar = contextvars.ContextVar("llm_call_tags", default={})
+
+
+@contextmanager
+def tag_calls(**tags):
+    """Within this block, LLM call records carry ``tags`` (merged over the outer tags)."""
+    token = call_tags.set({**call_tags.get(), **tags})
+    try:
+        yield
+    finally:
+        call_tags.reset(token)
+
+
+def estimate_text_tokens(text: Any) -> int:
+    """Same two-characters-per-token heuristic as the rate limiter uses for prompts."""
+    return len(text if isinstance(text, str) else str(text)) // 2 + 1
+
+
+def response_usage(response: Any) -> Optional[Dict[str, int]]:
+    """Return provider-reported prompt/completion (and prefix-cached prompt) tokens of a response, or None."""
+    usage = getattr(response, "usage_metadata", None)
+    if isinstance(usage, dict) and usage.get("input_tokens") is not None:
+        cached = (usage.get("input_token_details") or {}).get("cache_read") or 0
+        return {"prompt": usage.get("input_tokens", 0), "completion": usage.get("output_tokens", 0), "cached": cached}
+    token_usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    if token_usage.get("prompt_tokens") is not None:
+        cached = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        return {"prompt": token_usage.get("prompt_tokens", 0), "completion": token_usage.get("completion_tokens", 0),
+                "cached": cached}
+    return None
+
+
+class CallRecord:
+    """Accounting of one logical LLM call (all of its attempts)."""
+
+    __slots__ = (
+        "tags", "queue_wait", "latency", "attempts", "schema_aborts",
+        "prompt_tokens", "completion_tokens", "cached_prompt_tokens", "estimated", "cache_hit", "provider", "outcome",
+    )
+
+    def __init__(self, tags: Optional[Dict[str, Any]] = None):
+        self.tags = dict(call_tags.get() if tags is None else tags)
+        self.queue_wait = 0.0
+        self.latency = 0.0
+        self.attempts = 0
+        self.schema_aborts = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Prompt tokens the provider served from its prompt prefix cache
+        self.cached_prompt_tokens = 0
+        self.estimated = False
+        self.cache_hit = False
+        self.provider: Optional[str] = None
+        self.outcome = "success"
+
+    def add_attempt(self, queue_wait: float, latency: float) -> None:
+        self.attempts += 1
+        self.queue_wait += queue_wait
+        self.latency += latency
+
+    def set_usage(self, response: Any, prompt_estimate: int) -> None:
+        """Take token counts from the response metadata, or estimate them."""
+        usage = response_usage(response)
+        if usage is None:
+            self.prompt_tokens = prompt_estimate
+            self.completion_tokens = estimate_text_tokens(getattr(response, "content", ""))
+            self.estimated = True
+        else:
+            self.prompt_tokens = usage["prompt"]
+            self.completion_tokens = usage["completion"]
+            self.cached_prompt_tokens = usage["cached"]
+        metadata = getattr(response, "response_metadata", None) or {}
+        self.provider = metadata.get("provider", self.provider)
+
+    @property
+    def cost(self) -> float:
+        if self.cache_hit:
+            return 0.0
+        return (self.prompt_tokens * LLM_PRICE_PROMPT_PER_1K + self.completion_tokens * LLM_PRICE_COMPLETION_PER_1K) / 1000
+
+
+class _Bucket:
+    """Running totals for one slice (a question type, a node, a q_id or the whole job)."""
+
+    __slots__ = ("calls", "attempts", "retries", "schema_aborts", "parse_failures", "cache_hits", "failures",
+                 "estimated", "prompt_tokens", "completion_tokens", "cached_prompt_tokens", "cost", "queue_wait", "latency", "latencies")
+
+    def __init__(self):
+        self.calls = self.attempts = self.retries = self.schema_aborts = self.parse_failures = 0
+        self.cache_hits = self.failures = self.estimated = 0
+        self.prompt_tokens = self.completion_tokens = self.cached_prompt_tokens = 0
+        self.cost = self.queue_wait = self.latency = 0.0
+        self.latencies: deque = deque(maxlen=10000)
+
+    def add(self, record: CallRecord) -> None:
+        self.calls += 1
+        self.attempts += record.attempts
+        self.retries += max(0, record.attempts - 1)
+        self.schema_aborts += record.schema_aborts
+        self.cache_hits += 1 if record.cache_hit else 0
+        self.failures += 1 if record.outcome != "success" else 0
+        self.estimated += 1 if record.estimated else 0
+        self.prompt_tokens += record.prompt_tokens
+        self.completion_tokens += record.completion_tokens
+        self.cached_prompt_tokens += record.cached_prompt_tokens
+        self.cost += record.cost
+        self.queue_wait += record.queue_wait
+        self.latency += record.latency
+        if not record.cache_hit:
+            self.latencies.append(record.latency)
+
+    def as_dict(self) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        network_calls = len(latencies)
+        return {
+            "calls": self.calls,
+            "attempts": self.attempts,
+            "retries": self.retries,
+            "schema_aborts": self.schema_aborts,
+            "parse_failures": self.parse_failures,
+            "cache_hits": self.cache_hits,
+            "failures": self.failures,
+            "estimated_token_calls": self.estimated,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "cost": round(self.cost, 6),
+            "queue_wait_seconds": round(self.queue_wait, 3),
+            "latency_seconds": round(self.latency, 3),
+            "latency_mean": round(self.latency / network_calls, 4) if network_calls else None,
+            "latency_p95": round(latencies[min(network_calls - 1, int(0.95 * network_calls))], 4) if network_calls else None,
+        }
+
+
+class _JobAccount:
+    def __init__(self):
+        self.created = time.time()
+        self.total = _Bucket()
+        self.by_type: Dict[str, _Bucket] = {}
+        self.by_node: Dict[str, _Bucket] = {}
+        self.by_question: Dict[str, _Bucket] = {}
+        self.by_provider: Dict[str, _Bucket] = {}
+
+    def buckets(self, tags: Dict[str, Any]) -> List[_Bucket]:
+        return [
+            self.total,
+            self.by_type.setdefault(str(tags.get("type")), _Bucket()),
+            self.by_node.setdefault(str(tags.get("node")), _Bucket()),
+            self.by_question.setdefault(str(tags.get("q_id")), _Bucket()),
+        ]
+
+
+class LLMCallLedger:
+    """
+    Aggregates call records per job (records without a job_id go to ``"_global"``).
+
+    Args:
+        max_jobs: Job accounts kept; the oldest is dropped first
+    """
+
+    def __init__(self, max_jobs: int = LLM_METRICS_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, _JobAccount]" = OrderedDict()
+
+    def _account(self, job_id: str) -> _JobAccount:
+        account = self._jobs.get(job_id)
+        if account is None:
+            account = self._jobs[job_id] = _JobAccount()
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        return account
+
+    def record(self, record: CallRecord) -> None:
+        job_id = str(record.tags.get("job_id") or "_global")
+        with self._lock:
+            account = self._account(job_id)
+            buckets = account.buckets(record.tags)
+            if record.provider is not None:
+                buckets.append(account.by_provider.setdefault(record.provider, _Bucket()))
+            for bucket in buckets:
+                bucket.add(record)
+        logger.debug("llm_call_recorded", job_id=job_id, node=record.tags.get("node"), q_id=record.tags.get("q_id"),
+                     prompt_tokens=record.prompt_tokens, completion_tokens=record.completion_tokens,
+                     attempts=record.attempts, latency=round(record.latency, 3), cache_hit=record.cache_hit)
+
+    def record_parse_failure(self, tags: Optional[Dict[str, Any]] = None) -> None:
+        """Count an LLM output the caller could not parse (tags default to the current context)."""
+        tags = call_tags.get() if tags is None else tags
+        job_id = str(tags.get("job_id") or "_global")
+        with self._lock:
+            for bucket in self._account(job_id).buckets(tags):
+                bucket.parse_failures += 1
+
+    def summary(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Totals plus per-type, per-node and per-question breakdowns of a job, or None if unknown."""
+        with self._lock:
+            account = self._jobs.get(job_id)
+            if account is None:
+                return None
+            return {
+                "job_id": job_id,
+                "total": account.total.as_dict(),
+                "by_type": {name: bucket.as_dict() for name, bucket in account.by_type.items()},
+                "by_node": {name: bucket.as_dict() for name, bucket in account.by_node.items()},
+                "by_question": {name: bucket.as_dict() for name, bucket in account.by_question.items()},
+                "by_provider": {name: bucket.as_dict() for name, bucket in account.by_provider.items()},
+                "pricing_per_1k": {"prompt": LLM_PRICE_PROMPT_PER_1K, "completion": LLM_PRICE_COMPLETION_PER_1K},
+            }
+
+
+call_ledger = LLMCallLedger()
+
+
+def get_call_ledger() -> LLMCallLedger:
+    """Return the process-wide LLM call ledger."""
+    return call_ledger
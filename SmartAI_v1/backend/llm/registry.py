@@ -0,0 +1,179 @@
+"""
+Registry of pooled LLM clients keyed by provider/model.
+
+One chat-model instance is built per (provider, model, temperature) and reused
+by every request. All OpenAI-compatible clients share a single HTTP connection
+pool with keep-alive (one sync ``httpx.Client`` and one ``httpx.AsyncClient``),
+so TLS handshakes and client construction are paid once per process instead of
+once per answer.
+"""
+import os
+import asyncio
+import threading
+import structlog
+from typing import Dict, Any, Optional, Tuple
+
+import httpx
+
+# Setup logger
+logger = structlog.get_logger()
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "50"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+LLM_WARM_CONNECTIONS = int(os.getenv("LLM_WARM_CONNECTIONS", "4"))
+
+
+class LLMClientRegistry:
+    """
+    Thread-safe, async-safe cache of chat-model clients.
+
+    Args:
+        providers: Provider configs keyed by name. OpenAI-compatible entries need
+            ``kind="openai"``, ``api_key``, ``base_url`` and ``model``; Gemini
+            entries need ``kind="gemini"``, ``api_key`` and ``model``.
+        default_provider: Provider used when none is requested
+    """
+
+    def __init__(self, providers: Dict[str, Dict[str, Any]], default_provider: str = "zhipu"):
+        self.providers = providers
+        self.default_provider = default_provider
+        self._clients: Dict[Tuple[str, str, float], Any] = {}
+        self._lock = threading.Lock()
+        self._http_client: Optional[httpx.Client] = None
+        self._http_async_client: Optional[httpx.AsyncClient] = None
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        )
+
+    @property
+    def http_client(self) -> httpx.Client:
+        """The shared synchronous connection pool."""
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(limits=self._limits(), timeout=None)
+            return self._http_client
+
+    @property
+    def http_async_client(self) -> httpx.AsyncClient:
+        """The shared asynchronous connection pool (used from the runtime loop)."""
+        with self._lock:
+            if self._http_async_client is None:
+                self._http_async_client = httpx.AsyncClient(limits=self._limits(), timeout=None)
+            return self._http_async_client
+
+    def _build(self, provider: str, model: str, temperature: float) -> Any:
+        config = self.providers[provider]
+        kind = config.get("kind", "openai")
+
+        if kind == "openai":
+            from langchain_openai import ChatOpenAI
+            if not config.get("api_key"):
+                logger.error("llm_api_key_missing", provider=provider)
+            return ChatOpenAI(
+                model=model,
+                temperature=temperature,
+                api_key=config.get("api_key"),
+                base_url=config.get("base_url"),
+                # Streamed responses end with a usage chunk; without it every streamed call is estimated
+                stream_usage=True,
+                http_client=self.http_client,
+                http_async_client=self.http_async_client,
+            )
+
+        if kind == "gemini":
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            return ChatGoogleGenerativeAI(
+                model=model,
+                temperature=temperature,
+                google_api_key=config.get("api_key"),
+            )
+
+        raise ValueError(f"Unknown LLM provider kind: {kind}")
+
+    def get(self, provider: Optional[str] = None, model: Optional[str] = None, temperature: float = 0.0) -> Any:
+        """
+        Get (building on first use) the shared client for a provider/model.
+
+        Args:
+            provider: Provider name from the registry config; defaults to ``default_provider``
+            model: Model name; defaults to the provider's configured model
+            temperature: Sampling temperature
+
+        Returns:
+            Any: A LangChain chat model, or None if it could not be built
+        """
+        provider = provider or self.default_provider
+        if provider not in self.providers:
+            raise ValueError(f"Unknown LLM provider: {provider}")
+        model = model or self.providers[provider].get("model")
+        key = (provider, model, temperature)
+
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        # http_client/http_async_client take the lock themselves, so build outside it
+        try:
+            client = self._build(provider, model, temperature)
+        except Exception as e:
+            logger.error("llm_client_init_failed", provider=provider, model=model, error=str(e))
+            return None
+
+        with self._lock:
+            # Another thread may have won the race; keep the first instance
+            client = self._clients.setdefault(key, client)
+        logger.info("llm_client_registered", provider=provider, model=model)
+        return client
+
+    async def awarmup(self, connections: int = LLM_WARM_CONNECTIONS, timeout: float = 10.0) -> int:
+        """
+        Open keep-alive connections to every OpenAI-compatible endpoint.
+
+        Must run on the LLM runtime loop, which owns the async connection pool.
+
+        Args:
+            connections: Number of parallel connections to open per endpoint
+            timeout: Per-request timeout in seconds
+
+        Returns:
+            int: Number of warm-up requests that reached the server
+        """
+        # Build the default client up front so the first request does not pay for it
+        self.get()
+        client = self.http_async_client
+        targets = {}
+        for name, config in self.providers.items():
+            if config.get("kind", "openai") == "openai" and config.get("base_url"):
+                targets[config["base_url"].rstrip("/")] = config.get("api_key")
+
+        async def _touch(base_url: str, api_key: Optional[str]) -> bool:
+            try:
+                # Any HTTP response means the TCP/TLS connection is now pooled
+                await client.get(f"{base_url}/models", headers={"Authorization": f"Bearer {api_key}"}, timeout=timeout)
+                return True
+            except Exception as e:
+                logger.warning("llm_warmup_failed", base_url=base_url, error=str(e))
+                return False
+
+        outcomes = await asyncio.gather(
+            *(_touch(url, key) for url, key in targets.items() for _ in range(max(1, connections)))
+        )
+        warmed = sum(1 for ok in outcomes if ok)
+        logger.info("llm_warmup_complete", endpoints=len(targets), connections=warmed)
+        return warmed
+
+    async def aclose(self) -> None:
+        """Close the shared connection pools and forget all clients."""
+        with self._lock:
+            sync_client, async_client = self._http_client, self._http_async_client
+            self._http_client = self._http_async_client = None
+            self._clients.clear()
+        if sync_client is not None:
+            sync_client.close()
+        if async_client is not None:
+            await async_client.aclose()
@@ -0,0 +1,262 @@
+"""
+Shared retry policy for LLM calls: capped exponential backoff with jitter,
+per-call and per-job deadlines, and optional hedged requests.
+
+Every attempt gets a timeout (bounded by the remaining job deadline, if one is
+set with :func:`job_deadline`), so a stalled socket cannot hold a grading
+slot for minutes. With hedging enabled, an attempt that is still running when
+it passes the observed latency percentile gets a duplicate request and the
+first answer wins. Per-attempt outcomes are counted in :class:`RetryMetrics`.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+import structlog
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Callable, Awaitable
+
+from backend.llm.limiter import is_throttling_error
+from backend.llm.streaming import StreamSchemaError
+
+# Setup logger
+logger = structlog.get_logger()
+
+LLM_RETRY_MAX_ATTEMPTS = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "20.0"))
+# Upper bound on a single attempt (a streamed response included)
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "90"))
+# Default deadline of a grading job in seconds; 0 disables it
+LLM_JOB_DEADLINE = float(os.getenv("LLM_JOB_DEADLINE", "0"))
+LLM_HEDGING = os.getenv("LLM_HEDGING", "0") not in ("0", "false", "False")
+# Latency percentile after which a duplicate request is fired
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+# Successful attempts observed before hedging starts
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Monotonic time by which the current job must be finished (None: no deadline)
+job_deadline_at: contextvars.ContextVar = contextvars.ContextVar("llm_job_deadline_at", default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """The job deadline leaves no time for another attempt."""
+
+
+@contextmanager
+def job_deadline(seconds: Optional[float]):
+    """
+    Bound all LLM calls made within this block by a shared deadline.
+
+    A nested block can only shorten the deadline, never extend it.
+
+    Args:
+        seconds: Time budget from now; None or 0 leaves the current deadline in place
+    """
+    current = job_deadline_at.get()
+    deadline = current
+    if seconds:
+        deadline = time.monotonic() + seconds
+        if current is not None:
+            deadline = min(deadline, current)
+    token = job_deadline_at.set(deadline)
+    try:
+        yield
+    finally:
+        job_deadline_at.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the job deadline, or None if there is none."""
+    deadline = job_deadline_at.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def classify_error(error: BaseException) -> str:
+    """Map an attempt's exception to its metrics outcome."""
+    if isinstance(error, DeadlineExceeded):
+        return "deadline"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(error, StreamSchemaError):
+        return "schema"
+    if is_throttling_error(error):
+        return "throttled"
+    return "error"
+
+
+class RetryMetrics:
+    """Per-attempt outcome counters plus the latency samples hedging is based on."""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._counts = {
+            "calls": 0, "attempts": 0, "success": 0, "timeout": 0, "throttled": 0, "schema": 0,
+            "error": 0, "deadline": 0, "gave_up": 0, "hedges_fired": 0, "hedges_won": 0,
+        }
+
+    def record_call(self) -> None:
+        with self._lock:
+            self._counts["calls"] += 1
+
+    def record_attempt(self, outcome: str, latency: Optional[float] = None) -> None:
+        with self._lock:
+            self._counts["attempts"] += 1
+            self._counts[outcome] += 1
+            if outcome == "success" and latency is not None:
+                self._latencies.append(latency)
+
+    def record(self, counter: str) -> None:
+        with self._lock:
+            self._counts[counter] += 1
+
+    def latency_percentile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        """The q-th latency percentile of successful attempts, once enough samples exist."""
+        with self._lock:
+            if len(self._latencies) < max(1, min_samples):
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        latency_p50 = self.latency_percentile(0.5)
+        latency_p95 = self.latency_percentile(0.95)
+        with self._lock:
+            return dict(
+                self._counts,
+                latency_p50=round(latency_p50, 4) if latency_p50 is not None else None,
+                latency_p95=round(latency_p95, 4) if latency_p95 is not None else None,
+            )
+
+
+class RetryPolicy:
+    """
+    How LLM calls are retried.
+
+    Args:
+        max_attempts: Attempts per call, the first one included
+        base_delay: Backoff cap of the first retry in seconds
+        max_delay: Upper bound of any backoff
+        call_timeout: Timeout of a single attempt in seconds
+        hedging: Whether slow attempts get a duplicate request
+        hedge_percentile: Latency percentile that triggers the duplicate
+        hedge_min_samples: Successful attempts needed before hedging starts
+        metrics: Where attempt outcomes are recorded
+    """
+
+    def __init__(self, max_attempts: int = LLM_RETRY_MAX_ATTEMPTS, base_delay: float = LLM_RETRY_BASE_DELAY,
+                 max_delay: float = LLM_RETRY_MAX_DELAY, call_timeout: float = LLM_CALL_TIMEOUT,
+                 hedging: bool = LLM_HEDGING, hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+                 hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES, metrics: Optional[RetryMetrics] = None):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.call_timeout = call_timeout
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.metrics = metrics or RetryMetrics()
+
+    def backoff(self, retry: int) -> float:
+        """Full-jitter delay before the given retry (1 for the first retry)."""
+        cap = min(self.max_delay, self.base_delay * (2 ** (retry - 1)))
+        return random.uniform(0, cap)
+
+    def _attempt_timeout(self) -> float:
+        remaining = remaining_time()
+        if remaining is None:
+            return self.call_timeout
+        if remaining <= 0:
+            raise DeadlineExceeded("job deadline exceeded")
+        return min(self.call_timeout, remaining)
+
+    async def _hedged(self, make_call: Callable[[], Awaitable[Any]], timeout: float) -> Any:
+        """Run one attempt, firing a duplicate if it is slower than the hedge threshold."""
+        threshold = None
+        if self.hedging:
+            threshold = self.metrics.latency_percentile(self.hedge_percentile, self.hedge_min_samples)
+        if threshold is None or threshold >= timeout:
+            return await asyncio.wait_for(make_call(), timeout)
+
+        started = time.monotonic()
+        primary = asyncio.ensure_future(make_call())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=threshold)
+            if not done:
+                self.metrics.record("hedges_fired")
+                logger.info("llm_hedge_fired", after=round(threshold, 3))
+                tasks.add(asyncio.ensure_future(make_call()))
+            error: Optional[BaseException] = None
+            while tasks:
+                left = timeout - (time.monotonic() - started)
+                if left <= 0:
+                    raise asyncio.TimeoutError()
+                done, _ = await asyncio.wait(tasks, timeout=left, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise asyncio.TimeoutError()
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.metrics.record("hedges_won")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def call(self, make_call: Callable[[], Awaitable[Any]], label: str = "llm") -> Any:
+        """
+        Run ``make_call()`` under this policy.
+
+        Args:
+            make_call: Factory returning a fresh awaitable for each attempt
+            label: Name used in log events
+
+        Returns:
+            Any: The first successful result
+
+        Raises:
+            Exception: The last attempt's error once attempts or the job deadline run out
+        """
+        self.metrics.record_call()
+        attempt = 0
+        while True:
+            attempt += 1
+            started = time.monotonic()
+            try:
+                result = await self._hedged(make_call, self._attempt_timeout())
+            except Exception as e:
+                outcome = classify_error(e)
+                self.metrics.record_attempt(outcome)
+                if outcome == "deadline" or attempt >= self.max_attempts:
+                    self.metrics.record("gave_up")
+                    logger.warning("llm_retry_gave_up", label=label, attempts=attempt, outcome=outcome, error=str(e))
+                    raise
+                delay = self.backoff(attempt)
+                remaining = remaining_time()
+                if remaining is not None and remaining <= delay:
+                    self.metrics.record("gave_up")
+                    logger.warning("llm_retry_gave_up", label=label, attempts=attempt, outcome="deadline", error=str(e))
+                    raise
+                logger.warning("llm_attempt_failed", label=label, attempt=attempt, outcome=outcome,
+                               retry_in=round(delay, 2), error=str(e))
+                await asyncio.sleep(delay)
+                continue
+            self.metrics.record_attempt("success", time.monotonic() - started)
+            return result
+
+
+# Policy shared by every LLM call site in the process
+retry_policy = RetryPolicy()
+
+
+def get_retry_policy() -> RetryPolicy:
+    """Return the process-wide LLM retry policy."""
+    return retry_policy
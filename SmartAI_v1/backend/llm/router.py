@@ -0,0 +1,283 @@
+"""
+Weighted routing of LLM traffic across providers/API keys with circuit breakers.
+
+:class:`RoutedLLM` looks like a chat model to the call layer (``ainvoke`` /
+``astream``) but sends every request to a provider picked by
+:class:`LLMRouter`: weighted random over the providers whose
+:class:`CircuitBreaker` is closed. A breaker opens on an error spike and
+sends traffic to the healthy providers; after a cooldown it lets one probe
+request through (half-open) and closes again if the probe succeeds. Adding
+API keys as extra providers raises the total grading throughput.
+"""
+import os
+import time
+import random
+import threading
+import structlog
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple
+
+# Setup logger
+logger = structlog.get_logger()
+
+# Breaker trips when the error rate over the window exceeds this...
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+# ...and at least this many requests were seen in the window
+LLM_BREAKER_MIN_REQUESTS = int(os.getenv("LLM_BREAKER_MIN_REQUESTS", "10"))
+# Consecutive failures that trip the breaker regardless of the rate
+LLM_BREAKER_CONSECUTIVE_FAILURES = int(os.getenv("LLM_BREAKER_CONSECUTIVE_FAILURES", "5"))
+LLM_BREAKER_WINDOW_SECONDS = float(os.getenv("LLM_BREAKER_WINDOW_SECONDS", "60"))
+LLM_BREAKER_COOLDOWN_SECONDS = float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def parse_routes(spec: str) -> Dict[str, float]:
+    """
+    Parse a route spec such as ``"zhipu:3,zhipu_2:1,gemini:0.5"``.
+
+    Args:
+        spec: Comma-separated ``provider[:weight]`` entries (weight defaults to 1)
+
+    Returns:
+        Dict[str, float]: Weight per provider name
+    """
+    routes: Dict[str, float] = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, weight = entry.partition(":")
+        routes[name.strip()] = float(weight) if weight else 1.0
+    return routes
+
+
+class CircuitBreaker:
+    """
+    Per-provider breaker over a sliding window of request outcomes.
+
+    Args:
+        error_rate: Error rate that trips the breaker
+        min_requests: Requests in the window before the rate is considered
+        consecutive_failures: Failures in a row that trip the breaker
+        window_seconds: Length of the outcome window
+        cooldown_seconds: Time an open breaker waits before a probe
+    """
+
+    def __init__(self, error_rate: float = LLM_BREAKER_ERROR_RATE, min_requests: int = LLM_BREAKER_MIN_REQUESTS,
+                 consecutive_failures: int = LLM_BREAKER_CONSECUTIVE_FAILURES,
+                 window_seconds: float = LLM_BREAKER_WINDOW_SECONDS,
+                 cooldown_seconds: float = LLM_BREAKER_COOLDOWN_SECONDS):
+        self.error_rate = error_rate
+        self.min_requests = min_requests
+        self.consecutive_failures = consecutive_failures
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self._failures_in_row = 0
+        self._probe_in_flight = False
+        # (timestamp, succeeded)
+        self._window: deque = deque()
+
+    def _prune(self, now: float) -> None:
+        while self._window and now - self._window[0][0] > self.window_seconds:
+            self._window.popleft()
+
+    def allows(self, now: float) -> bool:
+        """Whether a request may be sent now (an open breaker turns half-open after the cooldown)."""
+        if self.state == OPEN and now - self.opened_at >= self.cooldown_seconds:
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == HALF_OPEN:
+            return not self._probe_in_flight
+        return self.state == CLOSED
+
+    def on_dispatch(self) -> None:
+        if self.state == HALF_OPEN:
+            self._probe_in_flight = True
+
+    def cancel_probe(self) -> None:
+        self._probe_in_flight = False
+
+    def record(self, succeeded: bool, now: float) -> None:
+        self._window.append((now, succeeded))
+        self._prune(now)
+        if succeeded:
+            self._failures_in_row = 0
+            if self.state == HALF_OPEN:
+                self.state = CLOSED
+                self._window.clear()
+            return
+
+        self._failures_in_row += 1
+        if self.state == HALF_OPEN:
+            self._trip(now)
+            return
+        failures = sum(1 for _, ok in self._window if not ok)
+        if self._failures_in_row >= self.consecutive_failures or (
+            len(self._window) >= self.min_requests and failures / len(self._window) > self.error_rate
+        ):
+            self._trip(now)
+
+    def _trip(self, now: float) -> None:
+        self.state = OPEN
+        self.opened_at = now
+        self.trips += 1
+        self._probe_in_flight = False
+
+    def error_rate_now(self, now: float) -> float:
+        self._prune(now)
+        if not self._window:
+            return 0.0
+        return sum(1 for _, ok in self._window if not ok) / len(self._window)
+
+
+class LLMRouter:
+    """
+    Weighted provider selection with a circuit breaker and metrics per provider.
+
+    Args:
+        registry: The :class:`~backend.llm.registry.LLMClientRegistry` that builds the clients
+        routes: Weight per provider name (providers must exist in the registry)
+    """
+
+    def __init__(self, registry: Any, routes: Dict[str, float]):
+        self.registry = registry
+        self.routes = {name: weight for name, weight in routes.items() if weight > 0}
+        if not self.routes:
+            self.routes = {registry.default_provider: 1.0}
+        self._lock = threading.Lock()
+        self._breakers = {name: CircuitBreaker() for name in self.routes}
+        self._latencies = {name: deque(maxlen=500) for name in self.routes}
+        self._counts = {name: {"requests": 0, "successes": 0, "errors": 0} for name in self.routes}
+
+    def pick(self) -> Tuple[str, Any]:
+        """
+        Choose a provider for the next request.
+
+        Returns:
+            Tuple[str, Any]: (provider name, chat-model client)
+        """
+        now = time.monotonic()
+        with self._lock:
+            healthy = [name for name in self.routes if self._breakers[name].allows(now)]
+            if healthy:
+                weights = [self.routes[name] for name in healthy]
+                name = random.choices(healthy, weights=weights)[0]
+            else:
+                # Every breaker is open: use the one that will probe soonest rather than fail outright
+                name = min(self.routes, key=lambda n: self._breakers[n].opened_at)
+            self._breakers[name].on_dispatch()
+            self._counts[name]["requests"] += 1
+        client = self.registry.get(name)
+        if client is None:
+            self.record(name, False, None)
+            raise RuntimeError(f"LLM provider {name} is not available")
+        return name, client
+
+    def record(self, name: str, succeeded: bool, latency: Optional[float]) -> None:
+        """Record the outcome of a request sent to ``name``."""
+        now = time.monotonic()
+        with self._lock:
+            breaker = self._breakers[name]
+            previous = breaker.state
+            breaker.record(succeeded, now)
+            self._counts[name]["successes" if succeeded else "errors"] += 1
+            if succeeded and latency is not None:
+                self._latencies[name].append(latency)
+            state = breaker.state
+        if state != previous:
+            log = logger.warning if state == OPEN else logger.info
+            log("llm_breaker_state_changed", provider=name, previous=previous, state=state)
+
+    def release(self, name: str) -> None:
+        """Forget a dispatch whose outcome says nothing about the provider (e.g. a cancelled hedge)."""
+        with self._lock:
+            self._breakers[name].cancel_probe()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Per-provider weight, breaker state, error rate and latency percentiles."""
+        now = time.monotonic()
+        providers: Dict[str, Any] = {}
+        with self._lock:
+            for name, weight in self.routes.items():
+                breaker = self._breakers[name]
+                breaker.allows(now)
+                latencies = sorted(self._latencies[name])
+                providers[name] = dict(
+                    self._counts[name],
+                    weight=weight,
+                    state=breaker.state,
+                    trips=breaker.trips,
+                    window_error_rate=round(breaker.error_rate_now(now), 4),
+                    latency_p50=round(latencies[len(latencies) // 2], 4) if latencies else None,
+                    latency_p95=round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 4) if latencies else None,
+                )
+        return {"providers": providers}
+
+
+class RoutedLLM:
+    """
+    Chat-model facade that routes each request through an :class:`LLMRouter`.
+
+    Only ``ainvoke`` and ``astream`` are provided; every backend LLM call goes
+    through :mod:`backend.llm.calls`, which uses just these two.
+    """
+
+    def __init__(self, router: LLMRouter):
+        self.router = router
+        models = sorted({str(router.registry.providers[name].get("model")) for name in router.routes})
+        # Part of the response cache key; the same prompt on any routed provider shares one entry
+        self.model_name = "+".join(models)
+        self.temperature = 0.0
+
+    def _provider_kwargs(self, name: str, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """Drop ``response_format`` for providers that do not take it (the prompt still asks for JSON)."""
+        config = self.router.registry.providers[name]
+        if "response_format" in kwargs and not config.get("structured_output", config.get("kind", "openai") == "openai"):
+            return {key: value for key, value in kwargs.items() if key != "response_format"}
+        return kwargs
+
+    async def ainvoke(self, messages: List[Any], **kwargs) -> Any:
+        name, client = self.router.pick()
+        kwargs = self._provider_kwargs(name, kwargs)
+        started = time.monotonic()
+        try:
+            response = await client.ainvoke(messages, **kwargs)
+        except Exception:
+            self.router.record(name, False, None)
+            raise
+        except BaseException:
+            self.router.release(name)
+            raise
+        self.router.record(name, True, time.monotonic() - started)
+        response.response_metadata["provider"] = name
+        return response
+
+    async def astream(self, messages: List[Any], **kwargs):
+        name, client = self.router.pick()
+        kwargs = self._provider_kwargs(name, kwargs)
+        started = time.monotonic()
+        outcome = None
+        received = False
+        try:
+            async for chunk in client.astream(messages, **kwargs):
+                received = True
+                chunk.response_metadata["provider"] = name
+                yield chunk
+            outcome = True
+        except Exception:
+            outcome = False
+            raise
+        finally:
+            if outcome is None:
+                # Closed early by the consumer (complete JSON, schema abort or cancellation):
+                # the provider answered if any chunk arrived
+                if received:
+                    self.router.record(name, True, time.monotonic() - started)
+                else:
+                    self.router.release(name)
+            else:
+                self.router.record(name, outcome, time.monotonic() - started if outcome else None)
@@ -0,0 +1,99 @@
+"""
+Process-wide background event loop shared by all asynchronous LLM work.
+
+Every async LLM call (``ainvoke``) runs on this single loop, so async HTTP
+clients stay bound to one loop and synchronous callers (threads, CLI scripts)
+can still drive coroutines through :func:`run_sync`.
+"""
+import asyncio
+import threading
+import contextvars
+import concurrent.futures
+from typing import Any, Awaitable, Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """
+    Get the shared runtime loop, starting its daemon thread on first use.
+
+    Returns:
+        asyncio.AbstractEventLoop: The running background loop
+    """
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None or _LOOP.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="llm-runtime", daemon=True)
+            thread.start()
+            _LOOP = loop
+            logger.info("llm_runtime_started", thread=thread.name)
+    return _LOOP
+
+
+async def _run_in_context(values, coro: Awaitable[Any]) -> Any:
+    """Re-apply the caller's context variables inside the runtime task."""
+    for var, value in values:
+        var.set(value)
+    return await coro
+
+
+def submit(coro: Awaitable[Any]) -> concurrent.futures.Future:
+    """
+    Schedule a coroutine on the runtime loop from any thread.
+
+    The caller's ``contextvars`` are carried over to the scheduled task.
+
+    Args:
+        coro: The coroutine to run
+
+    Returns:
+        concurrent.futures.Future: Future resolving to the coroutine result
+    """
+    values = list(contextvars.copy_context().items())
+    return asyncio.run_coroutine_threadsafe(_run_in_context(values, coro), get_loop())
+
+
+def run_sync(coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """
+    Run a coroutine on the runtime loop and block until it finishes.
+
+    Args:
+        coro: The coroutine to run
+        timeout: Optional number of seconds to wait for the result
+
+    Returns:
+        Any: The coroutine result
+
+    Raises:
+        RuntimeError: If called from the runtime loop itself (would deadlock)
+    """
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is not None and running is _LOOP:
+        coro.close()
+        raise RuntimeError("run_sync() cannot be called from the LLM runtime loop; await the coroutine instead")
+    return submit(coro).result(timeout)
+
+
+async def run_async(coro: Awaitable[Any]) -> Any:
+    """
+    Await a coroutine on the runtime loop from another event loop (e.g. a FastAPI endpoint).
+
+    Args:
+        coro: The coroutine to run
+
+    Returns:
+        Any: The coroutine result
+    """
+    if asyncio.get_running_loop() is _LOOP:
+        return await coro
+    return await asyncio.wrap_future(submit(coro))
@@ -0,0 +1,313 @@
+"""
+Incremental JSON parsing of streamed LLM responses.
+
+Grading and segmentation prompts ask for a single JSON object. When the
+response is streamed, :class:`IncrementalJSONParser` follows the object as it
+arrives: every top-level field is published as soon as its value is complete
+(``score`` usually arrives first, well before the long ``steps`` array), and
+a stream that clearly breaks the expected schema (prose instead of JSON, an
+array where an object is expected, a wrong value type) is reported right
+away so the caller can abort and retry without waiting for the full
+completion. :class:`StreamMetrics` keeps time-to-first-token and
+time-to-valid-JSON samples.
+"""
+import os
+import re
+import json
+import threading
+import contextvars
+import structlog
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional, Set, Tuple, Callable
+
+# Setup logger
+logger = structlog.get_logger()
+
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") not in ("0", "false", "False")
+# Characters of non-JSON text tolerated before the opening brace
+LLM_STREAM_MAX_PREAMBLE = int(os.getenv("LLM_STREAM_MAX_PREAMBLE", "200"))
+# Seconds to keep reading after the JSON object closed, waiting for the provider's usage chunk
+LLM_STREAM_USAGE_WAIT = float(os.getenv("LLM_STREAM_USAGE_WAIT", "2.0"))
+
+# Markdown code fences are allowed around the JSON object
+CODE_FENCE = re.compile(r'```(?:json)?', re.IGNORECASE)
+
+# Receives (field, value) for every top-level field completed while streaming
+stream_field_sink: contextvars.ContextVar = contextvars.ContextVar("llm_stream_field_sink", default=None)
+
+
+@contextmanager
+def publish_stream_fields(callback: Optional[Callable[[str, Any], None]]):
+    """Within this block, streamed calls publish completed fields to ``callback``."""
+    token = stream_field_sink.set(callback)
+    try:
+        yield
+    finally:
+        stream_field_sink.reset(token)
+
+
+class StreamSchemaError(ValueError):
+    """The streamed output can no longer match the expected JSON schema."""
+
+
+def loads_lenient(text: str) -> Any:
+    """``json.loads`` that, like the node parsers, retries with LaTeX backslashes escaped."""
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json.loads(text.replace('\\', '\\\\'))
+
+
+def schema_field_types(schema: Any) -> Dict[str, Set[str]]:
+    """
+    Map each top-level field of a pydantic model to its allowed JSON types.
+
+    Args:
+        schema: A pydantic model class; anything else yields no constraints
+
+    Returns:
+        Dict[str, Set[str]]: Field name -> JSON types ("number", "string", "array", ...)
+    """
+    if not hasattr(schema, "model_json_schema"):
+        return {}
+    field_types: Dict[str, Set[str]] = {}
+    for name, prop in schema.model_json_schema().get("properties", {}).items():
+        options = prop.get("anyOf") or [prop]
+        types = set()
+        for option in options:
+            if "type" in option:
+                types.add(option["type"])
+            elif "$ref" in option:
+                types.add("object")
+        if types:
+            field_types[name] = types
+    return field_types
+
+
+def _start_matches(first: str, types: Set[str]) -> bool:
+    """Check the first character of a value against the allowed JSON types."""
+    if first == '"':
+        # LLMs often quote numbers; the final value check decides
+        return bool(types & {"string", "number", "integer"})
+    if first == '[':
+        return "array" in types
+    if first == '{':
+        return "object" in types
+    if first == 'n':
+        return "null" in types
+    if first in 'tf':
+        return "boolean" in types
+    return bool(types & {"number", "integer"})
+
+
+def _value_matches(value: Any, types: Set[str]) -> bool:
+    """Check a completed value against the allowed JSON types."""
+    if value is None:
+        return "null" in types
+    if isinstance(value, bool):
+        return "boolean" in types
+    if isinstance(value, (int, float)):
+        return bool(types & {"number", "integer"})
+    if isinstance(value, str):
+        if "string" in types:
+            return True
+        try:
+            float(value)
+            return True
+        except ValueError:
+            return False
+    if isinstance(value, list):
+        return "array" in types
+    return "object" in types
+
+
+class IncrementalJSONParser:
+    """
+    Character-level tracker of one top-level JSON object in a text stream.
+
+    Args:
+        field_types: Allowed JSON types per top-level field (see
+            :func:`schema_field_types`); unknown fields are not checked
+        max_preamble: Non-JSON characters tolerated before the opening brace
+    """
+
+    def __init__(self, field_types: Optional[Dict[str, Set[str]]] = None,
+                 max_preamble: int = LLM_STREAM_MAX_PREAMBLE):
+        self.field_types = field_types or {}
+        self.max_preamble = max_preamble
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.complete = False
+        self.result: Optional[Dict[str, Any]] = None
+        self._pos = 0
+        self._start: Optional[int] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # At depth 1: "key" -> "colon" -> "value" -> "value_end" -> "key" ...
+        self._expect = "key"
+        self._key_start = 0
+        self._key: Optional[str] = None
+        self._value_start = 0
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Consume the next piece of the stream.
+
+        Args:
+            chunk: Newly received text
+
+        Returns:
+            List[Tuple[str, Any]]: Top-level fields completed by this chunk
+
+        Raises:
+            StreamSchemaError: If the stream can no longer match the schema
+        """
+        if self.complete or not chunk:
+            return []
+        self.text += chunk
+        completed: List[Tuple[str, Any]] = []
+        text = self.text
+
+        while self._pos < len(text):
+            i = self._pos
+            ch = text[i]
+            self._pos += 1
+
+            if self._start is None:
+                if ch == '{':
+                    self._start = i
+                    self._depth = 1
+                elif ch == '[':
+                    raise StreamSchemaError("expected a JSON object, got an array")
+                elif len(CODE_FENCE.sub("", text[:i + 1]).strip()) > self.max_preamble:
+                    raise StreamSchemaError("no JSON object after %d characters" % self.max_preamble)
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == "key":
+                        self._key = text[self._key_start + 1:i]
+                        self._expect = "colon"
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    if self._expect == "key":
+                        self._key_start = i
+                    elif self._expect == "value":
+                        self._begin_value(i, ch)
+            elif ch in '{[':
+                if self._depth == 1 and self._expect == "value":
+                    self._begin_value(i, ch)
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._expect == "value_end":
+                        completed.append(self._end_value(i))
+                    self._finish(i)
+                    break
+            elif self._depth == 1:
+                if ch == ':' and self._expect == "colon":
+                    self._expect = "value"
+                elif ch == ',':
+                    if self._expect == "value_end":
+                        completed.append(self._end_value(i))
+                    self._expect = "key"
+                elif not ch.isspace() and self._expect == "value":
+                    self._begin_value(i, ch)
+
+        return [field for field in completed if field is not None]
+
+    def _begin_value(self, i: int, first: str) -> None:
+        self._value_start = i
+        self._expect = "value_end"
+        types = self.field_types.get(self._key)
+        if types and not _start_matches(first, types):
+            raise StreamSchemaError(f"field {self._key!r} should be {'/'.join(sorted(types))}")
+
+    def _end_value(self, i: int) -> Optional[Tuple[str, Any]]:
+        raw = self.text[self._value_start:i].strip()
+        try:
+            value = loads_lenient(raw)
+        except ValueError:
+            # Malformed values are left to the caller's own (more forgiving) parser
+            return None
+        types = self.field_types.get(self._key)
+        if types and not _value_matches(value, types):
+            raise StreamSchemaError(f"field {self._key!r} should be {'/'.join(sorted(types))}")
+        self.fields[self._key] = value
+        return self._key, value
+
+    def _finish(self, i: int) -> None:
+        self.complete = True
+        try:
+            result = loads_lenient(self.text[self._start:i + 1])
+            self.result = result if isinstance(result, dict) else None
+        except ValueError:
+            self.result = None
+
+
+def _percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 4)
+
+
+class StreamMetrics:
+    """Rolling time-to-first-token / time-to-valid-JSON samples and stream counters."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._ttft = deque(maxlen=window)
+        self._ttvj = deque(maxlen=window)
+        self._counts = {"streams": 0, "valid_json": 0, "incomplete": 0, "aborted": 0, "early_stops": 0}
+
+    def record(self, ttft: Optional[float], ttvj: Optional[float], outcome: str, early_stop: bool = False) -> None:
+        """
+        Record one finished stream.
+
+        Args:
+            ttft: Seconds until the first non-empty chunk
+            ttvj: Seconds until the JSON object was complete and valid
+            outcome: "valid_json", "incomplete" or "aborted"
+            early_stop: Whether trailing output after the object was skipped
+        """
+        with self._lock:
+            self._counts["streams"] += 1
+            self._counts[outcome] += 1
+            if early_stop:
+                self._counts["early_stops"] += 1
+            if ttft is not None:
+                self._ttft.append(ttft)
+            if ttvj is not None:
+                self._ttvj.append(ttvj)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            ttft, ttvj = list(self._ttft), list(self._ttvj)
+            return dict(
+                self._counts,
+                enabled=LLM_STREAMING,
+                ttft_p50=_percentile(ttft, 0.5),
+                ttft_p95=_percentile(ttft, 0.95),
+                time_to_valid_json_p50=_percentile(ttvj, 0.5),
+                time_to_valid_json_p95=_percentile(ttvj, 0.95),
+            )
+
+
+stream_metrics = StreamMetrics()
+
+
+def get_stream_metrics() -> StreamMetrics:
+    """Return the process-wide streaming metrics."""
+    return stream_metrics
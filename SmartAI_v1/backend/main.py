@@ -1,7 +1,10 @@
 # app/main.py
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from backend.routers import prob_preview, hw_preview, ai_grading, human_edit
+from backend.routers import prob_preview, hw_preview, ai_grading, human_edit, llm_status
+from backend.dependencies import llm_registry
+from backend.llm.runtime import run_async
+from backend.jobs.runner import GRADING_DURABLE_JOBS, GRADING_EMBEDDED_WORKER, worker_role_prefix, worker_is_alive
 # from app.db import init_db
 import logging
 
@@ -18,6 +21,7 @@ def create_app() -> FastAPI:
     app.include_router(hw_preview.router)   # 会自动挂载到 /file_preview（见 file_preview.py）
     app.include_router(ai_grading.router)   # 挂载到 /ai_grading
     app.include_router(human_edit.router)
+    app.include_router(llm_status.router)   # 挂载到 /llm，LLM 调用限流等运行状态
 
     # 允许所有来源的跨域请求，便于本地开发
     app.add_middleware(
@@ -28,6 +32,34 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
     )
 
+    @app.on_event("startup")
+    async def warm_llm_connections():
+        """预热共享 LLM 连接池，避免首批请求承担 TLS 握手和客户端构建的延迟。"""
+        try:
+            await run_async(llm_registry.awarmup())
+        except Exception as e:
+            logger.warning(f"LLM 连接预热失败（不影响启动）: {e}")
+
+    @app.on_event("startup")
+    async def resume_grading_jobs():
+        """重启后恢复未完成的批改任务：已退出的 API 进程领取但未完成的任务重新排队，由内嵌 worker 继续批改；仍在运行的同机 API 进程（如 uvicorn --workers）的任务不受影响。"""
+        if not (GRADING_DURABLE_JOBS and GRADING_EMBEDDED_WORKER):
+            return
+        worker = ai_grading.job_worker
+        requeued = worker.store.recover(worker_prefix=worker_role_prefix(worker.worker_id), is_alive=worker_is_alive)
+        if requeued:
+            logger.info(f"恢复了 {requeued} 个未完成的批改任务")
+        worker.start()
+
+    @app.on_event("shutdown")
+    async def stop_grading_worker():
+        if GRADING_DURABLE_JOBS and GRADING_EMBEDDED_WORKER:
+            ai_grading.job_worker.stop(timeout=10)
+
+    @app.on_event("shutdown")
+    async def close_llm_connections():
+        await run_async(llm_registry.aclose())
+
     return app
 
 app = create_app()
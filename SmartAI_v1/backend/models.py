@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, AliasChoices
 from typing import List, Optional, Any, Dict
 
 
@@ -18,4 +18,25 @@ class Correction(BaseModel):
     comment: str
     steps: List[StepScore]
     hits: Optional[List[str]] = None
-    logs: Optional[str] = None
\ No newline at end of file
+    logs: Optional[str] = None
+    # Hash of (q_id, type, rubric, normalized answer); a regrade reuses the Correction while it is unchanged
+    fingerprint: Optional[str] = None
+
+
+class StepOutput(BaseModel):
+    step_no: Optional[int] = None
+    desc: Optional[str] = None
+    comment: Optional[str] = None
+    is_correct: Optional[bool] = None
+    score: float = 0.0
+
+
+class GradingOutput(BaseModel):
+    """The JSON a grading node asks the LLM for: a Correction without q_id/type."""
+    # The proof prompt calls it "overall_score"
+    score: float = Field(validation_alias=AliasChoices("score", "overall_score"))
+    max_score: Optional[float] = None
+    confidence: Optional[float] = None
+    comment: Optional[str] = None
+    steps: List[StepOutput] = []
+    hits: Optional[List[str]] = None
@@ -1,19 +1,33 @@
 import time
+import json
+import gzip
 import uuid
+import hashlib
 import threading
 import logging
-import concurrent.futures
-from typing import Dict, List, Any
-from fastapi import APIRouter, Depends
+import zstandard
+from collections import OrderedDict
+from concurrent.futures import CancelledError
+from typing import Dict, List, Any, Optional, Literal, Tuple
+from fastapi import APIRouter, Depends, HTTPException, Request, Query, Header
+from fastapi.responses import StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from functools import lru_cache
 
 from backend.dependencies import get_problem_store, get_student_store, get_llm
 from backend.models import Correction
-from backend.correct.calc import calc_node
-from backend.correct.concept import concept_node
-from backend.correct.proof import proof_node
-from backend.correct.programming import programming_node
+from backend.correct.engine import grading_engine, GRADING_TASK_ORDER
+from backend.correct.batch import GRADING_BATCH_SIZE
+from backend.correct.scheduler import grading_job, PRIORITY_CLASSES
+from backend.correct.dedup import dedup_key, answer_fingerprint, reusable_corrections
+from backend.llm.runtime import run_sync
+from backend.llm import cache as llm_cache
+from backend.llm.retry import job_deadline, LLM_JOB_DEADLINE
+from backend.llm.metrics import tag_calls, get_call_ledger
+from backend.jobs.store import get_job_store, job_fingerprint, GRADING_IDEMPOTENCY_TTL_SECONDS
+from backend.jobs.runner import JobWorker, worker_name, GRADING_DURABLE_JOBS
+from backend.jobs.events import get_job_events, GRADING_EVENTS_POLL_SECONDS
+from backend.jobs.results import ResultStore, ENCODINGS, FINAL_STATUSES, dump_json
 
 # Setup logger
 logger = logging.getLogger(__name__)
@@ -23,197 +37,75 @@ router = APIRouter(
     tags=["ai_grading"]
 )
 
-# Store for grading results
-GRADING_RESULTS: Dict[str, Any] = {}
+# Store for grading results (finished ones compressed, cold ones spilled to disk)
+GRADING_RESULTS = ResultStore()
+
+# In-memory jobs (GRADING_DURABLE_JOBS=0) matched to repeated requests: idempotency key -> (job_id, fingerprint,
+# created at), and fingerprint -> job_id while the job is pending; durable jobs keep both in the job store
+LEGACY_IDEMPOTENCY_KEYS: Dict[str, Tuple[str, str, float]] = {}
+LEGACY_IN_FLIGHT: Dict[str, str] = {}
+SUBMIT_LOCK = threading.Lock()
+# Students graded so far by running in-memory batch jobs, in completion order (durable jobs use the job store),
+# and the completion order (student ids) of recently finished ones, so ``since`` cursors stay valid
+LEGACY_PARTIAL_RESULTS: Dict[str, List[Dict[str, Any]]] = {}
+LEGACY_COMPLETION_ORDER: Dict[str, List[str]] = OrderedDict()
+LEGACY_COMPLETION_ORDER_MAX_JOBS = 200
+
+def store_legacy_result(job_id: str, result: Dict[str, Any]) -> bool:
+    """Store the final result of an in-memory job unless it is no longer pending (e.g. cancelled meanwhile)."""
+    with SUBMIT_LOCK:
+        if (GRADING_RESULTS.get(job_id) or {}).get("status") != "pending":
+            logger.info(f"Grading task {job_id} is no longer pending; keeping its stored status")
+            return False
+        GRADING_RESULTS[job_id] = result
+        return True
 
 # Add a function to get all job IDs for debugging
 def get_all_job_ids():
     return list(GRADING_RESULTS.keys())
 
-# Cache for LLM clients to avoid repeated initialization
-LLM_CLIENT_CACHE: Dict[int, Any] = {}
-
-# Cache for processed rubrics to avoid redundant processing
-@lru_cache(maxsize=128)
-def get_processed_rubric(q_id: str, rubric_text: str) -> str:
-    """Cache processed rubrics to avoid redundant processing."""
-    # In a real implementation, this could do more complex processing
-    # For now, we just return the rubric as-is but cache it
-    return rubric_text
-
 class GradingRequest(BaseModel):
     student_id: str
+    # Skip LLM response cache lookups for this job (fresh responses are still cached)
+    bypass_cache: bool = False
+    # Time budget of the whole job in seconds; LLM calls stop retrying once it runs out
+    deadline_seconds: Optional[float] = None
+    # Interactive jobs run ahead of batch work in the job and task queues
+    priority: Literal["interactive", "batch"] = "interactive"
 
 class BatchGradingRequest(BaseModel):
-    # Empty for now, but could include options for batch grading
-    pass
-
-def get_cached_llm():
-    """Get a cached LLM client instance to avoid repeated initialization."""
-    thread_id = threading.get_ident()
-    if thread_id not in LLM_CLIENT_CACHE:
-        # Import here to avoid circular imports
-        from langchain_openai import ChatOpenAI
-        import os
-        OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "66ea05a8d4484dbd98063dbde387149d.pCG80vNPAyKrdmBq")
-        OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://open.bigmodel.cn/api/paas/v4")
-        OPENAI_MODEL = os.getenv("OPENAI_MODEL", "glm-4-plus")
-        
-        LLM_CLIENT_CACHE[thread_id] = ChatOpenAI(
-            model=OPENAI_MODEL,
-            temperature=0.0,
-            api_key=OPENAI_API_KEY,
-            base_url=OPENAI_API_BASE,
-        )
-    return LLM_CLIENT_CACHE[thread_id]
+    # Skip LLM response cache lookups for this job (fresh responses are still cached)
+    bypass_cache: bool = False
+    # Grade identical (normalized) answers to the same question only once
+    dedup: bool = True
+    # Pack short concept answers to the same question into multi-student prompts
+    batched: bool = False
+    # Maximum answers per batched prompt; shrinks automatically for long answers
+    batch_size: int = GRADING_BATCH_SIZE
+    # Time budget of the whole job in seconds; LLM calls stop retrying once it runs out
+    deadline_seconds: Optional[float] = None
+    # Interactive jobs run ahead of batch work in the job and task queues
+    priority: Literal["interactive", "batch"] = "batch"
+    # Queue answers student by student, question by question to reuse the shared prompt prefix,
+    # or longest estimated answer first to shorten the batch's tail
+    order: Literal["student", "question", "longest"] = GRADING_TASK_ORDER
+
+class RegradeRequest(BatchGradingRequest):
+    # Job whose Corrections are reused for answers, questions and rubrics that did not change
+    previous_job_id: str
 
 def process_student_answer(answer: Dict[str, Any], problem_store: Dict[str, Any]) -> Correction:
     """Process a single student answer and return the correction result."""
-    q_id = answer.get("q_id")
-    answer_type = answer.get("type")
-    content = answer.get("content")
-    
-    # Get the problem rubric
-    problem = problem_store.get(q_id)
-    if not problem:
-        logger.warning(f"Problem {q_id} not found in problem store")
-        # Create a default correction for missing problems
-        return Correction(
-            q_id=q_id,
-            type=answer_type or "概念题",
-            score=0.0,
-            max_score=10.0,
-            confidence=0.0,
-            comment=f"Problem {q_id} not found",
-            steps=[]
-        )
-        
-    # Use cached rubric processing
-    rubric_raw = problem.get("criterion", "")
-    rubric = get_processed_rubric(q_id, rubric_raw)
-    max_score = 10.0  # Default max score
-    
-    # Prepare answer unit based on type
-    answer_unit = {
-        "q_id": q_id,
-        "text": content
-    }
-    
-    # Map Chinese question types to internal English types for processing
-    type_mapping = {
-        "概念题": "concept",
-        "其他": "concept",
-        "其它": "concept",
-        "计算题": "calculation", 
-        "证明题": "proof",
-        "推理题": "proof", # 推理题和证明题可以使用相同的处理节点
-        "编程题": "programming"
-    }
-    
-    # Get internal type for processing
-    internal_type = type_mapping.get(answer_type, "concept")
-    
-    # Get cached LLM client
-    llm = get_cached_llm()
-    
-    # Call the appropriate correction node based on question type
-    try:
-        correction = None
-        if internal_type == "calculation":
-            # For calculation questions, we need to parse steps
-            answer_unit["steps"] = [{"step_no": 1, "content": content, "formula": ""}]
-            correction = calc_node(answer_unit, rubric, max_score, llm)
-        
-        elif internal_type == "concept":
-            correction = concept_node(answer_unit, rubric, max_score, llm)
-
-        elif internal_type == "proof":
-            # For proof/reasoning questions, parse steps from content
-            answer_unit["steps"] = [{"step_no": 1, "content": content}]
-            correction = proof_node(answer_unit, rubric, max_score, llm)
-
-        elif internal_type == "programming":
-            answer_unit["code"] = content
-            answer_unit["language"] = "python"  # Default language
-            answer_unit["test_cases"] = []  # Empty test cases for now
-            correction = programming_node(answer_unit, rubric, max_score, llm)
-        
-        else:
-            # For other types, create a default correction
-            return Correction(
-                q_id=q_id,
-                type=answer_type,
-                score=5.0,
-                max_score=max_score,
-                confidence=0.5,
-                comment=f"Unsupported question type: {answer_type}",
-                steps=[]
-            )
-        
-        # Ensure the type in the correction is the original Chinese type
-        if correction:
-            correction.type = answer_type
-        return correction
-
-    except Exception as e:
-        logger.error(f"Error grading question {q_id}: {e}")
-        # Create a default correction for errors
-        return Correction(
-            q_id=q_id,
-            type=answer_type,
-            score=0.0,
-            max_score=max_score,
-            confidence=0.0,
-            comment=f"Grading error: {str(e)}",
-            steps=[]
-        )
+    return run_sync(grading_engine.grade_answer(answer, problem_store, get_llm()))
 
 def process_student_submission(student: Dict[str, Any], problem_store: Dict[str, Any]) -> Dict[str, Any]:
     """Process all answers for a single student and return the results."""
-    student_id = student.get("stu_id")
-    if not student_id:
-        return None
-        
-    logger.info(f"Processing submission for student {student_id}")
-    
-    corrections = []
-    student_answers = student.get("stu_ans", [])
-    
-    # Use ThreadPoolExecutor to process answers in parallel for each student
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor: # Increased workers slightly
-        future_to_answer = {
-            executor.submit(process_student_answer, answer, problem_store): answer 
-            for answer in student_answers
-        }
-        
-        for future in concurrent.futures.as_completed(future_to_answer):
-            try:
-                correction = future.result()
-                if correction:
-                    corrections.append(correction)
-            except Exception as e:
-                answer = future_to_answer[future]
-                q_id = answer.get('q_id', 'unknown')
-                logger.error(f"Error processing answer {q_id} for student {student_id}: {e}")
-                # Add a default correction for failed answers
-                corrections.append(Correction(
-                    q_id=q_id,
-                    type=answer.get("type", "概念题"),
-                    score=0.0,
-                    max_score=10.0,
-                    confidence=0.0,
-                    comment=f"Processing error: {str(e)}",
-                    steps=[]
-                ))
-    
-    logger.info(f"Completed processing for student {student_id}")
-    return {
-        "student_id": student_id,
-        "corrections": corrections
-    }
+    # All answers are graded concurrently on the shared async engine
+    return run_sync(grading_engine.grade_student(student, problem_store, get_llm()))
 
 # MODIFICATION: Changed student_store type from List to Dict
-def run_grading_task(job_id: str, student_id: str, problem_store: Dict, student_store: Dict[str, Any]):
+def run_grading_task(job_id: str, student_id: str, problem_store: Dict, student_store: Dict[str, Any], bypass_cache: bool = False,
+                     deadline_seconds: Optional[float] = None, priority: str = "interactive"):
     """Run the grading task for a specific student."""
     logger.info(f"Grading task {job_id} started for student {student_id}")
     
@@ -223,33 +115,44 @@ def run_grading_task(job_id: str, student_id: str, problem_store: Dict, student_
         
         if not student_data:
             logger.error(f"Student {student_id} not found in student store")
-            GRADING_RESULTS[job_id] = {
+            store_legacy_result(job_id, {
                 "status": "error",
                 "message": f"Student {student_id} not found"
-            }
+            })
             return
             
         # Process the student's submission using the existing parallel function
-        result = process_student_submission(student_data, problem_store)
+        with llm_cache.bypass_cache(bypass_cache), job_deadline(deadline_seconds or LLM_JOB_DEADLINE), \
+                tag_calls(job_id=job_id), grading_job(job_id, PRIORITY_CLASSES[priority]):
+            result = process_student_submission(student_data, problem_store)
 
         # Store the results
-        GRADING_RESULTS[job_id] = {
+        store_legacy_result(job_id, {
             "status": "completed",
             "student_id": student_id,
-            "corrections": result.get("corrections", [])
-        }
+            "corrections": result.get("corrections", []),
+            "llm_stats": get_call_ledger().summary(job_id)
+        })
         
         logger.info(f"Grading task {job_id} completed for student {student_id}")
         
+    except CancelledError:
+        logger.info(f"Grading task {job_id} was cancelled")
+        store_legacy_result(job_id, {"status": "cancelled"})
     except Exception as e:
         logger.error(f"Error in grading task {job_id}: {e}")
-        GRADING_RESULTS[job_id] = {
+        store_legacy_result(job_id, {
             "status": "error",
             "message": str(e)
-        }
+        })
+    finally:
+        get_job_events().publish(job_id)
 
 # MODIFICATION: Changed student_store type from List to Dict
-def run_batch_grading_task(job_id: str, problem_store: Dict, student_store: Dict[str, Any]):
+def run_batch_grading_task(job_id: str, problem_store: Dict, student_store: Dict[str, Any], bypass_cache: bool = False,
+                           dedup: bool = True, batched: bool = False, batch_size: int = GRADING_BATCH_SIZE,
+                           deadline_seconds: Optional[float] = None, priority: str = "batch",
+                           reuse: Optional[Dict[str, Dict[str, Any]]] = None, order: str = GRADING_TASK_ORDER):
     """Run the grading task for all students using parallel processing."""
     logger.info(f"Batch grading task {job_id} started for all students")
     
@@ -257,57 +160,273 @@ def run_batch_grading_task(job_id: str, problem_store: Dict, student_store: Dict
         student_count = len(student_store)
         logger.info(f"Found {student_count} students to process")
         
-        all_results = []
-        
-        # Increased max_workers for better parallelization across students
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            # MODIFICATION: Iterate over dictionary values() instead of the list itself.
-            future_to_student = {
-                executor.submit(process_student_submission, student, problem_store): student 
-                for student in student_store.values() if student.get("stu_id")
-            }
-            
-            for future in concurrent.futures.as_completed(future_to_student):
-                try:
-                    result = future.result()
-                    if result:
-                        all_results.append(result)
-                        logger.info(f"Processed student result: {result.get('student_id', 'unknown')}")
-                except Exception as e:
-                    student = future_to_student[future]
-                    student_id = student.get("stu_id", "unknown")
-                    logger.error(f"Error processing student {student_id}: {e}")
+        # Every answer of every student is scheduled on the async engine at once;
+        # the engine's concurrency limit bounds the number of in-flight LLM calls.
+        stats: Dict[str, Any] = {}
+        finished = LEGACY_PARTIAL_RESULTS.setdefault(job_id, [])
+
+        def on_planned(schedule: Dict[str, Any]):
+            # A pending job shows its estimated makespan and ETA until it finishes
+            stats["schedule"] = schedule
+            with SUBMIT_LOCK:
+                pending = (GRADING_RESULTS.get(job_id) or {}).get("status") == "pending"
+                if pending:
+                    GRADING_RESULTS[job_id] = {"status": "pending", "schedule": schedule}
+            if pending:
+                get_job_events().publish(job_id)
+
+        with llm_cache.bypass_cache(bypass_cache), job_deadline(deadline_seconds or LLM_JOB_DEADLINE), \
+                tag_calls(job_id=job_id), grading_job(job_id, PRIORITY_CLASSES[priority]):
+            all_results = run_sync(grading_engine.grade_students(
+                list(student_store.values()), problem_store, get_llm(),
+                dedup=dedup, batched=batched, batch_size=batch_size, stats=stats, reuse=reuse, order=order,
+                on_planned=on_planned, on_student_done=finished.append
+            ))
     
-        # Store the results
-        GRADING_RESULTS[job_id] = {
+        # Store the results (complete before storing: the store keeps a compressed copy)
+        result = {
             "status": "completed",
-            "results": all_results
+            "results": all_results,
+            "llm_stats": get_call_ledger().summary(job_id)
         }
+        if "dedup" in stats:
+            result["dedup"] = stats["dedup"]
+            logger.info(f"Batch grading task {job_id} deduplicated answers, saved {stats['dedup']['saved_calls']} LLM calls.")
+        if "batching" in stats:
+            result["batching"] = stats["batching"]
+            logger.info(f"Batch grading task {job_id} batched prompts, saved {stats['batching']['saved_calls']} LLM calls.")
+        if "reuse" in stats:
+            result["reuse"] = stats["reuse"]
+            logger.info(f"Regrade task {job_id} reused {stats['reuse']['reused_answers']} unchanged corrections.")
+        if "schedule" in stats:
+            result["schedule"] = stats["schedule"]
+        store_legacy_result(job_id, result)
         
         logger.info(f"Batch grading task {job_id} completed for all students. Processed {len(all_results)} students.")
         
+    except CancelledError:
+        logger.info(f"Batch grading task {job_id} was cancelled")
+        store_legacy_result(job_id, {"status": "cancelled"})
     except Exception as e:
         logger.error(f"Error in batch grading task {job_id}: {e}")
-        GRADING_RESULTS[job_id] = {
+        store_legacy_result(job_id, {
             "status": "error",
             "message": str(e)
+        })
+    finally:
+        with SUBMIT_LOCK:
+            LEGACY_COMPLETION_ORDER[job_id] = [student["student_id"] for student in LEGACY_PARTIAL_RESULTS.pop(job_id, [])]
+            while len(LEGACY_COMPLETION_ORDER) > LEGACY_COMPLETION_ORDER_MAX_JOBS:
+                LEGACY_COMPLETION_ORDER.popitem(last=False)
+        get_job_events().publish(job_id)
+
+def job_result_from_store(job_id: str, offset: int = 0, limit: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Build the grade_result response (one page of students) of a durable job from the job store (None if unknown)."""
+    store = get_job_store()
+    job = store.job(job_id)
+    if job is None:
+        return None
+    if job["status"] in ("pending", "running"):
+        return {"status": job["status"], "tasks": job["tasks"], "progress": store.progress(job_id)}
+    if job["status"] == "error":
+        return {"status": "error", "message": job["message"], "failed_students": store.failed_tasks(job_id),
+                "progress": store.progress(job_id)}
+    if job["status"] == "cancelled":
+        # Students graded before the cancellation keep their results
+        return {"status": "cancelled", "results": store.results(job_id, offset, limit),
+                "total_students": store.result_count(job_id), "progress": store.progress(job_id)}
+
+    results = store.results(job_id, offset, limit)
+    if job["kind"] == "student":
+        result = {
+            "status": "completed",
+            "student_id": job["params"]["student_id"],
+            "corrections": results[0]["corrections"] if results else [],
+        }
+    else:
+        result = {"status": "completed", "results": results, "total_students": store.result_count(job_id)}
+        for key in ("dedup", "batching", "reuse", "schedule"):
+            if key in job["summary"]:
+                result[key] = job["summary"][key]
+    # The ledger only knows the calls made in this process (jobs graded by standalone workers have none here)
+    result["llm_stats"] = get_call_ledger().summary(job_id)
+    result["progress"] = store.progress(job_id)
+    failed = store.failed_tasks(job_id)
+    if failed:
+        result["failed_students"] = failed
+    return result
+
+def partial_result_from_store(job_id: str, since: int = 0) -> Optional[Dict[str, Any]]:
+    """Students graded so far (after the ``since`` cursor) of a durable job, with its progress."""
+    store = get_job_store()
+    job = store.job(job_id)
+    if job is None:
+        return None
+    results, cursor = store.results_since(job_id, since)
+    return {
+        "status": job["status"],
+        "progress": store.progress(job_id),
+        "results": results,
+        # Pass back as ?since= to receive only students finished after this response
+        "cursor": cursor,
+    }
+
+def partial_result_from_memory(job_id: str, since: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    In-memory counterpart of :func:`partial_result_from_store`: students graded
+    so far after the ``since`` cursor (the number of students already returned).
+    """
+    result = GRADING_RESULTS.get(job_id)
+    if result is None:
+        return None
+    with SUBMIT_LOCK:
+        finished = LEGACY_PARTIAL_RESULTS.get(job_id)
+        order = LEGACY_COMPLETION_ORDER.get(job_id)
+    if finished is None:
+        finished = result.get("results") or []
+        if "corrections" in result:
+            finished = [{"student_id": result.get("student_id"), "corrections": result["corrections"]}]
+        elif order is not None:
+            # Same order as while the job ran
+            by_id = {student.get("student_id"): student for student in finished}
+            finished = [by_id[student_id] for student_id in order if student_id in by_id]
+    finished = list(finished)
+    shaped = {
+        "status": result.get("status"),
+        "results": finished[since:],
+        # A job finishing between the two reads above never moves the cursor back
+        "cursor": max(since, len(finished)),
+    }
+    if "schedule" in result:
+        shaped["schedule"] = result["schedule"]
+    return shaped
+
+def on_durable_job_done(job_id: str, status: str):
+    """Keep the final result of a job finished by the embedded worker in GRADING_RESULTS."""
+    result = job_result_from_store(job_id)
+    if result is None:
+        return
+    GRADING_RESULTS[job_id] = result
+    if "dedup" in result:
+        logger.info(f"Batch grading task {job_id} deduplicated answers, saved {result['dedup']['saved_calls']} LLM calls.")
+    if "batching" in result:
+        logger.info(f"Batch grading task {job_id} batched prompts, saved {result['batching']['saved_calls']} LLM calls.")
+    if "reuse" in result:
+        logger.info(f"Regrade task {job_id} reused {result['reuse']['reused_answers']} unchanged corrections.")
+    logger.info(f"Durable grading job {job_id} finished with status {status}.")
+
+# Worker grading durable jobs inside the API process (started in main.py)
+job_worker = JobWorker(get_job_store(), grading_engine, get_llm, worker_name("api"), on_job_done=on_durable_job_done)
+
+def submit_durable_job(job_id: str, kind: str, params: Dict[str, Any], problem_store: Dict[str, Any],
+                       students: List[Dict[str, Any]], priority: str,
+                       idempotency_key: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """
+    Persist a job and its per-student tasks; the embedded worker (or a standalone one) grades it.
+
+    Longest-first jobs store each student's estimated grading cost, so their
+    costliest students are claimed first.
+
+    A request repeating an earlier one (same idempotency key, or the same
+    parameters and store snapshot as a job still in flight) creates nothing and
+    gets that job's id back, with the reason as the second value.
+    """
+    fingerprint = job_fingerprint(kind, params, problem_store, students)
+    costs = None
+    if params.get("order") == "longest":
+        # Students with the longest estimated grading time are claimed first, so the order spans claims
+        costs = {
+            student["stu_id"]: sum(grading_engine.task_cost([answer], problem_store) for answer in student.get("stu_ans", []))
+            for student in students if student.get("stu_id")
         }
+    job_id, reason = get_job_store().create_or_join_job(
+        job_id, kind, params, problem_store, students, PRIORITY_CLASSES[priority], idempotency_key, fingerprint,
+        costs
+    )
+    if reason is None:
+        GRADING_RESULTS[job_id] = {"status": "pending"}
+        job_worker.wake()
+    return job_id, reason
+
+def register_legacy_job(job_id: str, kind: str, params: Dict[str, Any], problem_store: Dict[str, Any],
+                        students: List[Any], idempotency_key: Optional[str] = None) -> Tuple[str, Optional[str]]:
+    """The in-memory counterpart of :func:`submit_durable_job`: registers ``job_id`` as pending unless it is a repeat."""
+    fingerprint = job_fingerprint(kind, params, problem_store, students)
+    now = time.time()
+    with SUBMIT_LOCK:
+        for key, (_, _, created_at) in list(LEGACY_IDEMPOTENCY_KEYS.items()):
+            if now - created_at > GRADING_IDEMPOTENCY_TTL_SECONDS:
+                del LEGACY_IDEMPOTENCY_KEYS[key]
+        if idempotency_key in LEGACY_IDEMPOTENCY_KEYS:
+            existing, existing_fingerprint, _ = LEGACY_IDEMPOTENCY_KEYS[idempotency_key]
+            return existing, "idempotency_key" if existing_fingerprint == fingerprint else "idempotency_conflict"
+        existing = LEGACY_IN_FLIGHT.get(fingerprint)
+        if existing is not None and (GRADING_RESULTS.get(existing) or {}).get("status") == "pending":
+            return existing, "in_flight"
+        GRADING_RESULTS[job_id] = {"status": "pending"}
+        LEGACY_IN_FLIGHT[fingerprint] = job_id
+        for other, other_job_id in list(LEGACY_IN_FLIGHT.items()):
+            if (GRADING_RESULTS.get(other_job_id) or {}).get("status") != "pending":
+                del LEGACY_IN_FLIGHT[other]
+        if idempotency_key:
+            LEGACY_IDEMPOTENCY_KEYS[idempotency_key] = (job_id, fingerprint, now)
+    return job_id, None
+
+def submitted_response(job_id: str, reason: Optional[str]) -> Dict[str, Any]:
+    """Response of a submit endpoint; ``coalesced`` tells why an existing job was returned."""
+    if reason == "idempotency_conflict":
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request.")
+    if reason is None:
+        return {"job_id": job_id}
+    logger.info(f"Request coalesced into grading job {job_id} ({reason})")
+    return {"job_id": job_id, "coalesced": reason}
 
 @router.post("/grade_student/")
 # MODIFICATION: Changed student_store type hint from List to Dict
 def start_grading(request: GradingRequest, 
                   problem_store: Dict[str, Any] = Depends(get_problem_store),
-                  student_store: Dict[str, Any] = Depends(get_student_store)):
+                  student_store: Dict[str, Any] = Depends(get_student_store),
+                  idempotency_key: Optional[str] = Header(None)):
     """
     Start grading for a specific student.
+
+    Repeating a request (same ``Idempotency-Key`` header, or the same student
+    and problems as a job still in flight) returns the existing job_id with a
+    ``coalesced`` reason instead of grading again. If a running batch already
+    grades this exact submission, its job_id is returned with
+    ``coalesced: "attached"``; the student's result is then at
+    ``/grade_result/{job_id}/students/{student_id}``. Attaching needs the job
+    store's per-student tasks, so it only happens with durable jobs; with
+    ``GRADING_DURABLE_JOBS=0`` the student is graded on their own.
     """
     job_id = str(uuid.uuid4())
-    GRADING_RESULTS[job_id] = {"status": "pending"}
+    params = {
+        "student_id": request.student_id,
+        "bypass_cache": request.bypass_cache,
+        "deadline_seconds": request.deadline_seconds,
+    }
+    student_data = student_store.get(request.student_id)
+    if not student_data:
+        logger.error(f"Student {request.student_id} not found in student store")
+        GRADING_RESULTS[job_id] = {"status": "error", "message": f"Student {request.student_id} not found"}
+        return {"job_id": job_id}
+    if GRADING_DURABLE_JOBS:
+        batch_job_id = get_job_store().find_student_in_flight(student_data, problem_store, params)
+        if batch_job_id is not None:
+            return submitted_response(batch_job_id, "attached")
+        return submitted_response(*submit_durable_job(
+            job_id, "student", params, problem_store, [student_data], request.priority, idempotency_key
+        ))
+
+    job_id, reason = register_legacy_job(job_id, "student", params, problem_store, [student_data], idempotency_key)
+    if reason is not None:
+        return submitted_response(job_id, reason)
     
     # Start grading in a background thread
     thread = threading.Thread(
         target=run_grading_task, 
-        args=(job_id, request.student_id, problem_store, student_store)
+        args=(job_id, request.student_id, problem_store, student_store, request.bypass_cache, request.deadline_seconds,
+              request.priority)
     )
     thread.start()
     
@@ -317,35 +436,423 @@ def start_grading(request: GradingRequest,
 # MODIFICATION: Changed student_store type hint from List to Dict
 def start_batch_grading(request: BatchGradingRequest,
                         problem_store: Dict[str, Any] = Depends(get_problem_store),
-                        student_store: Dict[str, Any] = Depends(get_student_store)):
+                        student_store: Dict[str, Any] = Depends(get_student_store),
+                        idempotency_key: Optional[str] = Header(None)):
     """
     Start grading for all students.
+
+    Repeating a request (same ``Idempotency-Key`` header, or the same
+    parameters, problems and answers as a job still in flight) returns the
+    existing job_id with a ``coalesced`` reason instead of grading again.
     """
     job_id = str(uuid.uuid4())
-    GRADING_RESULTS[job_id] = {"status": "pending"}
-    
+    params = {
+        "bypass_cache": request.bypass_cache,
+        "dedup": request.dedup,
+        "batched": request.batched,
+        "batch_size": request.batch_size,
+        "deadline_seconds": request.deadline_seconds,
+        "order": request.order,
+    }
+
+    if GRADING_DURABLE_JOBS:
+        return submitted_response(*submit_durable_job(
+            job_id, "batch", params, problem_store, list(student_store.values()), request.priority, idempotency_key
+        ))
+
+    job_id, reason = register_legacy_job(job_id, "batch", params, problem_store, list(student_store.values()),
+                                         idempotency_key)
+    if reason is not None:
+        return submitted_response(job_id, reason)
     logger.info(f"Created new batch grading job: {job_id}")
     
     # Start grading in a background thread
     thread = threading.Thread(
         target=run_batch_grading_task, 
-        args=(job_id, problem_store, student_store)
+        args=(job_id, problem_store, student_store, request.bypass_cache,
+              request.dedup, request.batched, request.batch_size, request.deadline_seconds, request.priority,
+              None, request.order)
     )
     thread.start()
     
     return {"job_id": job_id}
 
+def previous_job_results(job_id: str) -> Optional[List[Dict[str, Any]]]:
+    """Per-student results of an earlier job (durable or in-memory), or None if it has none."""
+    if GRADING_DURABLE_JOBS and get_job_store().status(job_id) is not None:
+        return get_job_store().results(job_id)
+    result = GRADING_RESULTS.get(job_id) or {}
+    if "results" in result:
+        return result["results"]
+    if "corrections" in result:
+        return [{"student_id": result.get("student_id"), "corrections": result["corrections"]}]
+    return None
+
+@router.post("/regrade/")
+def start_regrade(request: RegradeRequest,
+                  problem_store: Dict[str, Any] = Depends(get_problem_store),
+                  student_store: Dict[str, Any] = Depends(get_student_store),
+                  idempotency_key: Optional[str] = Header(None)):
+    """
+    Grade all students again after problems or answers were edited, reusing the
+    Corrections of ``previous_job_id`` for every answer whose question, type,
+    rubric and (normalized) content did not change. Only the changed answers
+    are sent to the LLM; the result's ``reuse`` field reports how many were reused.
+    Repeated requests are coalesced like those of ``grade_all``.
+    """
+    previous = previous_job_results(request.previous_job_id)
+    if previous is None:
+        raise HTTPException(status_code=404, detail="Previous job has no results.")
+    students = list(student_store.values())
+    wanted = {
+        answer_fingerprint(dedup_key(answer, problem_store))
+        for student in students for answer in student.get("stu_ans", [])
+    }
+    reuse = reusable_corrections(previous, wanted)
+
+    job_id = str(uuid.uuid4())
+    params = {
+        "previous_job_id": request.previous_job_id,
+        "bypass_cache": request.bypass_cache,
+        "dedup": request.dedup,
+        "batched": request.batched,
+        "batch_size": request.batch_size,
+        "deadline_seconds": request.deadline_seconds,
+        "order": request.order,
+        "reuse": reuse,
+    }
+
+    if GRADING_DURABLE_JOBS:
+        job_id, reason = submit_durable_job(job_id, "regrade", params, problem_store, students, request.priority,
+                                            idempotency_key)
+    else:
+        job_id, reason = register_legacy_job(job_id, "regrade", params, problem_store, students, idempotency_key)
+    if reason is None:
+        logger.info(f"Created regrade job {job_id} from {request.previous_job_id}: "
+                    f"{len(reuse)} of {len(wanted)} distinct answers unchanged")
+    if reason is not None or GRADING_DURABLE_JOBS:
+        return submitted_response(job_id, reason)
+
+    thread = threading.Thread(
+        target=run_batch_grading_task,
+        args=(job_id, problem_store, student_store, request.bypass_cache, request.dedup, request.batched,
+              request.batch_size, request.deadline_seconds, request.priority, reuse, request.order)
+    )
+    thread.start()
+
+    return {"job_id": job_id}
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Correction fields named in a ``fields=`` query (None keeps every field)."""
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in Correction.model_fields]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown correction fields: {', '.join(unknown)}")
+    return names
+
+def project_corrections(corrections: List[Any], fields: Optional[List[str]]) -> List[Any]:
+    if fields is None:
+        return corrections
+    projected = []
+    for correction in corrections:
+        data = correction.model_dump(include=set(fields)) if hasattr(correction, "model_dump") else correction
+        projected.append({name: data.get(name) for name in fields})
+    return projected
+
+def shape_result(result: Dict[str, Any], offset: int = 0, limit: Optional[int] = None,
+                 fields: Optional[List[str]] = None, paged: bool = False) -> Dict[str, Any]:
+    """
+    Page the students of a result and project their corrections onto ``fields``.
+
+    Stored results are never modified; ``paged`` means ``result`` already holds only the requested page.
+    """
+    shaped = dict(result)
+    if "results" in result:
+        students = result["results"]
+        if not paged:
+            shaped["total_students"] = len(students)
+            students = students[offset:offset + limit if limit is not None else None]
+        shaped["results"] = [
+            dict(student, corrections=project_corrections(student.get("corrections", []), fields))
+            for student in students
+        ] if fields is not None else students
+        if offset or limit is not None:
+            shaped["offset"] = offset
+            shaped["limit"] = limit
+    if "corrections" in result:
+        shaped["corrections"] = project_corrections(result["corrections"], fields)
+    return shaped
+
+def accepted_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The preferred content coding of ``ENCODINGS`` an Accept-Encoding header allows (None: identity)."""
+    weights: Dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        params = params.strip().replace(" ", "")
+        try:
+            weights[name.strip().lower()] = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            weights[name.strip().lower()] = 0.0
+    best = None
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (encoding, weight)
+    return best[0] if best else None
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header with an ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+
+def shaped_etag(etag: str, offset: int, limit: Optional[int], fields: Optional[List[str]]) -> str:
+    """ETag of one page / projection of a stored result: changes with the result and with the query."""
+    query = hashlib.blake2b(json.dumps([offset, limit, fields]).encode("utf-8"), digest_size=6).hexdigest()
+    return f'{etag[:-1]}-{query}"'
+
+def encoded_response(body: bytes, encoding: Optional[str], etag: str) -> Response:
+    """A JSON response whose ``body`` is already in ``encoding``."""
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+def compress_body(raw: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    if encoding == "gzip":
+        return gzip.compress(raw, compresslevel=6, mtime=0)
+    return raw
+
 @router.get("/grade_result/{job_id}")
-def get_grading_result(job_id: str):
+def get_grading_result(job_id: str, request: Request, partial: bool = False, since: Optional[int] = None,
+                       offset: int = Query(0, ge=0), limit: Optional[int] = Query(None, ge=1),
+                       fields: Optional[str] = None):
     """
     Get the grading result for a job.
+
+    While a job runs the response carries its progress (completed/failed/total
+    students, ETA, per-question throughput). With ``partial=true`` (or a
+    ``since`` cursor) the students graded so far are returned as well, so the
+    first students can be reviewed before the whole batch is done.
+
+    ``offset``/``limit`` return one page of students (``total_students`` is the
+    full count) and ``fields`` keeps only the listed Correction fields, e.g.
+    ``fields=q_id,score,max_score`` for a score table without steps and comments.
+
+    Finished results are served from the JSON serialized when the job
+    finished, compressed as the client's Accept-Encoding allows (zstd or gzip),
+    with an ETag; a request whose If-None-Match still matches gets a 304.
     """
-    result = GRADING_RESULTS.get(job_id, {"status": "not_found", "message": "Job ID not found in results."})
-    return result
+    field_names = parse_fields(fields)
+    if partial or since is not None:
+        result = partial_result_from_store(job_id, since or 0) if GRADING_DURABLE_JOBS else None
+        if result is None:
+            result = partial_result_from_memory(job_id, since or 0)
+        if result is not None:
+            return shape_result(result, fields=field_names, paged=True)
+
+    if GRADING_DURABLE_JOBS and GRADING_RESULTS.etag(job_id) is None \
+            and get_job_store().status(job_id) in FINAL_STATUSES:
+        # Finished by another worker or before a restart: kept here from now on
+        GRADING_RESULTS[job_id] = job_result_from_store(job_id)
+    etag = GRADING_RESULTS.etag(job_id)
+    if etag is not None:
+        shaped = bool(offset) or limit is not None or field_names is not None
+        if shaped:
+            etag = shaped_etag(etag, offset, limit, field_names)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept-Encoding"})
+        encoding = accepted_encoding(request.headers.get("accept-encoding"))
+        if not shaped:
+            payload = GRADING_RESULTS.payload(job_id, encoding)
+            if payload is not None:
+                return encoded_response(payload[0], encoding, etag)
+        else:
+            result = GRADING_RESULTS.get(job_id)
+            if result is not None:
+                body = dump_json(shape_result(result, offset, limit, field_names))
+                return encoded_response(compress_body(body, encoding), encoding, etag)
+
+    result = GRADING_RESULTS.get(job_id)
+    if GRADING_DURABLE_JOBS and (result is None or result.get("status") in ("pending", "running")):
+        # Progress, and results of jobs finished by other workers or before a restart, live in the job store
+        stored = job_result_from_store(job_id, offset, limit)
+        if stored is not None:
+            return shape_result(stored, offset, limit, field_names, paged=True)
+    if result is None:
+        return {"status": "not_found", "message": "Job ID not found in results."}
+    return shape_result(result, offset, limit, field_names)
+
+@router.get("/grade_result/{job_id}/students/{student_id}")
+def get_student_result(job_id: str, student_id: str, fields: Optional[str] = None):
+    """
+    Get the corrections of one student of a job.
+    """
+    field_names = parse_fields(fields)
+    result = GRADING_RESULTS.get(job_id) or {}
+    student = None
+    if result.get("student_id") == student_id and "corrections" in result:
+        student = {"student_id": student_id, "corrections": result["corrections"]}
+    for candidate in result.get("results", []):
+        if candidate.get("student_id") == student_id:
+            student = candidate
+            break
+    if student is None and GRADING_DURABLE_JOBS:
+        student = get_job_store().student_result(job_id, student_id)
+    if student is None:
+        raise HTTPException(status_code=404, detail="No result for this student in this job.")
+    return {
+        "job_id": job_id,
+        "student_id": student_id,
+        "corrections": project_corrections(student.get("corrections", []), field_names),
+    }
+
+@router.get("/status/{job_id}")
+def get_job_status(job_id: str):
+    """
+    Get only the status (and progress, or the planned schedule of in-memory jobs) of a job, without any results.
+    """
+    return job_event_snapshot(job_id)
+
+# Event sent for each status after which a job no longer changes
+# ("error" is not used as an event name: EventSource reserves it for connection errors)
+FINAL_JOB_EVENTS = {"completed": "completed", "error": "failed", "cancelled": "cancelled", "not_found": "not_found"}
+# Comment line sent on idle event streams so proxies do not close them
+EVENTS_KEEPALIVE_SECONDS = 15
+# Most jobs one event stream may watch
+EVENTS_MAX_JOBS = 100
+
+def job_event_snapshot(job_id: str) -> Dict[str, Any]:
+    """Status (and progress of durable jobs) of a job, as sent on the event stream."""
+    if GRADING_DURABLE_JOBS:
+        store = get_job_store()
+        status = store.status(job_id)
+        if status is not None:
+            return {"job_id": job_id, "status": status, "progress": store.progress(job_id)}
+    result = GRADING_RESULTS.get(job_id)
+    snapshot = {"job_id": job_id, "status": result.get("status", "unknown") if result else "not_found"}
+    if result and "schedule" in result:
+        snapshot["schedule"] = result["schedule"]
+    return snapshot
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.get("/events")
+async def stream_job_events(request: Request, job_ids: str = Query(..., description="逗号分隔的 job_id")):
+    """
+    Server-Sent Events stream of status and progress of several jobs.
+
+    Sends a ``progress`` event whenever a job's status or counters change, a
+    ``completed`` / ``failed`` / ``cancelled`` / ``not_found`` event once per finished job, and
+    ``end`` when every watched job is finished. Replaces polling
+    ``grade_result`` for completion notices; the full result is fetched once
+    afterwards.
+    """
+    watching = [job_id for job_id in dict.fromkeys(job_ids.split(",")) if job_id][:EVENTS_MAX_JOBS]
+    events = get_job_events()
+
+    async def event_stream():
+        pending = set(watching)
+        last_seen: Dict[str, Any] = {}
+        last_sent = time.monotonic()
+        # Tell EventSource how long to wait before reconnecting
+        yield "retry: 3000\n\n"
+        while pending:
+            if await request.is_disconnected():
+                return
+            for job_id in sorted(pending):
+                snapshot = await run_in_threadpool(job_event_snapshot, job_id)
+                progress = snapshot.get("progress") or {}
+                # Elapsed time and ETA change on every read; only real changes are sent
+                key = (snapshot["status"], progress.get("completed"), progress.get("failed"), "schedule" in snapshot)
+                if key != last_seen.get(job_id):
+                    last_seen[job_id] = key
+                    status = snapshot["status"]
+                    yield format_sse(FINAL_JOB_EVENTS.get(status, "progress"), snapshot)
+                    last_sent = time.monotonic()
+                if snapshot["status"] in FINAL_JOB_EVENTS:
+                    pending.discard(job_id)
+            if not pending:
+                break
+            await events.wait(pending, GRADING_EVENTS_POLL_SECONDS)
+            if time.monotonic() - last_sent >= EVENTS_KEEPALIVE_SECONDS:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+        yield format_sse("end", {"job_ids": watching})
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.post("/cancel/{job_id}")
+def cancel_grading(job_id: str):
+    """
+    Cancel a pending or running job.
+
+    Its queued tasks are dropped and no new LLM calls are made for it; students
+    graded before the cancellation keep their results.
+    """
+    if GRADING_DURABLE_JOBS and get_job_store().status(job_id) is not None:
+        cancelled = get_job_store().cancel_job(job_id)
+        if cancelled:
+            GRADING_RESULTS[job_id] = job_result_from_store(job_id)
+    else:
+        with SUBMIT_LOCK:
+            result = GRADING_RESULTS.get(job_id)
+            if result is None:
+                raise HTTPException(status_code=404, detail="Job ID not found in results.")
+            cancelled = result.get("status") in ("pending", "running")
+            if cancelled:
+                GRADING_RESULTS[job_id] = {"status": "cancelled"}
+    if cancelled:
+        # Stops the job's tasks in this process; standalone workers notice the stored status
+        grading_engine.queue.cancel_job(job_id)
+        get_job_events().publish(job_id)
+        logger.info(f"Grading job {job_id} cancelled")
+    return {"job_id": job_id, "cancelled": cancelled, "status": job_event_snapshot(job_id)["status"]}
+
+@router.get("/job_stats/{job_id}")
+def get_job_stats(job_id: str):
+    """
+    Get LLM token, cost, latency, retry and parse-failure totals of a job,
+    broken down by question type, grading node, question and provider.
+    """
+    # Live numbers while the job runs; the snapshot stored with the result once the ledger has dropped it
+    stats = get_call_ledger().summary(job_id) or GRADING_RESULTS.get(job_id, {}).get("llm_stats")
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No LLM statistics for this job.")
+    return stats
+
+@router.get("/queue")
+def get_queue_status():
+    """
+    Get the grading work queue's depth, busy workers, utilization, queue-wait percentiles
+    and the queued/running tasks of every job.
+    """
+    return grading_engine.queue.snapshot()
 
 @router.get("/all_jobs")
 def get_all_jobs():
     """
     Get all job IDs and their statuses for debugging.
     """
-    return {job_id: result.get("status", "unknown") for job_id, result in GRADING_RESULTS.items()}
\ No newline at end of file
+    jobs = get_job_store().list_jobs() if GRADING_DURABLE_JOBS else {}
+    for job_id, status in GRADING_RESULTS.statuses().items():
+        # Durable jobs report their stored status; in-memory entries only add what the store does not know
+        jobs.setdefault(job_id, status)
+    return jobs
+
+@router.get("/result_store")
+def get_result_store_status(limit: int = Query(100, ge=1)):
+    """
+    Get the memory budget and usage of the in-process result store, its
+    hit/load/spill counters and the compressed and raw size of the ``limit``
+    largest results.
+    """
+    return GRADING_RESULTS.snapshot(limit)
\ No newline at end of file
@@ -22,6 +22,8 @@ from langchain.chains.summarize import load_summarize_chain
 # from ..dependencies import get_problem_store, get_student_store, get_llm, StudentSubmission
 from ..dependencies import *
 from ..utils import *
+from ..llm.structured import structured_llm
+from ..llm.metrics import tag_calls
 
 
 # --- 日志和应用基础设置 ---
@@ -111,6 +113,69 @@ example = '''
 }
 '''
 
+# 紧凑提示词：题目表只保留分割所需字段并压缩序列化，共享内容放在固定前缀中，
+# 每个文件的文件名和作答内容放在最后，便于服务端的前缀缓存命中
+HW_PROMPT_COMPACT = os.getenv("HW_PROMPT_COMPACT", "1") not in ("0", "false", "False")
+# 题干只作为定位提示，截取前若干字符即可
+HW_STEM_HINT_CHARS = int(os.getenv("HW_STEM_HINT_CHARS", "80"))
+
+
+def build_segmentation_prefix(problems_data: Dict[str, Dict[str, Any]]) -> str:
+    """
+    构建所有文件共享的提示词前缀（题目表），每次上传只构建一次。
+    题目表只保留 q_id、number、type 和截断的题干，并以紧凑 JSON 序列化。
+    """
+    table = []
+    for prob in problems_data.values():
+        stem = prob.get("stem", "")
+        table.append({
+            "q_id": prob["q_id"],
+            "number": prob["number"],
+            "type": prob["type"],
+            "stem": stem if len(stem) <= HW_STEM_HINT_CHARS else stem[:HW_STEM_HINT_CHARS] + "…",
+        })
+    problems_json_str = json.dumps(table, ensure_ascii=False, separators=(",", ":"))
+    return f"**【题目数据 (JSON)】**:\n{problems_json_str}\n"
+
+
+def build_segmentation_messages(shared_prefix: str, filename: str, content: str) -> List[Any]:
+    """按“系统提示词 → 题目表 → 文件名 → 作答内容”的顺序构建消息，保证前缀在各文件间完全一致。"""
+    return [
+        SystemMessage(content=SYSTEM_PROMPT),
+        HumanMessage(content=(
+            f"{shared_prefix}\n"
+            f"请根据以上题目数据处理下面这份学生提交：\n\n"
+            f"**【文件名】**:\n{filename}\n\n"
+            f"**【学生作答内容】**:\n---\n{content}\n---"
+        ))
+    ]
+
+
+def legacy_human_message(filename: str, problems_json_str: str, content: str) -> str:
+    """旧版提示词格式（缩进的完整题目表夹在文件名和作答内容之间）。"""
+    return f"""
+            请根据以下信息处理这份学生提交：
+
+            **【文件名】**:
+            {filename}
+
+            **【题目数据 (JSON)】**:
+            {problems_json_str}
+
+            **【学生作答内容】**:
+            ---
+            {content}
+            ---"""
+
+
+def legacy_problems_json(problems_data: Dict[str, Dict[str, Any]]) -> str:
+    """旧版提示词中的题目表（完整题干、缩进序列化），用于回退和统计节省量。"""
+    return json.dumps(
+        [{key: prob[key] for key in ("q_id", "number", "type", "stem")} for prob in problems_data.values()],
+        ensure_ascii=False, indent=1
+    )
+
+
 def analyze_submissions(
     files_data: List[Dict[str, str]],
     problems_data: Dict[str, Dict[str,str]],
@@ -136,20 +201,12 @@ def analyze_submissions(
     # 将 Pydantic 模型与 LLM 绑定，使其能够输出我们想要的结构
     # structured_llm = llm.with_structured_output(StudentSubmission)
 
-    prob_main_data = []
-    for prob in problems_data.values():
-        prob_main = {}
-        prob_main["q_id"] = prob["q_id"]
-        prob_main["number"] = prob["number"]
-        prob_main["type"] = prob["type"]
-        prob_main["stem"] = prob["stem"]
-
-        prob_main_data.append(prob_main)
-
-    # 为了方便LLM处理，将题目数据字典转换为JSON字符串
-    problems_json_str = json.dumps(prob_main_data, ensure_ascii=False, indent=1)
+    # 题目表每次上传只序列化一次，所有文件共享同一前缀
+    shared_prefix = build_segmentation_prefix(problems_data)
+    legacy_json = legacy_problems_json(problems_data)
 
     all_students_results = []
+    saved_chars_per_file = []
 
     print(f"开始处理 {len(files_data)}份学生提交...")
     
@@ -163,28 +220,23 @@ def analyze_submissions(
 
         print(f"正在分析文件: {filename}")
 
-        # 为每个文件构建一个 HumanMessage
-        human_message_content = f"""
-            请根据以下信息处理这份学生提交：
-
-            **【文件名】**:
-            {filename}
-
-            **【题目数据 (JSON)】**:
-            {problems_json_str}
-
-            **【学生作答内容】**:
-            ---
-            {content}
-            ---"""
-        messages = [
-            SystemMessage(content=SYSTEM_PROMPT),
-            HumanMessage(content=human_message_content)
-        ]
+        if HW_PROMPT_COMPACT:
+            messages = build_segmentation_messages(shared_prefix, filename, content)
+            prompt_chars = sum(len(message.content) for message in messages)
+            legacy_chars = len(SYSTEM_PROMPT) + len(legacy_human_message(filename, legacy_json, content))
+            saved_chars = legacy_chars - prompt_chars
+            saved_chars_per_file.append(saved_chars)
+            logger.info(f"文件 {filename} 的分割提示词 {prompt_chars} 字符，比旧格式节省 {saved_chars} 字符")
+        else:
+            messages = [
+                SystemMessage(content=SYSTEM_PROMPT),
+                HumanMessage(content=legacy_human_message(filename, legacy_json, content))
+            ]
 
         # response_obj = structured_llm.invoke(messages)
-        raw_llm_output = llm.invoke(messages).content
-        json_output = parse_llm_json_output(raw_llm_output, StudentSubmission)
+        # 要求模型以JSON格式输出并按 StudentSubmission 校验，输出无效时会有限次地重新询问
+        with tag_calls(node="hw_preview"):
+            json_output = structured_llm(llm, messages, StudentSubmission)
         logger.info(f"提取到学生解答:{json_output.model_dump()}")
         return json_output.model_dump()
 
@@ -209,6 +261,11 @@ def analyze_submissions(
                 logger.error(f"Error processing file {filename}: {e}")
                 # Continue processing other files even if one fails
 
+    if HW_PROMPT_COMPACT:
+        saved_chars_total = sum(saved_chars_per_file)
+        logger.info(f"{len(files_data)} 份提交的分割提示词共节省 {saved_chars_total} 字符"
+                    f"（约 {saved_chars_total // 2} tokens）")
+
     stu_dict = {stu['stu_id']: stu for stu in all_students_results}
     student_store.clear()
     student_store.update(stu_dict)
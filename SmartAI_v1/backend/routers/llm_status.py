@@ -0,0 +1,69 @@
+import logging
+from typing import Dict, Any
+from fastapi import APIRouter
+
+from backend.llm.limiter import get_rate_limiter
+from backend.llm.cache import get_response_cache
+from backend.llm.streaming import get_stream_metrics
+from backend.llm.retry import get_retry_policy
+from backend.llm.structured import get_structured_metrics
+from backend.dependencies import llm_router
+
+# Setup logger
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/llm",
+    tags=["llm"]
+)
+
+@router.get("/limiter")
+def get_limiter_status() -> Dict[str, Any]:
+    """
+    Get the shared LLM rate limiter's current window, concurrency limit and counters.
+    """
+    return get_rate_limiter().snapshot()
+
+@router.get("/cache")
+def get_cache_status() -> Dict[str, Any]:
+    """
+    Get hit/miss counters, entry count and size of the persistent LLM response cache.
+    """
+    return get_response_cache().stats()
+
+@router.post("/cache/evict")
+def evict_cache() -> Dict[str, Any]:
+    """
+    Run age/size-based eviction on the LLM response cache immediately.
+    """
+    removed = get_response_cache().evict()
+    logger.info(f"LLM 响应缓存清理了 {removed} 条记录")
+    return {"removed": removed}
+
+@router.get("/streaming")
+def get_streaming_status() -> Dict[str, Any]:
+    """
+    Get time-to-first-token / time-to-valid-JSON percentiles and aborted-stream counters.
+    """
+    return get_stream_metrics().snapshot()
+
+@router.get("/retry")
+def get_retry_status() -> Dict[str, Any]:
+    """
+    Get per-attempt outcome counters (timeouts, throttling, schema aborts, hedges) of the retry policy.
+    """
+    return get_retry_policy().metrics.snapshot()
+
+@router.get("/structured")
+def get_structured_status() -> Dict[str, Any]:
+    """
+    Get how many structured outputs validated first time, were recovered by a re-ask, or failed.
+    """
+    return get_structured_metrics().snapshot()
+
+@router.get("/providers")
+def get_provider_status() -> Dict[str, Any]:
+    """
+    Get per-provider routing weight, circuit-breaker state, error rate and latency.
+    """
+    return llm_router.snapshot()
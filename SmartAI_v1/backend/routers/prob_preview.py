@@ -24,6 +24,8 @@ from langchain.chains.summarize import load_summarize_chain
 # from ..dependencies import get_problem_store, get_llm, ProblemSet
 from ..dependencies import *
 from ..utils import *
+from ..llm.structured import structured_llm
+from ..llm.metrics import tag_calls
 
 # --- 日志和应用基础设置 ---
 logging.basicConfig(level=logging.INFO)
@@ -87,8 +89,9 @@ def process_and_store_problems(
         print("正在调用AI分析题目...")
         # response_obj: ProblemSet = await structured_llm.ainvoke(messages)
 
-        raw_llm_output = llm.invoke(messages).content
-        json_output = parse_llm_json_output(raw_llm_output, ProblemSet)
+        # 要求模型以JSON格式输出并按 ProblemSet 校验，输出无效时会有限次地重新询问
+        with tag_calls(node="prob_preview"):
+            json_output = structured_llm(llm, messages, ProblemSet)
         print("AI分析完成。")
         
         if not (json_output and json_output.problems):
@@ -0,0 +1,55 @@
+"""
+Standalone grading worker.
+
+Grades the durable jobs the API stores in the shared SQLite job database
+(``GRADING_JOB_DB``), next to or instead of the worker embedded in the API
+process. Run as many as the LLM quota allows::
+
+    python -m backend.worker
+    GRADING_CONCURRENCY=32 python -m backend.worker --claim 20
+
+Tasks of a worker that dies are handed to another worker once their lease
+(``GRADING_TASK_LEASE_SECONDS``) runs out; Ctrl+C returns the unfinished tasks
+of the current claim to the queue right away.
+"""
+import argparse
+import logging
+
+from backend.dependencies import get_llm
+from backend.correct.engine import grading_engine
+from backend.jobs.store import get_job_store
+from backend.jobs.runner import JobWorker, worker_name, GRADING_WORKER_CLAIM, GRADING_WORKER_POLL_SECONDS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SmarTAI grading worker")
+    parser.add_argument("--claim", type=int, default=GRADING_WORKER_CLAIM, help="students claimed per claim")
+    parser.add_argument("--poll-seconds", type=float, default=GRADING_WORKER_POLL_SECONDS)
+    parser.add_argument("--once", action="store_true", help="exit once the queue is empty")
+    args = parser.parse_args()
+
+    store = get_job_store()
+    # Other workers on this host may be alive, so only tasks with an expired lease are taken over
+    store.recover()
+    worker = JobWorker(store, grading_engine, get_llm, worker_name("worker"),
+                       claim_size=args.claim, poll_seconds=args.poll_seconds)
+    logger.info(f"批改 worker {worker.worker_id} 启动，任务库: {store.path}")
+
+    if args.once:
+        while worker.run_once():
+            pass
+        return
+    thread = worker.start()
+    try:
+        while thread.is_alive():
+            thread.join(1)
+    except KeyboardInterrupt:
+        logger.info("收到中断信号，归还未完成的任务后退出")
+        worker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ import requests
 import streamlit as st
 import json
 import os
+from utils import get_json_cached
 
 @dataclass
 class StudentScore:
@@ -159,12 +160,11 @@ def load_ai_grading_data(job_id: str) -> Dict[str, Any]:
         print(f"Requesting AI grading data for job {job_id}")
         
         # 获取批改结果
-        response = requests.get(
+        # 结果未变时后端返回 304，直接复用上次下载的数据
+        result = get_json_cached(
             f"{st.session_state.backend}/ai_grading/grade_result/{job_id}",
             timeout=10
         )
-        response.raise_for_status()
-        result = response.json()
         
         # Debug information
         print(f"Loading AI grading data for job {job_id}")
@@ -229,12 +229,13 @@ else:
             # --- 以下是您原代码中用于获取和显示真实批改结果的部分 ---
             # --- 内部逻辑未作修改，仅针对 status == 'pending' 情况增加了模拟数据展示 ---
             try:
-                response = requests.get(
+                # 结果未变时后端返回 304，直接复用上次下载的数据
+                result = get_json_cached(
                     f"{st.session_state.backend}/ai_grading/grade_result/{selected_job}",
+                    # 总览表只用到这些字段，不下载步骤分析等内容
+                    params={"fields": "q_id,type,score,max_score,confidence,comment"},
                     timeout=10
                 )
-                response.raise_for_status()
-                result = response.json()
                 
                 status = result.get("status", "未知")
                 st.write(f"状态: {status}")
@@ -220,7 +220,7 @@ def render_completed_records():
             status = "pending"  # 默认状态
             try:
                 # 向后端查询任务的最新状态
-                result = requests.get(f"{st.session_state.backend}/ai_grading/grade_result/{job_id}", timeout=3)
+                result = requests.get(f"{st.session_state.backend}/ai_grading/status/{job_id}", timeout=3)
                 if result.ok:
                     status = result.json().get("status", "pending")
             except requests.RequestException:
@@ -414,7 +414,7 @@ def render_statistics_overview():
                 continue
             
             try:
-                result = requests.get(f"{st.session_state.backend}/ai_grading/grade_result/{job_id}", timeout=5)
+                result = requests.get(f"{st.session_state.backend}/ai_grading/status/{job_id}", timeout=5)
                 result.raise_for_status()
                 status = result.json().get("status", "未知")
                 if status == "completed":
@@ -1,6 +1,7 @@
 # pages/stu_preview.py
 
 import streamlit as st
+import uuid
 import pandas as pd
 from utils import *
 import re
@@ -186,6 +187,9 @@ def start_ai_grading_and_navigate():
     1. 在 session_state 中设置一个“一次性触发”的标志。
     2. 命令 Streamlit 跳转到任务轮询页面。
     """
+    # 同一次提交（连点、刷新、重跑）共用一个幂等键，后端对重复请求返回同一个 job_id
+    if not st.session_state.get('trigger_ai_grading'):
+        st.session_state.grading_idempotency_key = str(uuid.uuid4())
     st.session_state.trigger_ai_grading = True  # 使用与目标页面匹配的标志
     # st.switch_page("pages/wait_ai_grade.py")   # 跳转到你的目标页面
 
@@ -58,9 +58,12 @@ if st.session_state.get('trigger_ai_grading'):
         # 使用 with st.spinner 来提供更好的用户反馈
         with st.spinner('正在提交批改任务，请稍候...'):
             # Use the batch grading endpoint to grade all students
+            # 带上提交时生成的幂等键：重复提交时后端返回已有任务的 job_id，不会再批改一遍
+            idempotency_key = st.session_state.get("grading_idempotency_key")
             result = requests.post(
                 f"{st.session_state.backend}/ai_grading/grade_all/",
                 json={},
+                headers={"Idempotency-Key": idempotency_key} if idempotency_key else {},
                 timeout=600
             )
             result.raise_for_status()
@@ -89,8 +92,9 @@ if st.session_state.get('trigger_ai_grading'):
             if "jobs" not in st.session_state:
                 st.session_state.jobs = {} # Ensure it exists
             
-            # Add the new job
-            st.session_state.jobs[job_id] = task_details
+            # Add the new job（重复提交返回的已有任务保留原来的名称和提交时间）
+            if job_id not in st.session_state.jobs:
+                st.session_state.jobs[job_id] = task_details
             # Also store the job_id for immediate access
             st.session_state.current_job_id = job_id
             
@@ -11,40 +11,74 @@ function onRender(event) {
     jobsData = {};
   }
 
-  const jobIds = Object.keys(jobsData);
+  const jobIds = Object.keys(jobsData).filter(jobId => !sessionStorage.getItem(`job-completed-${jobId}`));
   if (jobIds.length === 0) {
     return;
   }
 
-  const startPollingForJob = (jobId, taskDetails) => {
+  // 已结束（完成、失败或不存在）的任务，回退轮询时不再处理
+  const finishedJobs = new Set();
+
+  const notifyCompleted = (jobId) => {
     const completedKey = `job-completed-${jobId}`;
+    finishedJobs.add(jobId);
     if (sessionStorage.getItem(completedKey)) {
       return;
     }
+    const taskDetails = jobsData[jobId] || {};
+    const taskName = taskDetails.name || "未命名任务";
+    const submittedAt = taskDetails.submitted_at || "未知时间";
+    alert(`您于 [${submittedAt}] 提交的任务\n"${taskName}"\n已成功完成！`);
+    sessionStorage.setItem(completedKey, 'true');
+    Streamlit.setComponentValue({ "rerun": true, "timestamp": Date.now() });
+  };
 
+  const startPollingForJob = (jobId) => {
     const intervalId = setInterval(async () => {
+      if (finishedJobs.has(jobId)) {
+        clearInterval(intervalId);
+        return;
+      }
       try {
-        const resp = await fetch(backend + '/ai_grading/grade_result/' + jobId);
+        const resp = await fetch(backend + '/ai_grading/status/' + jobId);
         if (!resp.ok) return;
 
         const data = await resp.json();
         if (data && data.status === 'completed') {
           clearInterval(intervalId);
-          if (!sessionStorage.getItem(completedKey)) {
-            const taskName = taskDetails.name || "未命名任务";
-            const submittedAt = taskDetails.submitted_at || "未知时间";
-            alert(`您于 [${submittedAt}] 提交的任务\n"${taskName}"\n已成功完成！`);
-            sessionStorage.setItem(completedKey, 'true');
-            Streamlit.setComponentValue({ "rerun": true, "timestamp": Date.now() });
-          }
+          notifyCompleted(jobId);
         }
       } catch (err) {}
     }, 3000);
   };
 
-  jobIds.forEach(jobId => {
-    startPollingForJob(jobId, jobsData[jobId]);
+  const startPolling = () => {
+    jobIds.filter(jobId => !finishedJobs.has(jobId)).forEach(startPollingForJob);
+  };
+
+  // 每次渲染都替换掉上一次的订阅
+  if (window.jobEventSource) {
+    window.jobEventSource.close();
+  }
+  if (!window.EventSource) {
+    startPolling();
+    return;
+  }
+
+  // 一条 SSE 连接订阅所有任务；不可用或连接失败时退回轮询
+  const source = new EventSource(backend + '/ai_grading/events?job_ids=' + encodeURIComponent(jobIds.join(',')));
+  window.jobEventSource = source;
+  source.addEventListener('completed', (e) => {
+    notifyCompleted(JSON.parse(e.data).job_id);
   });
+  ['failed', 'not_found'].forEach(name => source.addEventListener(name, (e) => {
+    finishedJobs.add(JSON.parse(e.data).job_id);
+  }));
+  source.addEventListener('end', () => source.close());
+  source.onerror = () => {
+    source.close();
+    startPolling();
+  };
 }
 
 String.prototype.rstrip = function(chars) {
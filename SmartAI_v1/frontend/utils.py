@@ -94,11 +94,35 @@ def update_ans():
             st.error(f"保存失败，错误信息: {e}")
             print(f"Error saving to DB: {e}") # 在终端打印错误
 
+def get_json_cached(url: str, params=None, timeout: float = 10):
+    """
+    GET 一个 JSON 接口，并按 ETag 缓存在 session_state 中。
+    再次请求时带上 If-None-Match，后端返回 304（结果未变）时直接复用上次的数据，
+    不再重复下载和解析整个批改结果。返回的数据是缓存中的同一对象。
+    """
+    cache = st.session_state.setdefault("etag_cache", {})
+    key = (url, json.dumps(params or {}, sort_keys=True))
+    cached = cache.get(key)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    response = requests.get(url, params=params, headers=headers, timeout=timeout)
+    if response.status_code == 304 and cached:
+        return cached[1]
+    response.raise_for_status()
+    data = response.json()
+    etag = response.headers.get("ETag")
+    if etag:
+        cache[key] = (etag, data)
+    else:
+        # 未结束的任务没有 ETag，不缓存
+        cache.pop(key, None)
+    return data
+
 def get_master_poller_html(jobs_json: str, backend_url: str) -> str:
     """
     生成一个"主"轮询脚本。
     这个脚本接收一个包含所有任务详细信息的 JSON 对象，
-    并在内部为每个 job_id 启动轮询。
+    通过一条 SSE 连接（/ai_grading/events）订阅所有任务的状态推送；
+    浏览器不支持或连接失败时，退回为每个 job_id 轮询。
     """
     be = backend_url.rstrip("/")
     # jobs_json 现在是一个字典的JSON字符串，例如：
@@ -116,42 +140,51 @@ def get_master_poller_html(jobs_json: str, backend_url: str) -> str:
             jobsData = {{}};
         }}
 
-        // 获取所有待轮询的任务ID (即对象的键)
-        const jobIds = Object.keys(jobsData);
+        // 获取所有尚未提示过完成的任务ID (即对象的键)
+        const jobIds = Object.keys(jobsData).filter(jobId => !sessionStorage.getItem(`job-completed-${{jobId}}`));
 
         if (jobIds.length === 0) {{
             return;
         }}
 
-        // 定义一个为单个任务启动轮询的函数
-        // <-- 接收 job_id 和对应的任务详情对象
-        const startPollingForJob = (jobId, taskDetails) => {{
-            const completedKey = `job-completed-${{jobId}}`;
+        // 已结束（完成、失败或不存在）的任务，回退轮询时不再处理
+        const finishedJobs = new Set();
 
+        // 任务完成时弹窗提示（每个任务只提示一次）
+        const notifyCompleted = (jobId) => {{
+            const completedKey = `job-completed-${{jobId}}`;
+            finishedJobs.add(jobId);
             if (sessionStorage.getItem(completedKey)) {{
                 return;
             }}
+            // --- 核心修改：生成用户友好的弹窗消息 ---
+            const taskDetails = jobsData[jobId] || {{}};
+            const taskName = taskDetails.name || "未命名任务";
+            const submittedAt = taskDetails.submitted_at || "未知时间";
+            alert(`您于 [${{submittedAt}}] 提交的任务："${{taskName}}"已成功完成！\\n请前往“历史批改记录”-“批改结果”查看，或直接查看[报告]和[分析]。\\n如果您当前正在AI批改结果总览窗口，请手动点击右上角“刷新数据”按钮以查看最新批改数据！`);
+            // 标记为完成，防止重复弹窗
+            sessionStorage.setItem(completedKey, 'true');
+            // --- 新增功能：刷新当前页面 ---
+            //window.parent.location.reload();
+            // -----------------------------
+        }};
 
+        // 定义一个为单个任务启动轮询的函数（SSE 不可用时的回退方案）
+        const startPollingForJob = (jobId) => {{
             const intervalId = setInterval(async () => {{
+                if (finishedJobs.has(jobId)) {{
+                    clearInterval(intervalId);
+                    return;
+                }}
                 try {{
-                    // 轮询的URL依然只使用 job_id
-                    const resp = await fetch(backend + '/ai_grading/grade_result/' + jobId);
+                    // 只查询状态，不下载批改结果
+                    const resp = await fetch(backend + '/ai_grading/status/' + jobId);
                     if (!resp.ok) return;
 
                     const data = await resp.json();
                     if (data && data.status === 'completed') {{
                         clearInterval(intervalId);
-                        if (!sessionStorage.getItem(completedKey)) {{
-                            // --- 核心修改：生成用户友好的弹窗消息 ---
-                            const taskName = taskDetails.name || "未命名任务";
-                            const submittedAt = taskDetails.submitted_at || "未知时间";
-                            alert(`您于 [${{submittedAt}}] 提交的任务："${{taskName}}"已成功完成！\\n请前往“历史批改记录”-“批改结果”查看，或直接查看[报告]和[分析]。\\n如果您当前正在AI批改结果总览窗口，请手动点击右上角“刷新数据”按钮以查看最新批改数据！`);
-                            // 标记为完成，防止重复弹窗
-                            sessionStorage.setItem(completedKey, 'true');
-                            // --- 新增功能：刷新当前页面 ---
-                            //window.parent.location.reload();
-                            // -----------------------------
-                        }}
+                        notifyCompleted(jobId);
                     }}
                 }} catch (err) {{
                     // 静默处理错误
@@ -159,10 +192,29 @@ def get_master_poller_html(jobs_json: str, backend_url: str) -> str:
             }}, 3000);
         }};
 
-        // 遍历所有任务ID，为每一个启动轮询，并传入其详细信息
-        jobIds.forEach(jobId => {{
-            startPollingForJob(jobId, jobsData[jobId]);
+        const startPolling = () => {{
+            jobIds.filter(jobId => !finishedJobs.has(jobId)).forEach(startPollingForJob);
+        }};
+
+        if (!window.EventSource) {{
+            startPolling();
+            return;
+        }}
+
+        // 一条连接订阅所有任务，任务完成时后端立即推送，不再每 3 秒拉取完整结果
+        const source = new EventSource(backend + '/ai_grading/events?job_ids=' + encodeURIComponent(jobIds.join(',')));
+        source.addEventListener('completed', (e) => {{
+            notifyCompleted(JSON.parse(e.data).job_id);
         }});
+        ['failed', 'not_found'].forEach(name => source.addEventListener(name, (e) => {{
+            finishedJobs.add(JSON.parse(e.data).job_id);
+        }}));
+        source.addEventListener('end', () => source.close());
+        source.onerror = () => {{
+            // 连接失败或中断：关闭推送，剩余任务改为轮询
+            source.close();
+            startPolling();
+        }};
 
     }})();
     </script>
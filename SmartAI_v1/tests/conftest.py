@@ -0,0 +1,144 @@
+"""
+Shared pytest setup: makes the ``backend`` package importable when the tests
+are run from the repository root or from ``SmartAI_v1``, keeps every test off
+the on-disk LLM response cache, and provides an in-process chat model that
+answers like ``backend.fake_llm`` and throwaway grading engines::
+
+    cd SmartAI_v1 && python -m pytest -q tests
+"""
+import os
+import sys
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+SMARTAI_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SMARTAI_DIR not in sys.path:
+    sys.path.insert(0, SMARTAI_DIR)
+
+
+class FakeChatModel:
+    """
+    Chat model answering every prompt with ``backend.fake_llm.build_answer``.
+
+    Args:
+        outputs: Raw completions returned first, in order, before falling back to fake_llm answers
+        latency: Seconds each call takes before answering
+        usage: Usage metadata reported with every answer; streams send it in a
+            final content-less chunk, as OpenAI does with ``stream_usage``
+    """
+
+    model_name = "fake-llm"
+    temperature = 0.0
+
+    def __init__(self, outputs: Optional[List[str]] = None, latency: float = 0.0,
+                 usage: Optional[Dict[str, Any]] = None):
+        self.outputs = list(outputs or [])
+        self.latency = latency
+        self.usage = usage
+        self.calls = 0
+        self.started = 0
+        # Full text of every prompt answered, in call order
+        self.prompts: List[str] = []
+
+    def _answer(self, messages: List[Any]) -> str:
+        from backend.fake_llm import build_answer
+
+        self.calls += 1
+        self.prompts.append("\n".join(str(m.content) for m in messages))
+        if self.outputs:
+            return self.outputs.pop(0)
+        return build_answer([
+            {"role": "system" if getattr(m, "type", "") == "system" else "user", "content": m.content}
+            for m in messages
+        ])
+
+    async def ainvoke(self, messages: List[Any], **kwargs: Any) -> Any:
+        from langchain_core.messages import AIMessage
+
+        self.started += 1
+        await asyncio.sleep(self.latency)
+        return AIMessage(content=self._answer(messages), usage_metadata=self.usage)
+
+    async def astream(self, messages: List[Any], **kwargs: Any):
+        from langchain_core.messages import AIMessageChunk
+
+        self.started += 1
+        await asyncio.sleep(self.latency)
+        content = self._answer(messages)
+        for start in range(0, len(content), 64):
+            yield AIMessageChunk(content=content[start:start + 64])
+        if self.usage is not None:
+            yield AIMessageChunk(content="", usage_metadata=self.usage)
+
+
+@pytest.fixture
+def fake_chat():
+    """Factory of :class:`FakeChatModel` instances."""
+    return FakeChatModel
+
+
+def problem_store(*stems: str, answer_type: str = "概念题") -> Dict[str, Any]:
+    """Problem store with one question (q1, q2, ...) per stem."""
+    stems = stems or ("什么是栈？",)
+    return {
+        f"q{number}": {"q_id": f"q{number}", "number": str(number), "type": answer_type, "stem": stem,
+                       "criterion": "满分10分"}
+        for number, stem in enumerate(stems, 1)
+    }
+
+
+def student(stu_id: str, *contents: str, answer_type: str = "概念题") -> Dict[str, Any]:
+    """Student answering q1, q2, ... with ``contents`` (by default one answer unique to the student)."""
+    contents = contents or (f"{stu_id} 的回答",)
+    return {
+        "stu_id": stu_id,
+        "stu_name": "",
+        "stu_ans": [
+            {"q_id": f"q{number}", "number": str(number), "type": answer_type, "content": content, "flag": []}
+            for number, content in enumerate(contents, 1)
+        ],
+    }
+
+
+@pytest.fixture
+def make_problems():
+    """Factory of problem stores, see :func:`problem_store`."""
+    return problem_store
+
+
+@pytest.fixture
+def make_student():
+    """Factory of student submissions matching :func:`problem_store`, see :func:`student`."""
+    return student
+
+
+@pytest.fixture(autouse=True)
+def response_cache(tmp_path, monkeypatch):
+    """A fresh LLM response cache in the test's temporary directory."""
+    from backend.llm import calls
+    from backend.llm.cache import LLMResponseCache
+
+    cache = LLMResponseCache(path=str(tmp_path / "llm_cache.sqlite3"))
+    monkeypatch.setattr(calls, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(calls, "get_response_cache", lambda: cache)
+    return cache
+
+
+@pytest.fixture
+def grading_engine():
+    """Factory of grading engines whose workers are stopped when the test ends."""
+    from backend.correct.engine import GradingEngine
+    from backend.llm.runtime import run_sync
+
+    engines: List[Any] = []
+
+    def make(*args: Any, **kwargs: Any) -> Any:
+        engine = GradingEngine(*args, **kwargs)
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        run_sync(engine.close())
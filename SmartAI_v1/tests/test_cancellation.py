@@ -0,0 +1,109 @@
+"""
+Cancelling a single-student job stops its LLM calls and records the job as
+cancelled instead of filing error corrections for the unfinished answers.
+"""
+import time
+import threading
+import concurrent.futures
+
+import pytest
+
+from backend.correct.scheduler import grading_job, INTERACTIVE
+from backend.jobs.results import ResultStore
+from backend.llm.runtime import submit, run_sync
+
+@pytest.fixture
+def problems(make_problems):
+    return make_problems("什么是栈？", "什么是队列？")
+
+
+@pytest.fixture
+def submission(make_student):
+    return make_student("s1", "后进先出", "先进先出")
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_grade_student_propagates_cancellation(fake_chat, grading_engine, problems, submission):
+    engine = grading_engine(concurrency=4)
+    llm = fake_chat(latency=30)
+    with grading_job("cancel-engine", INTERACTIVE):
+        future = submit(engine.grade_student(submission, problems, llm))
+    wait_until(lambda: llm.started == 2)
+
+    engine.queue.cancel_job("cancel-engine")
+    with pytest.raises(concurrent.futures.CancelledError):
+        future.result(timeout=5)
+    assert llm.calls == 0
+
+
+def test_grade_student_without_cancellation_grades_every_answer(fake_chat, grading_engine, problems, submission):
+    engine = grading_engine(concurrency=4)
+    with grading_job("plain", INTERACTIVE):
+        result = submit(engine.grade_student(submission, problems, fake_chat())).result(timeout=10)
+    assert [correction.q_id for correction in result["corrections"]] == ["q1", "q2"]
+
+
+def test_closing_the_queue_cancels_running_and_queued_tasks(fake_chat, grading_engine, problems, submission):
+    engine = grading_engine(concurrency=1)
+    llm = fake_chat(latency=30)
+    with grading_job("closing", INTERACTIVE):
+        future = submit(engine.grade_student(submission, problems, llm))
+    # One answer runs on the single worker, the other waits in the queue
+    wait_until(lambda: llm.started == 1)
+
+    run_sync(engine.close())
+    with pytest.raises(concurrent.futures.CancelledError):
+        future.result(timeout=5)
+    assert llm.calls == 0
+    snapshot = engine.queue.snapshot()
+    assert snapshot["queue_depth"] == 0
+    assert snapshot["busy_workers"] == 0
+
+
+def test_cancelled_single_student_job_is_recorded_as_cancelled(fake_chat, monkeypatch, tmp_path, problems, submission):
+    from backend.routers import ai_grading
+
+    llm = fake_chat(latency=30)
+    results = ResultStore(spill_dir=str(tmp_path / "results"))
+    monkeypatch.setattr(ai_grading, "GRADING_RESULTS", results)
+    monkeypatch.setattr(ai_grading, "GRADING_DURABLE_JOBS", False)
+    monkeypatch.setattr(ai_grading, "get_llm", lambda: llm)
+
+    job_id = "cancel-single"
+    results[job_id] = {"status": "pending"}
+    worker = threading.Thread(target=ai_grading.run_grading_task, args=(job_id, "s1", problems, {"s1": submission}))
+    worker.start()
+    wait_until(lambda: llm.started == 2)
+
+    assert ai_grading.cancel_grading(job_id)["cancelled"]
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert results[job_id] == {"status": "cancelled"}
+    assert llm.calls == 0
+
+
+@pytest.mark.parametrize("batch", [False, True])
+def test_late_cancel_is_not_overwritten_by_the_finished_job(fake_chat, monkeypatch, tmp_path, problems, submission,
+                                                            batch):
+    from backend.routers import ai_grading
+
+    results = ResultStore(spill_dir=str(tmp_path / "results"))
+    monkeypatch.setattr(ai_grading, "GRADING_RESULTS", results)
+    monkeypatch.setattr(ai_grading, "GRADING_DURABLE_JOBS", False)
+    monkeypatch.setattr(ai_grading, "get_llm", fake_chat)
+
+    # The cancel request lands after the last answer was graded, before the result is stored
+    job_id = f"late-cancel-{batch}"
+    results[job_id] = {"status": "cancelled"}
+    if batch:
+        ai_grading.run_batch_grading_task(job_id, problems, {"s1": submission})
+    else:
+        ai_grading.run_grading_task(job_id, "s1", problems, {"s1": submission})
+
+    assert results[job_id] == {"status": "cancelled"}
@@ -0,0 +1,69 @@
+"""
+Grading nodes driven through the engine with the fake LLM model.
+"""
+import os
+import json
+import asyncio
+
+import pytest
+
+
+from conftest import SMARTAI_DIR
+
+NODE_TYPES = ["概念题", "计算题", "证明题", "编程题"]
+# Complete JSON, but without the score GradingOutput requires
+INVALID = '{"comment": "没有分数"}'
+
+
+def problem_store(answer_type):
+    return {"q1": {"q_id": "q1", "number": "1", "type": answer_type, "stem": "题目", "criterion": "满分10分"}}
+
+
+def grade(grading_engine, llm, answer_type, content="学生的解答"):
+    answer = {"q_id": "q1", "number": "1", "type": answer_type, "content": content, "flag": []}
+    return asyncio.run(grading_engine(concurrency=2).grade_answer(answer, problem_store(answer_type), llm))
+
+
+@pytest.mark.parametrize("answer_type", NODE_TYPES)
+def test_invalid_llm_output_scores_zero_for_review(fake_chat, grading_engine, answer_type):
+    correction = grade(grading_engine, fake_chat(outputs=[INVALID] * 4), answer_type)
+    assert correction.score == 0.0
+    assert correction.confidence == 0.0
+    assert "人工复核" in correction.comment
+    assert correction.type == answer_type
+
+
+@pytest.mark.parametrize("answer_type", NODE_TYPES)
+def test_valid_llm_output_is_used(fake_chat, grading_engine, answer_type):
+    valid = json.dumps({"score": 7.0, "max_score": 10.0, "confidence": 0.9, "comment": "基本正确", "steps": []})
+    correction = grade(grading_engine, fake_chat(outputs=[valid]), answer_type)
+    assert correction.score == 7.0
+    assert correction.confidence == 0.9
+
+
+@pytest.mark.parametrize("answer_type", ["概念题", "计算题"])
+def test_prompt_prefix_is_shared_and_ends_with_the_student_answer(fake_chat, grading_engine, monkeypatch, answer_type):
+    # The node templates are looked up relative to SmartAI_v1
+    monkeypatch.chdir(SMARTAI_DIR)
+    problems = {"q1": {"q_id": "q1", "number": "1", "type": answer_type, "stem": "计算 12 × 34 并说明理由",
+                       "answer": "408", "criterion": "结果正确得10分"}}
+    students = [
+        {"stu_id": stu_id, "stu_name": "", "stu_ans": [
+            {"q_id": "q1", "number": "1", "type": answer_type, "content": content, "flag": []}]}
+        for stu_id, content in (("s1", "答案是 408，因为 12×34=408"), ("s2", "418"))
+    ]
+    llm = fake_chat()
+    asyncio.run(grading_engine(concurrency=2).grade_students(students, problems, llm, dedup=False))
+
+    assert len(llm.prompts) == 2
+    assert all("计算 12 × 34 并说明理由" in prompt for prompt in llm.prompts)
+    # The student answer is the last block of its prompt
+    for student in students:
+        content = student["stu_ans"][0]["content"]
+        assert sum(prompt.rstrip().endswith(content) for prompt in llm.prompts) == 1
+    if answer_type == "计算题":
+        assert all("408" in prompt.split("学生解答")[0] for prompt in llm.prompts)
+    # Everything before the answers is identical, so the provider can cache it
+    first, second = llm.prompts
+    shared = len(os.path.commonprefix([first, second]))
+    assert first[:shared].rstrip().endswith("学生解答：")
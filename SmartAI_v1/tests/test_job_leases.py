@@ -0,0 +1,158 @@
+"""
+Task leases of the durable job store: expiry, renewal, attempt limits and
+recovery of a crashed worker's tasks.
+"""
+import os
+import sys
+import time
+import threading
+import subprocess
+
+import pytest
+
+from backend.jobs import store as store_module
+from backend.jobs.store import JobStore, PENDING, RUNNING, DONE, FAILED
+from backend.jobs.runner import JobWorker, worker_name, worker_role_prefix, worker_is_alive
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class Clock:
+    """Stands in for the ``time`` module of the store, so leases expire without waiting."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(store_module, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return JobStore(path=str(tmp_path / "jobs.sqlite3"), lease_seconds=60, max_attempts=2)
+
+
+def test_expired_lease_is_claimed_by_another_worker(store, clock, make_problems, make_student):
+    store.create_job("job", "batch", {}, make_problems(), [make_student("s1")])
+    [task] = store.claim_tasks("crashed", 10)
+    assert store.claim_tasks("healthy", 10) == []
+
+    clock.advance(61)
+    [again] = store.claim_tasks("healthy", 10)
+    assert again["task_id"] == task["task_id"]
+    assert again["attempts"] == 2
+
+    # The first worker lost the task: its late result is dropped
+    assert not store.complete_task(task["task_id"], "crashed", "job", "s1", {"corrections": []})
+    assert store.complete_task(again["task_id"], "healthy", "job", "s1", {"corrections": []})
+    assert store.result_count("job") == 1
+    assert store.finish_job_if_done("job") == "completed"
+
+
+def test_renewed_lease_does_not_expire(store, clock, make_problems, make_student):
+    store.create_job("job", "batch", {}, make_problems(), [make_student("s1")])
+    [task] = store.claim_tasks("worker", 10)
+    clock.advance(50)
+    store.renew_leases("worker", [task["task_id"]])
+    clock.advance(50)
+    assert store.claim_tasks("other", 10) == []
+    assert store.job("job")["tasks"][RUNNING] == 1
+
+
+def test_task_fails_after_max_attempts_of_expired_leases(store, clock, make_problems, make_student):
+    store.create_job("job", "batch", {}, make_problems(), [make_student("s1")])
+    for _ in range(2):
+        assert store.claim_tasks("crashing", 10)
+        clock.advance(61)
+    assert store.claim_tasks("crashing", 10) == []
+    assert store.job("job")["tasks"][FAILED] == 1
+    assert store.failed_tasks("job") == [{"student_id": "s1", "error": "lease expired"}]
+    assert store.finish_job_if_done("job") == "error"
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_restarted_worker_recovers_the_tasks_of_its_dead_incarnation(store, clock, make_problems, make_student):
+    store.create_job("job", "batch", {}, make_problems(), [make_student("s1"), make_student("s2")])
+    crashed = worker_name("api").rsplit(":", 1)[0] + f":{dead_pid()}"
+    assert len(store.claim_tasks(crashed, 10)) == 2
+    # Leases still valid, but the claiming process is gone
+    assert store.recover(worker_prefix=worker_role_prefix(crashed), is_alive=worker_is_alive) == 2
+    assert store.job("job")["tasks"][PENDING] == 2
+
+
+def test_recover_leaves_live_sibling_workers_alone(store, clock, make_problems, make_student):
+    # Two API processes on one host (uvicorn --workers 2) share the role prefix
+    first = worker_name("api")
+    sibling = first.rsplit(":", 1)[0] + f":{os.getppid()}"
+    assert worker_role_prefix(first) == worker_role_prefix(sibling)
+    store.create_job("job", "batch", {}, make_problems(), [make_student("s1"), make_student("s2")])
+    assert len(store.claim_tasks(sibling, 1)) == 1
+    assert len(store.claim_tasks(first, 1)) == 1
+
+    # The first process restarts its embedded worker
+    assert store.recover(worker_prefix=worker_role_prefix(first), is_alive=worker_is_alive) == 0
+    assert store.job("job")["tasks"][RUNNING] == 2
+    assert store.claim_tasks(worker_name("api"), 10) == []
+
+
+def test_worker_stops_holding_a_task_it_lost(store, clock, fake_chat, grading_engine, make_problems, make_student):
+    store.create_job("job", "batch", {}, make_problems(), [make_student("s1")])
+    worker = JobWorker(store, grading_engine(concurrency=1), lambda: fake_chat(latency=1.0), "slow")
+    grading = threading.Thread(target=worker.run_once)
+    grading.start()
+    wait_until(lambda: store.job("job")["tasks"][RUNNING] == 1)
+
+    clock.advance(61)
+    [stolen] = store.claim_tasks("thief", 10)
+    assert store.renew_leases("slow", [stolen["task_id"]]) == []
+    grading.join(timeout=10)
+
+    # The slow worker's result was refused and the thief's claim left untouched
+    assert store.result_count("job") == 0
+    assert store.job("job")["tasks"][RUNNING] == 1
+    assert store.complete_task(stolen["task_id"], "thief", "job", "s1", {"corrections": []})
+
+
+def test_released_tasks_keep_their_attempt(store, clock, make_problems, make_student):
+    store.create_job("job", "batch", {}, make_problems(), [make_student("s1")])
+    [task] = store.claim_tasks("worker", 10)
+    store.release_tasks("worker", [task["task_id"]])
+    [again] = store.claim_tasks("worker", 10)
+    assert again["attempts"] == 1
+
+
+def test_worker_grades_the_tasks_of_a_crashed_worker(store, clock, fake_chat, grading_engine, make_problems,
+                                                     make_student):
+    store.create_job("job", "batch", {"dedup": True}, make_problems(), [make_student("s1"), make_student("s2")])
+    assert len(store.claim_tasks("crashed", 10)) == 2
+    clock.advance(61)
+
+    done = []
+    worker = JobWorker(store, grading_engine(concurrency=4), fake_chat, "healthy",
+                       on_job_done=lambda job_id, status: done.append((job_id, status)))
+    assert worker.run_once() == 2
+
+    assert done == [("job", "completed")]
+    assert store.job("job")["tasks"][DONE] == 2
+    results = store.results("job")
+    assert [result["student_id"] for result in results] == ["s1", "s2"]
+    assert all(len(result["corrections"]) == 1 for result in results)
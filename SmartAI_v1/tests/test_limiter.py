@@ -0,0 +1,97 @@
+"""
+AIMD behaviour of the process-wide LLM rate limiter.
+"""
+import asyncio
+
+from backend.llm.limiter import AdaptiveRateLimiter, is_throttling_error
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(status_code)
+        self.status_code = status_code
+
+
+def acquire(limiter, tokens=0):
+    return asyncio.run(limiter.acquire(tokens))
+
+
+def test_throttling_halves_the_concurrency_limit():
+    limiter = AdaptiveRateLimiter(initial_concurrency=16, decrease_cooldown=0.0)
+    limiter.release(acquire(limiter), "throttled")
+    assert limiter.snapshot()["concurrency_limit"] == 8
+    limiter.release(acquire(limiter), "throttled")
+    assert limiter.snapshot()["concurrency_limit"] == 4
+    assert limiter.snapshot()["stats"]["throttled"] == 2
+
+
+def test_backoff_never_goes_below_the_minimum():
+    limiter = AdaptiveRateLimiter(initial_concurrency=4, min_concurrency=2, decrease_cooldown=0.0)
+    for _ in range(5):
+        limiter.release(acquire(limiter), "throttled")
+    assert limiter.snapshot()["concurrency_limit"] == 2
+
+
+def test_burst_of_429s_within_the_cooldown_counts_once():
+    limiter = AdaptiveRateLimiter(initial_concurrency=16, decrease_cooldown=60.0)
+    tickets = [acquire(limiter) for _ in range(5)]
+    for ticket in tickets:
+        limiter.release(ticket, "throttled")
+    snapshot = limiter.snapshot()
+    assert snapshot["concurrency_limit"] == 8
+    assert snapshot["stats"]["throttled"] == 5
+
+
+def test_successes_grow_the_limit_additively_up_to_the_maximum():
+    limiter = AdaptiveRateLimiter(initial_concurrency=4, max_concurrency=6)
+    # About one slot per limit's worth of successes
+    for _ in range(4):
+        limiter.release(acquire(limiter), "success")
+    assert limiter.snapshot()["concurrency_limit"] == 4
+    assert limiter.snapshot()["concurrency_limit_exact"] > 4.9
+    for _ in range(100):
+        limiter.release(acquire(limiter), "success")
+    assert limiter.snapshot()["concurrency_limit"] == 6
+
+
+def test_recovers_after_backoff():
+    limiter = AdaptiveRateLimiter(initial_concurrency=8, decrease_cooldown=0.0)
+    limiter.release(acquire(limiter), "throttled")
+    assert limiter.snapshot()["concurrency_limit"] == 4
+    for _ in range(20):
+        limiter.release(acquire(limiter), "success")
+    assert limiter.snapshot()["concurrency_limit"] >= 7
+
+
+def test_errors_do_not_change_the_limit():
+    limiter = AdaptiveRateLimiter(initial_concurrency=8)
+    limiter.release(acquire(limiter), "error")
+    assert limiter.snapshot()["concurrency_limit_exact"] == 8
+    assert limiter.snapshot()["stats"]["failed"] == 1
+
+
+def test_acquire_waits_for_a_free_slot():
+    limiter = AdaptiveRateLimiter(initial_concurrency=1, max_concurrency=1)
+
+    async def scenario():
+        first = await limiter.acquire()
+        second = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0.1)
+        assert not second.done()
+        limiter.release(first)
+        ticket = await asyncio.wait_for(second, timeout=1.0)
+        assert ticket.waited > 0
+
+    asyncio.run(scenario())
+
+
+def test_throttling_errors_are_recognised():
+    assert is_throttling_error(RateLimitError())
+    assert is_throttling_error(HTTPError(429))
+    assert is_throttling_error(HTTPError(503))
+    assert not is_throttling_error(HTTPError(400))
+    assert not is_throttling_error(ValueError("bad json"))
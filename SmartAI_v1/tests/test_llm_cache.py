@@ -0,0 +1,72 @@
+"""
+The LLM response cache only stores and replays outputs that pass the caller's
+schema validation.
+"""
+import json
+import asyncio
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from backend.models import GradingOutput
+from backend.llm.cache import is_cacheable_output, make_cache_key
+from backend.llm.structured import astructured_llm, parse_structured, StructuredOutputError
+
+MESSAGES = [HumanMessage(content="请批改：1+1=2")]
+VALID = json.dumps({"score": 8.0, "max_score": 10.0, "confidence": 0.9, "comment": "正确", "steps": []})
+
+
+def grade(llm, max_reasks=0):
+    return asyncio.run(astructured_llm(llm, list(MESSAGES), GradingOutput, max_reasks=max_reasks))
+
+
+def test_valid_output_is_replayed_from_the_cache(fake_chat, response_cache):
+    llm = fake_chat()
+    first = grade(llm)
+    second = grade(llm)
+    assert llm.calls == 1
+    assert second == first
+    assert response_cache.stats()["entries"] == 1
+    assert response_cache.stats()["hits"] == 1
+
+
+def test_output_failing_the_schema_is_not_cached(fake_chat, response_cache):
+    # Valid JSON, but without the required score
+    llm = fake_chat(outputs=['{"comment": "没有分数"}', VALID])
+    with pytest.raises(StructuredOutputError):
+        grade(llm)
+    assert response_cache.stats()["entries"] == 0
+    assert grade(llm).score == 8.0
+    assert llm.calls == 2
+
+
+def test_reask_recovers_and_only_the_valid_answer_is_replayed(fake_chat, response_cache):
+    llm = fake_chat(outputs=['{"comment": "没有分数"}', VALID])
+    assert grade(llm, max_reasks=1).score == 8.0
+    assert llm.calls == 2
+    assert response_cache.stats()["entries"] == 1
+    # The invalid first answer was never cached, so the same request goes to the model again
+    grade(llm, max_reasks=1)
+    assert llm.calls == 3
+    assert response_cache.stats()["entries"] == 2
+
+
+def test_stale_invalid_entry_is_dropped_and_asked_again(fake_chat, response_cache):
+    llm = fake_chat(outputs=[VALID])
+    key = make_cache_key(llm, MESSAGES, GradingOutput)
+    # Stored before responses were validated
+    response_cache.put(key, '{"score": "eight"}')
+    assert grade(llm).score == 8.0
+    assert llm.calls == 1
+    assert response_cache.get(key) == VALID
+
+
+def test_is_cacheable_output():
+    validate = lambda text: parse_structured(text, GradingOutput)
+    assert is_cacheable_output(VALID, validate)
+    assert not is_cacheable_output('{"comment": "没有分数"}', validate)
+    assert not is_cacheable_output("score: 8", validate)
+    # Without a validator the whole output must be JSON
+    assert is_cacheable_output('{"a": 1}')
+    assert not is_cacheable_output('前言 {"a": 1}')
+    assert not is_cacheable_output(None)
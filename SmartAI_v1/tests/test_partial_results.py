@@ -0,0 +1,76 @@
+"""
+Partial results of in-memory batch jobs (``GRADING_DURABLE_JOBS=0``): the
+``since`` cursor counts students in completion order and stays valid after
+the job finishes.
+"""
+import time
+import threading
+
+import pytest
+
+from backend.jobs.results import ResultStore
+from backend.routers import ai_grading
+
+def graded(stu_id):
+    return {"student_id": stu_id, "corrections": []}
+
+
+@pytest.fixture
+def results(monkeypatch, tmp_path):
+    store = ResultStore(spill_dir=str(tmp_path / "results"))
+    monkeypatch.setattr(ai_grading, "GRADING_RESULTS", store)
+    monkeypatch.setattr(ai_grading, "GRADING_DURABLE_JOBS", False)
+    monkeypatch.setattr(ai_grading, "LEGACY_PARTIAL_RESULTS", {})
+    monkeypatch.setattr(ai_grading, "LEGACY_COMPLETION_ORDER", type(ai_grading.LEGACY_COMPLETION_ORDER)())
+    return store
+
+
+def test_cursor_stays_valid_when_the_job_finishes(results):
+    results["job"] = {"status": "pending"}
+    ai_grading.LEGACY_PARTIAL_RESULTS["job"] = [graded("s3"), graded("s1")]
+
+    first = ai_grading.partial_result_from_memory("job")
+    assert [r["student_id"] for r in first["results"]] == ["s3", "s1"]
+    assert first["cursor"] == 2
+
+    # Finished: the final result lists students in input order, the cursor still counts completion order
+    ai_grading.LEGACY_PARTIAL_RESULTS.pop("job")
+    ai_grading.LEGACY_COMPLETION_ORDER["job"] = ["s3", "s1", "s2"]
+    results["job"] = {"status": "completed", "results": [graded("s1"), graded("s2"), graded("s3")]}
+
+    rest = ai_grading.partial_result_from_memory("job", since=first["cursor"])
+    assert rest["status"] == "completed"
+    assert [r["student_id"] for r in rest["results"]] == ["s2"]
+    assert rest["cursor"] == 3
+    assert ai_grading.partial_result_from_memory("job", since=3)["results"] == []
+
+
+def test_single_student_job(results):
+    results["job"] = {"status": "completed", "student_id": "s1", "corrections": [{"q_id": "q1"}]}
+    partial = ai_grading.partial_result_from_memory("job")
+    assert partial["results"] == [{"student_id": "s1", "corrections": [{"q_id": "q1"}]}]
+    assert ai_grading.partial_result_from_memory("unknown") is None
+
+
+def test_batch_job_pages_every_student_once(results, fake_chat, make_problems, make_student, monkeypatch):
+    llm = fake_chat(latency=0.05)
+    monkeypatch.setattr(ai_grading, "get_llm", lambda: llm)
+    students = {f"s{n}": make_student(f"s{n}") for n in range(6)}
+    results["job"] = {"status": "pending"}
+
+    worker = threading.Thread(target=ai_grading.run_batch_grading_task, args=("job", make_problems(), students))
+    worker.start()
+    seen, cursor = [], 0
+    while True:
+        partial = ai_grading.partial_result_from_memory("job", since=cursor)
+        seen += [r["student_id"] for r in partial["results"]]
+        cursor = partial["cursor"]
+        if partial["status"] in ai_grading.FINAL_STATUSES:
+            break
+        time.sleep(0.01)
+    worker.join(timeout=5)
+
+    assert partial["status"] == "completed"
+    assert sorted(seen) == sorted(students)
+    assert cursor == len(students)
+    assert "job" not in ai_grading.LEGACY_PARTIAL_RESULTS
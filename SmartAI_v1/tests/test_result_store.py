@@ -0,0 +1,100 @@
+"""
+Memory budget of the result store: finished results spill to disk, come back
+on the next read, and spilled jobs beyond the index limit are found by file name.
+"""
+import os
+import time
+import gzip
+
+import orjson
+
+from backend.jobs.results import ResultStore
+
+
+def finished(i, students=40):
+    return {
+        "status": "completed",
+        "results": [{"student_id": f"s{n}", "corrections": [{"q_id": "q1", "score": float(i)}]}
+                    for n in range(students)],
+    }
+
+
+def spill_files(store):
+    return sorted(name for name in os.listdir(store.spill_dir) if name.endswith(".json.gz"))
+
+
+def test_results_over_the_budget_spill_and_reload(tmp_path):
+    store = ResultStore(max_bytes=1, spill_dir=str(tmp_path))
+    for i in range(3):
+        store[f"job{i}"] = finished(i)
+    # Only the most recently stored result stays in memory
+    assert spill_files(store) == ["job0.json.gz", "job1.json.gz"]
+    assert store.snapshot()["in_memory"] == 1
+
+    assert store.get("job0") == orjson.loads(orjson.dumps(finished(0)))
+    assert store.snapshot()["loads"] == 1
+    # The spilled bytes are the stored gzip form, served as they are
+    body, etag = store.payload("job1", "gzip")
+    assert orjson.loads(gzip.decompress(body))["results"][0]["corrections"][0]["score"] == 1.0
+    assert etag == store.etag("job1")
+
+
+def test_idle_results_spill_within_the_budget(tmp_path):
+    store = ResultStore(ttl_seconds=0.05, spill_dir=str(tmp_path))
+    store["job"] = finished(0)
+    time.sleep(0.1)
+    store["other"] = {"status": "running"}
+    assert spill_files(store) == ["job.json.gz"]
+    assert store.snapshot()["memory_bytes"] == 0
+    assert store.get("job")["status"] == "completed"
+
+
+def test_running_results_stay_live(tmp_path):
+    store = ResultStore(max_bytes=1, spill_dir=str(tmp_path))
+    progress = {"status": "running", "progress": {"done": 1}}
+    store["job"] = progress
+    store["done"] = finished(0)
+    assert store.get("job") is progress
+
+
+def test_spilled_jobs_beyond_the_index_limit_are_found_by_file_name(tmp_path):
+    store = ResultStore(max_bytes=1, spill_dir=str(tmp_path), max_indexed=2)
+    for i in range(6):
+        store[f"job{i}"] = finished(i)
+    assert len(store) == 3
+    assert set(store.statuses()) == {"job3", "job4", "job5"}
+    assert store.snapshot()["unindexed"] == 3
+
+    assert "job0" in store
+    assert store.etag("job0") is not None
+    assert store.get("job0")["results"][0]["corrections"][0]["score"] == 0.0
+    assert "job0" in store.statuses()
+    assert len(store) == 3
+
+
+def test_results_survive_a_restart(tmp_path):
+    store = ResultStore(max_bytes=1, spill_dir=str(tmp_path))
+    store["job0"] = finished(0)
+    store["job1"] = finished(1)
+    etag = store.etag("job0")
+
+    restarted = ResultStore(spill_dir=str(tmp_path))
+    assert restarted.etag("job0") == etag
+    assert restarted.get("job0")["status"] == "completed"
+
+
+def test_pop_deletes_the_spilled_file(tmp_path):
+    store = ResultStore(max_bytes=1, spill_dir=str(tmp_path), max_indexed=0)
+    store["job0"] = finished(0)
+    store["job1"] = finished(1)
+    assert "job0" not in store.statuses()
+    assert store.pop("job0")["status"] == "completed"
+    assert "job0" not in store
+    assert "job0.json.gz" not in spill_files(store)
+
+
+def test_unsafe_job_ids_never_touch_the_disk(tmp_path):
+    store = ResultStore(spill_dir=str(tmp_path))
+    assert store.get("../secrets") is None
+    assert store.etag("../secrets") is None
+    assert "../secrets" not in store
@@ -0,0 +1,88 @@
+"""
+Longest-first scheduling: the task cost model, makespan estimates, the
+engine's queue order and the durable store's claim order.
+"""
+import asyncio
+
+import pytest
+
+from backend.correct.cost import TaskCostModel, list_schedule, schedule_estimate
+from backend.jobs.store import JobStore
+
+
+def test_cost_model_learns_a_per_type_scale():
+    model = TaskCostModel(alpha=0.5)
+    prior = TaskCostModel.prior("proof", 1000)
+    assert model.estimate("proof", 1000) == pytest.approx(prior)
+    model.observe("proof", 1000, 2 * prior)
+    assert model.estimate("proof", 1000) == pytest.approx(2 * prior)
+    model.observe("proof", 1000, prior)
+    assert model.estimate("proof", 1000) == pytest.approx(1.5 * prior)
+    # Other types keep their prior
+    assert model.estimate("concept", 1000) == pytest.approx(TaskCostModel.prior("concept", 1000))
+    assert model.snapshot() == {"proof": {"scale": 1.5, "samples": 2}}
+
+
+def test_longest_first_shortens_the_makespan():
+    costs = [1, 1, 1, 1, 1, 1, 6]
+    assert list_schedule(costs, 2) == 9
+    assert list_schedule(sorted(costs, reverse=True), 2) == 6
+    assert list_schedule([], 4) == 0.0
+
+
+def test_schedule_estimate_caps_the_eta_at_the_deadline():
+    estimate = schedule_estimate([4, 4, 4, 4], 2, "longest", deadline_seconds=5)
+    assert estimate["makespan_seconds"] == 8
+    assert estimate["lower_bound_seconds"] == 8
+    assert estimate["eta_seconds"] == 5
+    assert estimate["meets_deadline"] is False
+    assert schedule_estimate([4, 4], 2, "longest", deadline_seconds=5)["meets_deadline"] is True
+    assert schedule_estimate([4], 2, "student")["deadline_seconds"] is None
+
+
+def test_engine_queues_the_longest_answers_first(fake_chat, grading_engine):
+    problems = {"q1": {"q_id": "q1", "number": "1", "type": "概念题", "stem": "题目", "criterion": "满分10分"}}
+    lengths = {"short": 10, "long": 3000, "medium": 500}
+    students = [
+        {"stu_id": stu_id, "stu_name": "", "stu_ans": [
+            {"q_id": "q1", "number": "1", "type": "概念题", "content": stu_id * length, "flag": []}]}
+        for stu_id, length in lengths.items()
+    ]
+    llm = fake_chat()
+    planned = []
+    engine = grading_engine(concurrency=1, cost_model=TaskCostModel())
+    asyncio.run(engine.grade_students(students, problems, llm, order="longest", on_planned=planned.append))
+
+    graded = [max(lengths, key=lambda stu_id: prompt.count(stu_id)) for prompt in llm.prompts]
+    assert graded == ["long", "medium", "short"]
+    [schedule] = planned
+    assert schedule["order"] == "longest"
+    assert schedule["tasks"] == 3
+    assert schedule["workers"] == 1
+
+
+def test_store_claims_the_costliest_students_first(tmp_path):
+    store = JobStore(path=str(tmp_path / "jobs.sqlite3"))
+    students = [{"stu_id": stu_id, "stu_ans": []} for stu_id in ("s1", "s2", "s3", "s4")]
+    store.create_or_join_job("job", "batch", {"order": "longest"}, {}, students,
+                             costs={"s1": 1.0, "s2": 9.0, "s3": 5.0, "s4": 3.0})
+    first = store.claim_tasks("worker", 2)
+    second = store.claim_tasks("worker", 2)
+    assert [task["student_id"] for task in first] == ["s2", "s3"]
+    assert [task["student_id"] for task in second] == ["s4", "s1"]
+
+
+def test_claim_schedule_is_kept_in_progress(tmp_path):
+    store = JobStore(path=str(tmp_path / "jobs.sqlite3"))
+    store.create_job("job", "batch", {"deadline_seconds": 600}, {}, [{"stu_id": "s1", "stu_ans": []}])
+    [task] = store.claim_tasks("worker", 10)
+    schedule = schedule_estimate([3.0], 4, "longest", 600)
+    store.set_schedule("job", dict(schedule, students=1))
+    assert store.progress("job")["schedule"]["eta_seconds"] == 3.0
+
+    store.complete_task(task["task_id"], "worker", "job", "s1", {"corrections": []})
+    assert store.finish_job_if_done("job", {"dedup": {"answers": 0}}) == "completed"
+    progress = store.progress("job")
+    assert progress["schedule"]["students"] == 1
+    assert progress["deadline_seconds"] == 600
+    assert progress["meets_deadline"] is True
@@ -0,0 +1,49 @@
+"""
+Streamed calls record the token usage the provider reports after the JSON
+object, not an estimate.
+"""
+import json
+import asyncio
+
+from langchain_core.messages import HumanMessage
+
+from backend.models import GradingOutput
+from backend.llm.calls import astream_llm
+from backend.llm.metrics import LLMCallLedger, tag_calls
+
+VALID = json.dumps({"score": 8.0, "max_score": 10.0, "confidence": 0.9, "comment": "正确", "steps": []})
+USAGE = {"input_tokens": 1200, "output_tokens": 40, "total_tokens": 1240, "input_token_details": {"cache_read": 1024}}
+
+
+def stream(llm):
+    async def call():
+        with tag_calls(job_id="job"):
+            return await astream_llm(llm, [HumanMessage(content="请批改：1+1=2")], GradingOutput)
+    return asyncio.run(call())
+
+
+def test_streamed_call_records_the_provider_usage(fake_chat, monkeypatch):
+    from backend.llm import calls
+
+    ledger = LLMCallLedger()
+    monkeypatch.setattr(calls, "get_call_ledger", lambda: ledger)
+
+    response = stream(fake_chat(outputs=[VALID], usage=USAGE))
+
+    assert response.usage_metadata == USAGE
+    total = ledger.summary("job")["total"]
+    assert total["prompt_tokens"] == 1200
+    assert total["completion_tokens"] == 40
+    assert total["cached_prompt_tokens"] == 1024
+    assert total["estimated_token_calls"] == 0
+
+
+def test_stream_without_usage_chunk_is_estimated(fake_chat, monkeypatch):
+    from backend.llm import calls
+
+    ledger = LLMCallLedger()
+    monkeypatch.setattr(calls, "get_call_ledger", lambda: ledger)
+
+    stream(fake_chat(outputs=[VALID]))
+
+    assert ledger.summary("job")["total"]["estimated_token_calls"] == 1
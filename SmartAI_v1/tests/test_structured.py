@@ -0,0 +1,26 @@
+"""
+Repair of LaTeX backslashes in LLM JSON output leaves valid escapes intact.
+"""
+import pytest
+
+from backend.llm.structured import extract_json_object, StructuredOutputError
+
+
+@pytest.mark.parametrize("escaped, decoded", [
+    (r"\\frac{1}{2}", r"\frac{1}{2}"),
+    (r"第一行\n第二行", "第一行\n第二行"),
+    (r"记作 \"α\"", '记作 "α"'),
+    (r"\u03b1", "α"),
+])
+def test_valid_escapes_survive_the_repair_of_an_invalid_one(escaped, decoded):
+    text = '{"comment": "' + escaped + r'，且 $\alpha$ 正确"}'
+    assert extract_json_object(text) == {"comment": decoded + r"，且 $\alpha$ 正确"}
+
+
+def test_escaped_backslash_before_a_letter_is_kept():
+    assert extract_json_object(r'{"a": "\\alpha", "b": "\gamma"}') == {"a": r"\alpha", "b": r"\gamma"}
+
+
+def test_output_without_an_object_is_rejected():
+    with pytest.raises(StructuredOutputError):
+        extract_json_object("没有 JSON")